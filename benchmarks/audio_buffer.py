@@ -0,0 +1,105 @@
+"""
+Micro-benchmark of the pending-audio storage behind `vq.chunker.AudioBuffer`.
+
+Compares the old concatenate-on-every-frame storage against `vq.sound.SoundBuffer` on the same
+decode-like workload: AAC-sized frames are pushed and video-frame-sized chunks are read out.
+
+  $ python -m benchmarks.audio_buffer --seconds 600 --rate 48000 --fps 30
+"""
+from __future__ import annotations
+from typing import *
+from vq.sound import Sound, SoundBuffer
+import argparse
+import numpy as np
+import time
+import tracemalloc
+
+class ConcatenatingBuffer:
+  # The storage `AudioBuffer` used before `SoundBuffer`
+  def __init__(self, *, num_channels: int, dtype: np.dtype) -> None:
+    self.buffer = Sound.allocate(num_channels=num_channels, num_samples=0, dtype=dtype)
+
+  @property
+  def num_samples(self) -> int:
+    return self.buffer.num_samples
+
+  def push(self, samples: np.ndarray) -> None:
+    self.buffer = self.buffer + Sound(samples)
+
+  def read(self, num_samples: int) -> Sound:
+    read = self.buffer[:num_samples]
+    self.buffer = self.buffer[num_samples:]
+    return read
+
+def workload(buffer, *, seconds: float, rate: int, fps: float, frame_size: int, on_step: Callable[[], None]) -> int:
+  frame = np.random.default_rng(0).uniform(-1, 1, size=(buffer_channels(buffer), frame_size)).astype(np.float32)
+  chunk_size = rate / fps
+  last_aread = 0.0
+  num_frames = int(seconds * rate / frame_size)
+  for _ in range(num_frames):
+    buffer.push(frame)
+    on_step()
+    while True:
+      asamples = int(last_aread + chunk_size) - int(last_aread)
+      if buffer.num_samples < asamples:
+        break
+      buffer.read(asamples)
+      last_aread += chunk_size
+      on_step()
+  return num_frames
+
+def buffer_channels(buffer) -> int:
+  return buffer.buffer.num_channels if isinstance(buffer, ConcatenatingBuffer) else buffer.num_channels
+
+def measure(make_buffer: Callable[[], Any], **kwargs) -> dict:
+  # Pass 1: timing only
+  t0 = time.perf_counter()
+  num_frames = workload(make_buffer(), on_step=lambda: None, **kwargs)
+  elapsed = time.perf_counter() - t0
+
+  # Pass 2: count the steps that allocated memory, and how much
+  allocations = 0
+  allocated_bytes = 0
+  def on_step() -> None:
+    nonlocal allocations, allocated_bytes, before
+    _, peak = tracemalloc.get_traced_memory()
+    if peak > before:
+      allocations += 1
+      allocated_bytes += peak - before
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+  tracemalloc.start()
+  before, _ = tracemalloc.get_traced_memory()
+  workload(make_buffer(), on_step=on_step, **kwargs)
+  tracemalloc.stop()
+
+  return {
+    "frames_per_sec": num_frames / elapsed,
+    "allocations_per_sec": allocations / elapsed,
+    "allocated_mb_per_sec": allocated_bytes / elapsed / 2**20,
+  }
+
+def main() -> None:
+  parser = argparse.ArgumentParser("benchmarks.audio_buffer", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--seconds", type=float, default=600.0, help="Seconds of audio to push through the buffer")
+  parser.add_argument("--rate", type=int, default=48000, help="Audio sample rate")
+  parser.add_argument("--fps", type=float, default=30.0, help="Video frame rate deciding the chunk size")
+  parser.add_argument("--frame-size", type=int, default=1024, help="Samples per decoded audio frame")
+  parser.add_argument("--channels", type=int, default=2, help="Number of audio channels")
+  args = parser.parse_args()
+
+  kwargs = dict(seconds=args.seconds, rate=args.rate, fps=args.fps, frame_size=args.frame_size)
+  candidates = {
+    "concatenate": lambda: ConcatenatingBuffer(num_channels=args.channels, dtype=np.float32),
+    "ring": lambda: SoundBuffer(num_channels=args.channels, dtype=np.float32),
+  }
+  for name, make_buffer in candidates.items():
+    result = measure(make_buffer, **kwargs)
+    print(
+      f"{name:>12}: {result['frames_per_sec']:>12.0f} frames/s"
+      f" {result['allocations_per_sec']:>12.0f} allocations/s"
+      f" {result['allocated_mb_per_sec']:>10.2f} MiB/s allocated"
+    )
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,104 @@
+"""
+Benchmark of `vq.cutter.Cutter.cut_chunks` on synthetic chunks, and check that its batched dBFS computation takes
+exactly the same cut decisions as computing the dBFS of every chunk on its own. Chunks of float32 samples and of s16
+samples (as decoded from PCM or FLAC) are both checked.
+
+  $ python -m benchmarks.cutter --seconds 600 --batch-size 8
+"""
+from __future__ import annotations
+from typing import *
+from vq.chunker import Chunk, FrameStub
+from vq.cutter import Cutter, CutChunk
+from vq.sound import Sound
+import argparse
+import fractions
+import itertools
+import math
+import numpy as np
+import time
+import types
+
+# Sample formats checked, with the dBFS of full scale
+SAMPLE_FORMATS: dict[str, tuple[type, float]] = {
+  "flt": (np.float32, 0.0),
+  "s16": (np.int16, 20 * math.log10(2**15)),
+}
+
+def reference_dbfs(samples: np.ndarray) -> float:
+  # How `calculate_dbfs` used to compute dBFS, one chunk at a time, in floating point so that integers do not overflow
+  if np.issubdtype(samples.dtype, np.integer):
+    samples = samples.astype(np.float64)
+  with np.errstate(divide='ignore'):
+    power = np.max(np.square(samples))
+    return -np.inf if power == 0 else 10 * np.log10(power)
+
+def make_chunks(*, seconds: float, fps: int, rate: int, num_channels: int, dtype: type = np.float32) -> list[Chunk]:
+  """
+  Chunks alternating between speech-like noise and near silence, every ~0.1 to 2 seconds. Integer samples span their
+  whole range, the most negative value included.
+  """
+  rng = np.random.default_rng(0)
+  time_base = fractions.Fraction(1, fps)
+  num_samples = rate // fps
+  chunks = []
+  loud = True
+  remaining = 0
+  for i in range(int(seconds * fps)):
+    if remaining == 0:
+      loud = not loud
+      remaining = int(rng.integers(fps // 10, 2 * fps))
+    remaining -= 1
+    amplitude = rng.uniform(0.1, 1.0) if loud else rng.uniform(0.0, 0.05)
+    samples = rng.uniform(-1, 1, size=(num_channels, num_samples)) * amplitude
+    if np.issubdtype(dtype, np.integer):
+      info = np.iinfo(dtype)
+      samples = np.clip(np.round(samples * -info.min), info.min, info.max)
+      if loud and rng.random() < 0.1:
+        samples[0, 0] = info.min
+    samples = samples.astype(dtype)
+    chunks.append(Chunk(video_frame=FrameStub(pts=i, time_base=time_base), sound=Sound(samples)))
+  return chunks
+
+def fake_source(fps: int) -> Any:
+  return types.SimpleNamespace(video_stream=types.SimpleNamespace(average_rate=fractions.Fraction(fps)))
+
+def reference_decisions(chunks: list[Chunk], cutter: Cutter) -> list[bool]:
+  return [cutter.judge(CutChunk(video_frame=chunk.video_frame, sound=chunk.sound, dbfs=reference_dbfs(chunk.sound.samples))) for chunk in chunks]
+
+def main() -> None:
+  parser = argparse.ArgumentParser("benchmarks.cutter", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--seconds", type=float, default=600.0, help="Seconds of chunks per frame rate")
+  parser.add_argument("--rate", type=int, default=48000, help="Audio sample rate")
+  parser.add_argument("--channels", type=int, default=2, help="Number of audio channels")
+  parser.add_argument("--batch-size", type=int, default=8, help="Cutter batch size")
+  parser.add_argument("-t", "--tolerance", type=float, default=-20.0, help="Cutter tolerance")
+  parser.add_argument("-m", "--after-loud-save-duration", type=float, default=0.3, help="Cutter after loud save duration")
+  args = parser.parse_args()
+
+  for (format, (dtype, full_scale)), fps in itertools.product(SAMPLE_FORMATS.items(), [25, 30, 60]):
+    chunks = make_chunks(seconds=args.seconds, fps=fps, rate=args.rate, num_channels=args.channels, dtype=dtype)
+    # Integer samples are not normalized, so their dBFS are offset by the dBFS of their full scale
+    tolerance = args.tolerance + full_scale
+    def make_cutter(batch_size: int) -> Cutter:
+      return Cutter(fake_source(fps), tolerance=tolerance, after_loud_save_duration=args.after_loud_save_duration, batch_size=batch_size)
+
+    t0 = time.perf_counter()
+    expected = reference_decisions(chunks, make_cutter(1))
+    reference_elapsed = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    kept = {cut_chunk.video_frame.pts for cut_chunk in make_cutter(args.batch_size).cut_chunks(iter(chunks))}
+    batched_elapsed = time.perf_counter() - t0
+
+    decisions = [chunk.video_frame.pts in kept for chunk in chunks]
+    if decisions != expected:
+      mismatches = sum(a != b for a, b in zip(decisions, expected))
+      raise SystemExit(f"{format} {fps} fps: batched cut decisions differ from the reference on {mismatches} chunks")
+    print(
+      f"{format} {fps:>3} fps: reference {len(chunks) / reference_elapsed:>10.0f} chunks/s,"
+      f" batched {len(chunks) / batched_elapsed:>10.0f} chunks/s,"
+      f" {sum(decisions)}/{len(chunks)} kept, decisions identical"
+    )
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Stand-in for yt-dlp that "downloads" a local file to stdout with a flaky network, for testing
+`vq.YtdlReader` without a network. Takes the same arguments as the real command (the URL being a
+file path, or https://<any host>/<absolute file path> for `vq`, which only hands URLs to yt-dlp) and is configured through environment variables:
+
+  FAKE_YTDL_RATE           bytes per second while not stalled (default: unlimited)
+  FAKE_YTDL_STALL_EVERY    stall after every this many bytes (default: never)
+  FAKE_YTDL_STALL_SECONDS  length of each stall (default: 1.0)
+
+Used by `benchmarks.prefetch` as `vq.YtdlReader(path, command=FAKE_YTDL)`.
+"""
+import os
+import sys
+import time
+import urllib.parse
+
+CHUNK_SIZE = 2**14
+
+def main() -> None:
+  path = sys.argv[-1]
+  if path.startswith(("http://", "https://")):
+    path = urllib.parse.unquote(urllib.parse.urlsplit(path).path)
+  rate = float(os.environ.get("FAKE_YTDL_RATE", "inf"))
+  stall_every = int(os.environ.get("FAKE_YTDL_STALL_EVERY", "0"))
+  stall_seconds = float(os.environ.get("FAKE_YTDL_STALL_SECONDS", "1.0"))
+
+  out = sys.stdout.buffer
+  sent = 0
+  next_stall = stall_every
+  start = time.monotonic()
+  with open(path, "rb") as f:
+    while chunk := f.read(CHUNK_SIZE):
+      out.write(chunk)
+      out.flush()
+      sent += len(chunk)
+      if stall_every and sent >= next_stall:
+        time.sleep(stall_seconds)
+        next_stall += stall_every
+        start += stall_seconds # stalls do not count towards the rate
+      ahead = sent / rate - (time.monotonic() - start)
+      if ahead > 0:
+        time.sleep(ahead)
+
+if __name__ == "__main__":
+  try:
+    main()
+  except BrokenPipeError:
+    pass
@@ -0,0 +1,136 @@
+"""
+Synthetic audio/video clips for the benchmarks, generated locally with PyAV.
+
+Every clip alternates tone bursts and silences following `PATTERN`, so the cut decisions it should get are known in
+advance. Clips are cached in benchmarks/.fixtures and only regenerated when missing.
+"""
+from __future__ import annotations
+from typing import *
+from dataclasses import dataclass
+import av
+import fractions
+import numpy as np
+import os
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), ".fixtures")
+
+# (duration in seconds, is loud), repeated over the length of a clip
+PATTERN: list[tuple[float, bool]] = [
+  (1.0, True),
+  (0.5, False),
+  (2.0, True),
+  (1.5, False),
+  (0.25, True),
+  (3.0, False),
+  (0.75, True),
+  (1.0, False),
+]
+
+TONE_FREQUENCY = 440.0
+TONE_AMPLITUDE = 0.5 # about -6 dBFS
+RATE = 48000
+
+@dataclass(frozen=True)
+class Fixture:
+  width: int
+  height: int
+  fps: int
+  audio_codec: str
+  duration: float # in seconds
+  gop: Optional[int] = None # frames between keyframes, the encoder's default if None
+
+  @property
+  def name(self) -> str:
+    name = f"{self.height}p{self.fps}-{self.audio_codec}-{self.duration:g}s"
+    return name if self.gop is None else f"{name}-g{self.gop}"
+
+  @property
+  def path(self) -> str:
+    return os.path.join(FIXTURES_DIR, f"{self.name}.mkv")
+
+FIXTURES = [
+  Fixture(640, 360, 25, "aac", 60.0),
+  Fixture(640, 360, 30, "libopus", 60.0),
+  Fixture(1280, 720, 30, "aac", 60.0),
+  Fixture(1280, 720, 60, "libopus", 60.0),
+  Fixture(1920, 1080, 30, "aac", 60.0),
+  Fixture(1920, 1080, 60, "aac", 60.0),
+]
+
+QUICK_FIXTURES = [
+  Fixture(640, 360, 30, "aac", 20.0),
+  Fixture(1280, 720, 25, "libopus", 20.0),
+]
+
+def is_loud_at(t: float) -> bool:
+  period = sum(duration for duration, _ in PATTERN)
+  t = t % period
+  for duration, loud in PATTERN:
+    if t < duration:
+      return loud
+    t -= duration
+  return PATTERN[-1][1]
+
+def make_sound(start_sample: int, num_samples: int) -> np.ndarray:
+  """
+  (2, num_samples) float32 stereo samples of the clip's audio starting at `start_sample`.
+  """
+  t = (start_sample + np.arange(num_samples)) / RATE
+  loud = np.array([is_loud_at(x) for x in t[::480]]).repeat(480)[:num_samples] # 10ms resolution is plenty
+  wave = (np.sin(2 * np.pi * TONE_FREQUENCY * t) * TONE_AMPLITUDE * loud).astype(np.float32)
+  return np.stack([wave, wave])
+
+def make_video_frame(fixture: Fixture, index: int) -> av.VideoFrame:
+  # A moving gradient, so that the encoder has some (but not too much) work to do
+  y = ((np.arange(fixture.width)[None, :] + np.arange(fixture.height)[:, None] + 4 * index) % 256).astype(np.uint8)
+  uv = np.full((fixture.height // 2, fixture.width), 128, dtype=np.uint8)
+  return av.VideoFrame.from_ndarray(np.concatenate([y, uv]), format="yuv420p")
+
+def to_audio_frame(samples: np.ndarray, format: av.AudioFormat, layout: str) -> av.AudioFrame:
+  if not format.is_planar:
+    samples = samples.T.reshape(1, -1) # interleave channels
+  dtype = av.audio.frame.format_dtypes[format.name]
+  if np.issubdtype(dtype, np.integer):
+    samples = (samples * np.iinfo(dtype).max).astype(dtype)
+  frame = av.AudioFrame.from_ndarray(samples.astype(dtype), format=format.name, layout=layout)
+  frame.rate = RATE
+  return frame
+
+def generate(fixture: Fixture) -> None:
+  os.makedirs(FIXTURES_DIR, exist_ok=True)
+  tmp_path = fixture.path + ".tmp.mkv"
+  with av.open(tmp_path, mode="w") as container:
+    video_stream = container.add_stream("libx264", rate=fixture.fps)
+    video_stream.width = fixture.width
+    video_stream.height = fixture.height
+    video_stream.pix_fmt = "yuv420p"
+    video_options = {"preset": "ultrafast"}
+    if fixture.gop is not None:
+      video_options["g"] = str(fixture.gop)
+    video_stream.options = video_options
+    audio_stream = container.add_stream(fixture.audio_codec, rate=RATE, layout="stereo")
+    audio_context = audio_stream.codec_context
+
+    num_frames = int(fixture.duration * fixture.fps)
+    frame_size = audio_context.frame_size or 1024
+    audio_pos = 0
+    for i in range(num_frames):
+      frame = make_video_frame(fixture, i)
+      frame.pts = i
+      frame.time_base = fractions.Fraction(1, fixture.fps)
+      container.mux(video_stream.encode(frame))
+      # Keep audio interleaved with the video
+      while audio_pos < (i + 1) * RATE // fixture.fps:
+        audio_frame = to_audio_frame(make_sound(audio_pos, frame_size), audio_context.format, "stereo")
+        audio_frame.pts = audio_pos
+        audio_frame.time_base = fractions.Fraction(1, RATE)
+        container.mux(audio_stream.encode(audio_frame))
+        audio_pos += frame_size
+    container.mux(video_stream.encode(None))
+    container.mux(audio_stream.encode(None))
+  os.replace(tmp_path, fixture.path)
+
+def ensure(fixture: Fixture) -> str:
+  if not os.path.exists(fixture.path):
+    generate(fixture)
+  return fixture.path
@@ -0,0 +1,76 @@
+"""
+Benchmark of `YtdlReader` prefetching against a flaky download, simulated by `benchmarks.fake_ytdl`.
+
+A player downstream of vq reads at playback speed and, through the pipe, throttles vq to the same speed. Without
+prefetching, the download is throttled too and never gets ahead, so every network stall longer than the player's cache
+becomes a stutter. The consumer here decodes frames no earlier than a player with `--cache-secs` would need them, and
+counts the frames that arrive late (underruns) and how long playback would pause for them.
+
+  $ python -m benchmarks.prefetch --cache-secs 0.5 1 2 --stall-seconds 2
+"""
+from __future__ import annotations
+from typing import *
+from . import fixtures
+import argparse
+import av
+import os
+import sys
+import time
+import vq
+
+FAKE_YTDL = os.path.join(os.path.dirname(__file__), "fake_ytdl.py")
+
+def play(path: str, *, cache_secs: float, prefetch_size: int) -> dict:
+  reader = vq.YtdlReader(path, command=FAKE_YTDL, prefetch_size=prefetch_size)
+  underruns = 0
+  paused = 0.0
+  with reader.open() as source:
+    playback_start = None
+    for frame in source.decode():
+      if not isinstance(frame, av.VideoFrame):
+        continue
+      now = time.monotonic()
+      if playback_start is None:
+        # Playback starts once the cache is filled
+        playback_start = now + cache_secs - frame.time
+      due = playback_start + frame.time
+      if now > due:
+        underruns += 1
+        paused += now - due
+        playback_start += now - due # the player pauses until the frame arrives
+      else:
+        # Do not read ahead of what the player's cache can hold
+        time.sleep(max(0.0, due - cache_secs - now))
+  result = {"underruns": underruns, "paused_seconds": paused}
+  if reader.prefetch_stats is not None:
+    result["stalls"] = reader.prefetch_stats.stalls
+    result["max_buffered_mb"] = reader.prefetch_stats.max_buffered / 2**20
+  return result
+
+def main() -> None:
+  parser = argparse.ArgumentParser("benchmarks.prefetch", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--cache-secs", type=float, nargs="+", default=[0.5, 1.0, 2.0], help="Player cache sizes to simulate")
+  parser.add_argument("--speed", type=float, default=3.0, help="Download speed, as a multiple of the clip's bitrate")
+  parser.add_argument("--stall-every", type=float, default=4.0, help="Stall the download after every this many seconds of the clip")
+  parser.add_argument("--stall-seconds", type=float, default=2.0, help="Length of each stall")
+  parser.add_argument("--prefetch-size", type=float, default=vq.DEFAULT_PREFETCH_SIZE / 2**20, help="Prefetch size in MiB")
+  args = parser.parse_args()
+
+  fixture = fixtures.QUICK_FIXTURES[0]
+  path = fixtures.ensure(fixture)
+  bitrate = os.path.getsize(path) / fixture.duration
+  os.environ["FAKE_YTDL_RATE"] = str(bitrate * args.speed)
+  os.environ["FAKE_YTDL_STALL_EVERY"] = str(int(bitrate * args.stall_every))
+  os.environ["FAKE_YTDL_STALL_SECONDS"] = str(args.stall_seconds)
+  print(f"{fixture.name}: {bitrate * 8 / 1000:.0f}kb/s, downloaded at {args.speed}x with {args.stall_seconds}s stalls every {args.stall_every}s", file=sys.stderr)
+
+  for cache_secs in args.cache_secs:
+    for name, prefetch_size in [("pipe", 0), ("prefetch", int(args.prefetch_size * 2**20))]:
+      result = play(path, cache_secs=cache_secs, prefetch_size=prefetch_size)
+      print(
+        f"cache={cache_secs:>4g}s {name:>8}: underruns={result['underruns']:>4} paused={result['paused_seconds']:>6.2f}s"
+        + (f" stalls={result['stalls']} max_buffered={result['max_buffered_mb']:.1f}MiB" if "stalls" in result else "")
+      )
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,109 @@
+"""
+Check of the segmented ways of cutting against `vq.cut`: `vq.cut_resumable` cuts a clip with a keyframe every half
+second into half second segments, so that the longer silences of `fixtures.PATTERN` hold segments that are cut
+entirely, and must write as many frames as `vq.cut`, with increasing timestamps. `vq.cut_parallel` is checked the same
+way, with as many jobs as there are seconds of clip so that some of its segments are cut entirely too. A run at a
+tolerance that cuts everything must write an empty output rather than fail.
+
+  $ python -m benchmarks.segments
+"""
+from __future__ import annotations
+from typing import *
+from . import fixtures
+from .fixtures import Fixture
+import argparse
+import av
+import io
+import os
+import sys
+import tempfile
+import time
+import vq
+
+TOLERANCE = -20.0
+AFTER_LOUD_SAVE_DURATION = 0.3
+FIXTURE = Fixture(640, 360, 30, "aac", 20.0, gop=15)
+SEGMENT_DURATION = 0.5
+PARALLEL_JOBS = 20
+
+def cut_reference(path: str, tolerance: float) -> int:
+  # Returns the number of frames written
+  with vq.FileReader(path).open() as source, vq.HandleWriter(io.BytesIO(), format="matroska").open_like(source) as sink:
+    vq.cut(source, sink, tolerance, AFTER_LOUD_SAVE_DURATION)
+    return sink.num_video_frames
+
+def cut_resumable(path: str, output: str, tolerance: float) -> None:
+  with open(output, "wb") as handle, tempfile.TemporaryDirectory(prefix="vq-segments-") as tmpdir:
+    vq.cut_resumable(
+      vq.FileReader(path),
+      vq.HandleWriter(handle, format="matroska"),
+      tolerance,
+      AFTER_LOUD_SAVE_DURATION,
+      work_dir = os.path.join(tmpdir, "work"),
+      segment_duration = SEGMENT_DURATION,
+    )
+
+def cut_parallel(path: str, output: str, tolerance: float) -> None:
+  with open(output, "wb") as handle:
+    vq.cut_parallel(
+      vq.FileReader(path),
+      vq.HandleWriter(handle, format="matroska"),
+      tolerance,
+      AFTER_LOUD_SAVE_DURATION,
+      jobs = PARALLEL_JOBS,
+    )
+
+def check_output(output: str, expected_frames: int) -> list[str]:
+  """
+  Compare the number of video frames in `output` with `expected_frames`, and check that the timestamps of each of its
+  streams never go back. Returns the problems found.
+  """
+  if os.path.getsize(output) == 0:
+    return [] if expected_frames == 0 else [f"empty output, expected {expected_frames} frames"]
+  problems = []
+  with av.open(output) as container:
+    num_frames = 0
+    last_dts: dict[str, float] = {}
+    for packet in container.demux():
+      if packet.pts is None and packet.dts is None:
+        continue # flushing packet, demuxers may leave the dts of the first video packets unset
+      kind = packet.stream.type
+      num_frames += kind == "video"
+      if packet.dts is None:
+        continue
+      dts = float(packet.dts * packet.time_base)
+      if kind in last_dts and dts <= last_dts[kind]:
+        problems.append(f"{kind} dts goes from {last_dts[kind]:.3f}s back to {dts:.3f}s")
+      last_dts[kind] = dts
+  if num_frames != expected_frames:
+    problems.append(f"wrote {num_frames} frames, vq.cut wrote {expected_frames}")
+  return problems
+
+CHECKS: dict[str, Callable[[str, str, float], None]] = {
+  "resumable": cut_resumable,
+  "parallel": cut_parallel,
+}
+
+def main() -> None:
+  parser = argparse.ArgumentParser("benchmarks.segments", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--only", choices=CHECKS.keys(), nargs="+", default=list(CHECKS), help="Checks to run")
+  args = parser.parse_args()
+
+  path = fixtures.ensure(FIXTURE)
+  failed = False
+  with tempfile.TemporaryDirectory(prefix="vq-segments-") as tmpdir:
+    # 0 dBFS is above the tones, so that everything is cut
+    for tolerance in [TOLERANCE, 0.0]:
+      expected_frames = cut_reference(path, tolerance)
+      for name in args.only:
+        output = os.path.join(tmpdir, f"{name}.mkv")
+        t0 = time.perf_counter()
+        CHECKS[name](path, output, tolerance)
+        elapsed = time.perf_counter() - t0
+        problems = check_output(output, expected_frames)
+        print(f"{name:>10} t={tolerance:>5}: {elapsed:6.2f}s {'OK' if not problems else '; '.join(problems)}")
+        failed |= bool(problems)
+  sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,83 @@
+"""
+Benchmark of `vq serve`: several players requesting cut streams of the same file at once, on localhost.
+
+Each client reads its whole response as fast as it can and reports its time to first byte and total time. The first
+round starts with an empty loudness cache, so all of its requests wait for one shared analysis. The second round
+reuses that analysis.
+
+  $ python -m benchmarks.serve --clients 1 4 8 --max-jobs 8
+"""
+from __future__ import annotations
+from typing import *
+from . import fixtures
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import urllib.parse
+import vq
+
+async def fetch(port: int, src: str, tolerance: float) -> tuple[int, float, float, int]:
+  """
+  Status, time to first byte, total time and bytes of the body, chunk framing included.
+  """
+  start = time.monotonic()
+  reader, writer = await asyncio.open_connection("127.0.0.1", port)
+  query = urllib.parse.urlencode({"src": src, "t": tolerance})
+  writer.write(f"GET /cut?{query} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+  await writer.drain()
+  status_line = await reader.readline()
+  first_byte = time.monotonic() - start
+  await reader.readuntil(b"\r\n\r\n")
+  size = 0
+  while data := await reader.read(2**16):
+    size += len(data)
+  writer.close()
+  return int(status_line.split()[1]), first_byte, time.monotonic() - start, size
+
+async def run(root: str, src: str, *, clients: list[int], max_jobs: int, tolerance: float) -> None:
+  server = vq.CutServer(root, max_jobs=max_jobs)
+  listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+  port = listener.sockets[0].getsockname()[1]
+  async with listener:
+    for num_clients in clients:
+      for cache in ["cold", "warm"]:
+        if cache == "cold":
+          server.cache = vq.AnalysisCache() # the disk cache is in a fresh directory, see main
+          for name in os.listdir(os.environ["VQ_CACHE_DIR"]):
+            os.remove(os.path.join(os.environ["VQ_CACHE_DIR"], name))
+        start = time.monotonic()
+        results = await asyncio.gather(*[fetch(port, src, tolerance) for _ in range(num_clients)])
+        wall = time.monotonic() - start
+        ok = [result for result in results if result[0] == 200]
+        first_bytes = sorted(result[1] for result in ok)
+        print(
+          f"clients={num_clients:>3} {cache}: ok={len(ok)}/{num_clients} wall={wall:6.2f}s"
+          + (f" first_byte median={first_bytes[len(first_bytes) // 2]:.2f}s max={first_bytes[-1]:.2f}s" if ok else "")
+          + f" served={sum(result[3] for result in ok) / 2**20:.1f}MiB"
+        )
+  server.executor.shutdown()
+
+def main() -> None:
+  parser = argparse.ArgumentParser("benchmarks.serve", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--clients", type=int, nargs="+", default=[1, 4], help="Numbers of concurrent clients to try")
+  parser.add_argument("--max-jobs", type=int, default=vq.DEFAULT_MAX_JOBS, help="Jobs cap of the server")
+  parser.add_argument("--tolerance", type=float, default=-20.0, help="Tolerance requested by the clients")
+  args = parser.parse_args()
+
+  fixture = fixtures.QUICK_FIXTURES[0]
+  path = fixtures.ensure(fixture)
+  print(f"{fixture.name}, max_jobs={args.max_jobs}", file=sys.stderr)
+  with tempfile.TemporaryDirectory(prefix="vq-cache-") as cache_dir:
+    os.environ["VQ_CACHE_DIR"] = cache_dir
+    asyncio.run(run(
+      os.path.dirname(path), os.path.basename(path),
+      clients = args.clients,
+      max_jobs = args.max_jobs,
+      tolerance = args.tolerance,
+    ))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,67 @@
+"""
+Benchmark of the time from launching `vq` to the first byte it writes to stdout, for a local file and for a YouTube
+input piped from `benchmarks.fake_ytdl`, along with the time `import vq.cli` takes on its own.
+
+Time to first byte is what a player started as `vq ... | mpv -` waits before it can show anything: interpreter start,
+imports, probing the input and encoding until the muxer writes its header.
+
+  $ python -m benchmarks.startup --runs 5 --probe-size 32768 --analyze-duration 0.5
+"""
+from __future__ import annotations
+from typing import *
+from . import fixtures
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUN_CLI = os.path.join(ROOT, "run_cli.py")
+FAKE_YTDL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_ytdl.py")
+
+def time_to_first_byte(args: list[str]) -> float:
+  start = time.monotonic()
+  process = subprocess.Popen([sys.executable, RUN_CLI, *args, "-"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=ROOT)
+  try:
+    if not process.stdout.read(1):
+      raise RuntimeError(f"vq {' '.join(args)} exited without any output")
+    return time.monotonic() - start
+  finally:
+    process.kill()
+    process.wait()
+
+def time_to_exit(code: str) -> float:
+  start = time.monotonic()
+  subprocess.run([sys.executable, "-c", code], check=True, cwd=ROOT)
+  return time.monotonic() - start
+
+def main() -> None:
+  parser = argparse.ArgumentParser("benchmarks.startup", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("--runs", type=int, default=5, help="Runs per measurement, the median is reported")
+  parser.add_argument("--probe-size", type=int, default=32768, help="--probe-size of the tuned YouTube run")
+  parser.add_argument("--analyze-duration", type=float, default=0.5, help="--analyze-duration of the tuned YouTube run")
+  args = parser.parse_args()
+
+  fixture = fixtures.QUICK_FIXTURES[0]
+  path = fixtures.ensure(fixture)
+  url = f"https://fake.invalid{os.path.abspath(path)}"
+  ytdl = ["--ytdl-command", FAKE_YTDL, "--prefetch-size", "0"]
+  print(f"{fixture.name}, median of {args.runs} runs", file=sys.stderr)
+
+  measurements: list[tuple[str, Callable[[], float]]] = [
+    ("python startup", lambda: time_to_exit("pass")),
+    ("import vq.cli", lambda: time_to_exit("import vq.cli")),
+    ("file", lambda: time_to_first_byte([path])),
+    ("youtube", lambda: time_to_first_byte([*ytdl, url])),
+    ("youtube tuned", lambda: time_to_first_byte([
+      *ytdl, "--probe-size", str(args.probe_size), "--analyze-duration", str(args.analyze_duration), url,
+    ])),
+  ]
+  for name, measure in measurements:
+    seconds = statistics.median(measure() for _ in range(args.runs))
+    print(f"{name:>14}: {seconds * 1000:7.1f}ms")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,209 @@
+"""
+Reproducible throughput benchmarks on synthetic clips (see `benchmarks.fixtures`).
+
+Runs `Chunker.to_chunks`, `Cutter.cut_chunks`, `vq.analyze` and the whole of `vq.cut` on every fixture, each in a
+fresh process, and records frames/s, realtime factor, peak RSS and peak traced allocations into a JSON file. The same
+runs check that the cut decisions match the fixture's known pattern of tones and silences.
+
+  $ python -m benchmarks.suite --output results.json
+  $ python -m benchmarks.suite --output results.json --baseline baseline.json --threshold 0.1
+
+Exits with status 1 if a cut decision is wrong, or if a benchmark is slower than the baseline by more than the
+threshold.
+"""
+from __future__ import annotations
+from typing import *
+from . import fixtures
+from .fixtures import Fixture
+import argparse
+import av
+import concurrent.futures
+import io
+import json
+import multiprocessing
+import numpy as np
+import platform
+import resource
+import sys
+import time
+import tracemalloc
+import vq
+from vq.chunker import Chunker
+from vq.analysis import stub_frames
+from vq.cli import InfoDrawer
+
+TOLERANCE = -20.0
+AFTER_LOUD_SAVE_DURATION = 0.3
+# Frames closer than this to a change between tone and silence are not checked, as encoding smears the edges
+CHECK_MARGIN = 0.1
+
+# Each benchmark prepares its input, and returns the measured function which returns the number of frames it processed
+
+def prepare_chunker(path: str) -> Callable[[], int]:
+  def run() -> int:
+    with vq.FileReader(path).open() as source:
+      return sum(1 for _ in Chunker(source).to_chunks(source.decode()))
+  return run
+
+def prepare_cutter(path: str) -> Callable[[], int]:
+  # Chunks of video stubs are prepared beforehand, so that only the cutter is measured
+  with vq.FileReader(path).open() as source:
+    chunks = list(Chunker(source).to_chunks(stub_frames(source)))
+    cutter = vq.Cutter(source, tolerance=TOLERANCE, after_loud_save_duration=AFTER_LOUD_SAVE_DURATION)
+  def run() -> int:
+    for _ in cutter.cut_chunks(iter(chunks)):
+      pass
+    return len(chunks)
+  return run
+
+def prepare_analyze(path: str) -> Callable[[], int]:
+  def run() -> int:
+    with vq.FileReader(path).open() as source:
+      return len(vq.analyze(source))
+  return run
+
+def cut_to_memory(path: str, *, draw_info: bool = False) -> int:
+  # Returns the number of frames written
+  output = io.BytesIO()
+  with vq.FileReader(path).open() as source, vq.HandleWriter(output, format="matroska").open_like(source) as sink:
+    native_frame_modifier = None
+    if draw_info:
+      args = argparse.Namespace(font_scale=0.4, tolerance=TOLERANCE)
+      native_frame_modifier = InfoDrawer(source, args).on_callback
+    vq.cut(source, sink, TOLERANCE, AFTER_LOUD_SAVE_DURATION, native_frame_modifier=native_frame_modifier)
+    return sink.num_video_frames
+
+def prepare_cut(path: str, *, draw_info: bool = False) -> Callable[[], int]:
+  # Throughput of `cut` is measured in input frames, which matroska does not count
+  with vq.FileReader(path).open() as source:
+    num_frames = len(vq.analyze(source))
+  def run() -> int:
+    cut_to_memory(path, draw_info=draw_info)
+    return num_frames
+  return run
+
+def prepare_cut_draw_info(path: str) -> Callable[[], int]:
+  return prepare_cut(path, draw_info=True)
+
+BENCHMARKS: dict[str, Callable[[str], Callable[[], int]]] = {
+  "chunker": prepare_chunker,
+  "cutter": prepare_cutter,
+  "analyze": prepare_analyze,
+  "cut": prepare_cut,
+  "cut_draw_info": prepare_cut_draw_info,
+}
+
+def run_benchmark(name: str, path: str, duration: float, trace: bool) -> dict:
+  """
+  Runs in a fresh process, so that peak RSS is the benchmark's own.
+  """
+  run = BENCHMARKS[name](path)
+  if trace:
+    tracemalloc.start()
+  t0 = time.perf_counter()
+  num_frames = run()
+  elapsed = time.perf_counter() - t0
+  peak_traced = None
+  if trace:
+    peak_traced = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+  return {
+    "frames": num_frames,
+    "seconds": elapsed,
+    "frames_per_sec": num_frames / elapsed,
+    "realtime_factor": duration / elapsed,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "peak_traced_mb": None if peak_traced is None else peak_traced / 2**20,
+  }
+
+def check_decisions(fixture: Fixture) -> list[str]:
+  """
+  Compare the cut decisions on `fixture` with the ones expected from its pattern, and that `vq.cut` keeps exactly as
+  many frames as the audio-only analysis says. Returns the problems found.
+  """
+  problems = []
+  with vq.FileReader(fixture.path).open() as source:
+    index = vq.analyze(source)
+    keep = vq.Cutter(source, tolerance=TOLERANCE, after_loud_save_duration=AFTER_LOUD_SAVE_DURATION).keep_mask(index)
+
+  def expected_keep(t: float) -> bool:
+    # Kept if loud, or if there was a loud moment within `AFTER_LOUD_SAVE_DURATION` before
+    return any(fixtures.is_loud_at(t - dt) for dt in np.arange(0, AFTER_LOUD_SAVE_DURATION + 1e-9, 0.01) if t - dt >= 0)
+
+  wrong = []
+  for t, kept in zip(index.time.tolist(), keep.tolist()):
+    expectations = {expected_keep(t + dt) for dt in (-CHECK_MARGIN, 0, CHECK_MARGIN)}
+    if len(expectations) == 1 and kept not in expectations:
+      wrong.append(t)
+  if wrong:
+    problems.append(f"{len(wrong)} frames wrongly cut or kept, first at {wrong[0]:.3f}s")
+
+  num_written = cut_to_memory(fixture.path)
+  if num_written != int(keep.sum()):
+    problems.append(f"vq.cut kept {num_written} frames, the analysis kept {int(keep.sum())}")
+  return problems
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+  regressions = []
+  for key, result in results["benchmarks"].items():
+    if key not in baseline["benchmarks"]:
+      continue
+    before = baseline["benchmarks"][key]["frames_per_sec"]
+    after = result["frames_per_sec"]
+    change = after / before - 1
+    print(f"{key:>48}: {before:>9.1f} -> {after:>9.1f} frames/s ({change:+.1%})")
+    if change < -threshold:
+      regressions.append(key)
+  return regressions
+
+def main() -> None:
+  parser = argparse.ArgumentParser("benchmarks.suite", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("-o", "--output", type=str, default="benchmarks/results.json", help="Where to write the results")
+  parser.add_argument("--baseline", type=str, default=None, help="Results to compare against")
+  parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown from the baseline that counts as a regression")
+  parser.add_argument("--quick", action="store_true", help="Only run a couple of short fixtures")
+  parser.add_argument("--trace-allocations", action="store_true", help="Also record peak allocations with tracemalloc, which slows the benchmarks down")
+  parser.add_argument("--only", choices=BENCHMARKS.keys(), nargs="+", default=list(BENCHMARKS), help="Benchmarks to run")
+  args = parser.parse_args()
+
+  results = {
+    "environment": {
+      "python": platform.python_version(),
+      "av": av.__version__,
+      "numpy": np.__version__,
+      "machine": platform.machine(),
+      "processor": platform.processor(),
+    },
+    "benchmarks": {},
+    "problems": {},
+  }
+  spawn = multiprocessing.get_context("spawn")
+  for fixture in (fixtures.QUICK_FIXTURES if args.quick else fixtures.FIXTURES):
+    fixtures.ensure(fixture)
+    for name in args.only:
+      with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+        result = executor.submit(run_benchmark, name, fixture.path, fixture.duration, args.trace_allocations).result()
+      key = f"{fixture.name}/{name}"
+      results["benchmarks"][key] = result
+      print(f"{key:>48}: {result['frames_per_sec']:>9.1f} frames/s, {result['realtime_factor']:>7.2f}x realtime, {result['peak_rss_mb']:>7.1f} MiB peak RSS")
+    problems = check_decisions(fixture)
+    if problems:
+      results["problems"][fixture.name] = problems
+      for problem in problems:
+        print(f"{fixture.name}: {problem}", file=sys.stderr)
+
+  with open(args.output, "w") as f:
+    json.dump(results, f, indent=2)
+
+  failed = bool(results["problems"])
+  if args.baseline is not None:
+    with open(args.baseline) as f:
+      regressions = compare(results, json.load(f), args.threshold)
+    for key in regressions:
+      print(f"{key}: regressed by more than {args.threshold:.0%}", file=sys.stderr)
+    failed = failed or bool(regressions)
+  sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+  main()
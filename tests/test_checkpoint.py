@@ -0,0 +1,110 @@
+from __future__ import annotations
+from typing import *
+from benchmarks import fixtures
+from benchmarks.fixtures import Fixture
+import av
+import io
+import logging
+import numpy as np
+import os
+import pytest
+import signal
+import subprocess
+import sys
+import vq
+
+# Keyframes every half second and half second segments, so that a run has many segments to be killed after
+FIXTURE = Fixture(320, 180, 30, "aac", 6.0, gop=15)
+SEGMENT_DURATION = 0.5
+TOLERANCE = -20.0
+AFTER_LOUD_SAVE_DURATION = 0.3
+# Two runs are not encoded bit for bit the same: the video encoder's threads make it differ by a level or two on a few
+# pixels, and the audio decoder does not give back exactly the same samples after a seek. A frame off by one differs by
+# about 4 levels everywhere on the fixture's moving gradient, and audio off by a single sample over 10 times as much as
+# allowed on its tones
+MAX_VIDEO_MEAN_DIFFERENCE = 0.1
+MAX_AUDIO_RMS_DIFFERENCE = 0.005
+
+# Cuts with --resume-dir, and kills itself as soon as the first checkpoint is saved
+KILLED_RUN = """
+import os, signal, sys, vq
+from vq.checkpoint import Checkpoint
+save = Checkpoint.save
+def save_and_die(self, path):
+  save(self, path)
+  os.kill(os.getpid(), signal.SIGKILL)
+Checkpoint.save = save_and_die
+input, output, work_dir, segment_duration, tolerance, after_loud_save_duration = sys.argv[1:]
+with open(output, "wb") as handle:
+  vq.cut_resumable(
+    vq.FileReader(input),
+    vq.HandleWriter(handle, format="matroska"),
+    float(tolerance),
+    float(after_loud_save_duration),
+    work_dir = work_dir,
+    segment_duration = float(segment_duration),
+  )
+"""
+
+@pytest.fixture(scope="module")
+def clip() -> str:
+  return fixtures.ensure(FIXTURE)
+
+def cut_resumable(path: str, output: str, work_dir: str) -> None:
+  with open(output, "wb") as handle:
+    vq.cut_resumable(
+      vq.FileReader(path),
+      vq.HandleWriter(handle, format="matroska"),
+      TOLERANCE,
+      AFTER_LOUD_SAVE_DURATION,
+      work_dir = work_dir,
+      segment_duration = SEGMENT_DURATION,
+    )
+
+def read_packets(path: str) -> list[tuple[str, Optional[int]]]:
+  # (stream type, pts) of each packet
+  with av.open(path) as container:
+    return [
+      (packet.stream.type, packet.pts)
+      for packet in container.demux()
+      if packet.pts is not None or packet.dts is not None
+    ]
+
+def decode_video(path: str) -> list[np.ndarray]:
+  with av.open(path) as container:
+    return [frame.to_ndarray().astype(np.int16) for frame in container.decode(video=0)]
+
+def decode_audio(path: str) -> np.ndarray:
+  with av.open(path) as container:
+    return np.concatenate([frame.to_ndarray() for frame in container.decode(audio=0)], axis=1)
+
+def test_resumed_cut_matches_uninterrupted_cut(clip: str, tmp_path: Any, caplog: Any) -> None:
+  work_dir = str(tmp_path / "work")
+  killed = subprocess.run(
+    [sys.executable, "-c", KILLED_RUN, clip, str(tmp_path / "killed.mkv"), work_dir, str(SEGMENT_DURATION), str(TOLERANCE), str(AFTER_LOUD_SAVE_DURATION)],
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(vq.__file__))),
+  )
+  assert killed.returncode == -signal.SIGKILL
+  assert os.path.exists(os.path.join(work_dir, "checkpoint.json"))
+
+  with caplog.at_level(logging.INFO, logger="vq.checkpoint"):
+    cut_resumable(clip, str(tmp_path / "resumed.mkv"), work_dir)
+  assert "resuming after 1 segments" in caplog.text
+  assert not os.path.exists(work_dir)
+
+  cut_resumable(clip, str(tmp_path / "uninterrupted.mkv"), str(tmp_path / "uninterrupted"))
+  resumed = read_packets(str(tmp_path / "resumed.mkv"))
+  uninterrupted = read_packets(str(tmp_path / "uninterrupted.mkv"))
+  assert resumed == uninterrupted
+  resumed_video = decode_video(str(tmp_path / "resumed.mkv"))
+  uninterrupted_video = decode_video(str(tmp_path / "uninterrupted.mkv"))
+  assert len(resumed_video) == len(uninterrupted_video)
+  assert max(np.mean(np.abs(a - b)) for a, b in zip(resumed_video, uninterrupted_video)) < MAX_VIDEO_MEAN_DIFFERENCE
+  resumed_audio = decode_audio(str(tmp_path / "resumed.mkv"))
+  uninterrupted_audio = decode_audio(str(tmp_path / "uninterrupted.mkv"))
+  assert resumed_audio.shape == uninterrupted_audio.shape
+  assert np.sqrt(np.mean(np.square(resumed_audio - uninterrupted_audio))) < MAX_AUDIO_RMS_DIFFERENCE
+
+  with vq.FileReader(clip).open() as source, vq.HandleWriter(io.BytesIO(), format="matroska").open_like(source) as sink:
+    vq.cut(source, sink, TOLERANCE, AFTER_LOUD_SAVE_DURATION)
+  assert 0 < sum(kind == "video" for kind, _ in resumed) == sink.num_video_frames
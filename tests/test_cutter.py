@@ -0,0 +1,101 @@
+from __future__ import annotations
+from typing import *
+from vq.chunker import Chunk, FrameStub
+from vq.cutter import Cutter, CutChunk
+from vq.sound import Sound
+from vq.utils import calculate_dbfs
+import fractions
+import numpy as np
+import pytest
+import types
+
+FPS = 30
+RATE = 48000
+
+def make_sounds(dtype: type, num_sounds: int = 64, num_channels: int = 2) -> list[Sound]:
+  # Sounds of varied loudness and length, integer ones spanning their whole range
+  rng = np.random.default_rng(0)
+  sounds = []
+  for i in range(num_sounds):
+    num_samples = int(rng.integers(1, 2 * RATE // FPS))
+    samples = rng.uniform(-1, 1, size=(num_channels, num_samples)) * rng.choice([0.01, 0.03, 0.5], p=[0.45, 0.45, 0.1])
+    if np.issubdtype(dtype, np.integer):
+      samples = np.round(samples * -np.iinfo(dtype).min)
+    sounds.append(Sound(samples.astype(dtype)))
+  return sounds
+
+def make_chunks(dtype: type, num_chunks: int = 300) -> list[Chunk]:
+  time_base = fractions.Fraction(1, FPS)
+  return [
+    Chunk(video_frame=FrameStub(pts=i, time_base=time_base), sound=sound)
+    for i, sound in enumerate(make_sounds(dtype, num_chunks))
+  ]
+
+def baseline_dbfs(samples: np.ndarray) -> float:
+  # How dBFS were computed before they were batched, in floating point for integers, whose squares used to overflow
+  if np.issubdtype(samples.dtype, np.integer):
+    samples = samples.astype(np.float64)
+  with np.errstate(divide='ignore'):
+    return 10 * np.log10(np.max(np.square(samples)))
+
+def fake_source() -> Any:
+  return types.SimpleNamespace(video_stream=types.SimpleNamespace(average_rate=fractions.Fraction(FPS)))
+
+@pytest.mark.parametrize("dtype", [np.float32, np.int16, np.int32])
+def test_batch_dbfs_equals_calculate_dbfs(dtype: type) -> None:
+  sounds = make_sounds(dtype)
+  expected = [calculate_dbfs(sound.samples) for sound in sounds]
+  assert Sound.batch_dbfs(sounds).tolist() == expected
+
+@pytest.mark.parametrize("dtype", [np.float32, np.int16, np.int32])
+def test_dbfs_equals_baseline(dtype: type) -> None:
+  sounds = make_sounds(dtype, num_sounds=2000)
+  expected = [baseline_dbfs(sound.samples) for sound in sounds]
+  assert [sound.dbfs() for sound in sounds] == expected
+  assert Sound.batch_dbfs(sounds).tolist() == expected
+
+@pytest.mark.parametrize("dtype", [np.int16, np.int32])
+def test_dbfs_of_integer_extremes(dtype: type) -> None:
+  info = np.iinfo(dtype)
+  extremes = [
+    Sound(np.array([[info.min, 0]], dtype=dtype)),
+    Sound(np.array([[0, info.max]], dtype=dtype)),
+    Sound(np.array([[info.min, info.max]], dtype=dtype)),
+    Sound(np.zeros((1, 2), dtype=dtype)),
+  ]
+  # Computed in floating point, so the most negative value neither wraps around on negation nor overflows on squaring
+  expected = [20 * np.log10(-float(info.min)), 20 * np.log10(float(info.max)), 20 * np.log10(-float(info.min)), -np.inf]
+  assert [sound.dbfs() for sound in extremes] == pytest.approx(expected)
+  assert Sound.batch_dbfs(extremes).tolist() == pytest.approx(expected)
+
+@pytest.mark.parametrize("dtype, tolerance", [(np.float32, -20.0), (np.int16, 70.0)])
+@pytest.mark.parametrize("before_loud_save_duration", [0.0, 0.1])
+def test_cut_chunks_decisions_do_not_depend_on_batch_size(dtype: type, tolerance: float, before_loud_save_duration: float) -> None:
+  chunks = make_chunks(dtype)
+  kept = {}
+  for batch_size in [1, 8]:
+    cutter = Cutter(
+      fake_source(),
+      tolerance = tolerance,
+      after_loud_save_duration = 0.1,
+      before_loud_save_duration = before_loud_save_duration,
+      batch_size = batch_size,
+    )
+    kept[batch_size] = [cut_chunk.video_frame.pts for cut_chunk in cutter.cut_chunks(iter(chunks))]
+  assert 0 < len(kept[1]) < len(chunks)
+  assert kept[1] == kept[8]
+
+@pytest.mark.parametrize("batch_size", [1, 8])
+def test_cut_chunks_decisions_equal_baseline(batch_size: int) -> None:
+  chunks = make_chunks(np.float32, num_chunks=2000)
+  dbfs = [baseline_dbfs(chunk.sound.samples) for chunk in chunks]
+  # Tolerances right at the dBFS of chunks, whose decisions change with the slightest difference in their dBFS
+  for tolerance in dbfs[::50]:
+    baseline_cutter = Cutter(fake_source(), tolerance=float(tolerance), after_loud_save_duration=0.0)
+    expected = [
+      kept.video_frame.pts
+      for chunk, chunk_dbfs in zip(chunks, dbfs)
+      for kept in baseline_cutter.cut(CutChunk(video_frame=chunk.video_frame, sound=chunk.sound, dbfs=chunk_dbfs))
+    ]
+    cutter = Cutter(fake_source(), tolerance=float(tolerance), after_loud_save_duration=0.0, batch_size=batch_size)
+    assert [kept.video_frame.pts for kept in cutter.cut_chunks(iter(chunks))] == expected
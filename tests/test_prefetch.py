@@ -0,0 +1,62 @@
+from __future__ import annotations
+from typing import *
+from vq.prefetch import PrefetchReader
+import io
+import os
+import pytest
+import threading
+
+CHUNK_SIZE = 4096
+
+def make_data(size: int) -> bytes:
+  return bytes(i * 7 % 251 for i in range(size))
+
+@pytest.mark.parametrize("spill", [False, True])
+def test_reads_the_pipe_through(spill: bool, tmp_path: Any) -> None:
+  # A capacity that is not a multiple of the chunk size, so that chunks wrap around the end of the spill file
+  data = make_data(100_000)
+  reader = PrefetchReader(
+    io.BufferedReader(io.BytesIO(data)),
+    capacity = 3 * CHUNK_SIZE + 100,
+    chunk_size = CHUNK_SIZE,
+    spill_dir = str(tmp_path) if spill else None,
+  )
+  with io.BufferedReader(reader, buffer_size=1000) as buffered:
+    assert buffered.read() == data
+  assert reader.stats.max_buffered <= reader.capacity
+
+class StuckSpillReader(PrefetchReader):
+  # Its writes of the spill file after the first one wait for `unstuck`, like on a stalled disk
+  def __init__(self, *args, **kwargs) -> None:
+    self.unstuck = threading.Event()
+    self.stuck = threading.Event()
+    self.num_writes = 0
+    super().__init__(*args, **kwargs)
+
+  def _spill_write(self, data: bytes, position: int) -> None:
+    self.num_writes += 1
+    if self.num_writes > 1:
+      self.stuck.set()
+      assert self.unstuck.wait(timeout=10)
+    super()._spill_write(data, position)
+
+def test_stuck_spill_write_does_not_block_reads(tmp_path: Any) -> None:
+  data = make_data(2 * CHUNK_SIZE)
+  read_end, write_end = os.pipe()
+  with os.fdopen(write_end, "wb") as pipe:
+    pipe.write(data)
+  reader = StuckSpillReader(os.fdopen(read_end, "rb"), capacity=4 * CHUNK_SIZE, chunk_size=CHUNK_SIZE, spill_dir=str(tmp_path))
+  try:
+    assert reader.stuck.wait(timeout=10)
+    # The first chunk was written before the stuck write started, and is read while it still is
+    result: list[bytes] = []
+    consumer = threading.Thread(target=lambda: result.append(reader.read(CHUNK_SIZE)))
+    consumer.start()
+    consumer.join(timeout=5)
+    assert not consumer.is_alive()
+    assert result == [data[:CHUNK_SIZE]]
+  finally:
+    reader.unstuck.set()
+  assert reader.read(CHUNK_SIZE) == data[CHUNK_SIZE:]
+  assert reader.read(CHUNK_SIZE) == b""
+  reader.close()
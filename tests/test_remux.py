@@ -0,0 +1,39 @@
+from __future__ import annotations
+from typing import *
+from benchmarks import fixtures
+from benchmarks.fixtures import Fixture
+import av
+import io
+import logging
+import pytest
+import vq
+
+TOLERANCE = -20.0
+AFTER_LOUD_SAVE_DURATION = 0.1
+
+def kept_duration(path: str) -> float:
+  # Of the frames `vq.cut` keeps
+  with vq.FileReader(path).open() as source, vq.HandleWriter(io.BytesIO(), format="matroska").open_like(source) as sink:
+    vq.cut(source, sink, TOLERANCE, AFTER_LOUD_SAVE_DURATION)
+    rate = source.video_stream.average_rate
+  return float(sink.num_video_frames / rate)
+
+def remux(path: str, output: str) -> float:
+  # Returns the duration of the video written
+  with open(output, "wb") as handle, vq.FileReader(path).open() as source:
+    vq.remux(source, vq.HandleWriter(handle, format="matroska"), TOLERANCE, AFTER_LOUD_SAVE_DURATION)
+  with av.open(output) as container:
+    stream = container.streams.video[0]
+    num_frames = sum(1 for packet in container.demux(stream) if packet.pts is not None or packet.dts is not None)
+    return float(num_frames / stream.average_rate)
+
+@pytest.mark.parametrize("gop, copied", [(3, True), (60, False)])
+def test_remux_keeps_about_the_kept_duration(gop: int, copied: bool, tmp_path: Any, caplog: Any) -> None:
+  # Keyframes every 0.1s are close enough to copy whole GOPs, every 2s they would keep most of the silences
+  path = fixtures.ensure(Fixture(320, 180, 30, "aac", 12.0, gop=gop))
+  expected = kept_duration(path)
+  with caplog.at_level(logging.WARNING, logger="vq.remux"):
+    duration = remux(path, str(tmp_path / "remuxed.mkv"))
+  assert ("re-encoding instead" not in caplog.text) == copied
+  assert expected > 0
+  assert expected <= duration <= expected * (1 + vq.DEFAULT_MAX_REMUX_EXTRA)
@@ -1,4 +1,34 @@
+import importlib
+
 from .source import *
 from .sink import *
+from .chunker import *
 from .cutter import *
-from .core import *
\ No newline at end of file
+from .core import *
+from .analysis import *
+from .remux import *
+from .concat import *
+from .latency import *
+from .stats import *
+from .prefetch import *
+from .edl import *
+from .shape import *
+
+# Only some commands need these modules, and importing them (with concurrent.futures, multiprocessing or asyncio)
+# would slow down the start of every other command, so their names are imported on first use. `remux` and `concat`
+# are imported right away, as importing their modules would replace the functions of the same names with them
+_LAZY_MODULES = {
+  ".parallel": ["Segment", "plan_segments", "cut_parallel"],
+  ".index": ["index_cache_dir", "index_path", "cached_analyze"],
+  ".batch": ["BatchJob", "BatchOptions", "BatchResult", "find_inputs", "plan_batch", "run_batch"],
+  ".checkpoint": ["Checkpoint", "cut_resumable", "DEFAULT_SEGMENT_DURATION"],
+  ".serve": ["AnalysisCache", "CutServer", "DEFAULT_MAX_JOBS"],
+}
+_LAZY_NAMES = {name: module for module, names in _LAZY_MODULES.items() for name in names}
+
+def __getattr__(name: str):
+  if name in _LAZY_NAMES:
+    value = getattr(importlib.import_module(_LAZY_NAMES[name], __name__), name)
+    globals()[name] = value
+    return value
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,153 @@
+from __future__ import annotations
+from typing import *
+
+from .chunker import Chunker, FrameStub
+from .sound import Sound
+from .source import Source
+from .utils import batched
+from dataclasses import dataclass
+import av
+import fractions
+import heapq
+import json
+import logging
+import numpy as np
+import os
+
+__all__ = [
+  "LoudnessIndex",
+  "stub_frames",
+  "analyze",
+]
+
+logger = logging.getLogger(__name__)
+
+# Bump when the contents of a saved `LoudnessIndex` change meaning
+INDEX_VERSION = 1
+
+# Number of chunks whose dBFS is computed at once by `analyze`
+ANALYSIS_BATCH_SIZE = 256
+
+# Number of video packets held back to put them in presentation order. Must exceed the codec's reordering delay.
+REORDER_DEPTH = 16
+
+@dataclass
+class LoudnessIndex:
+  """
+  Per video frame loudness of a source, in presentation order.
+  """
+  time_base: fractions.Fraction # of `pts`
+  average_rate: fractions.Fraction # of the video stream, in frames per second
+  pts: np.ndarray  # int64
+  dbfs: np.ndarray # dBFS of the chunk paired with each frame
+  key: np.ndarray  # bool, whether the frame is a keyframe
+  audio_start_pts: int = 0 # pts of the first audio sample, in the audio stream's time base
+
+  def __len__(self) -> int:
+    return len(self.pts)
+
+  @property
+  def time(self) -> np.ndarray:
+    return self.pts.astype(np.float64) * self.time_base.numerator / self.time_base.denominator
+
+  @property
+  def duration(self) -> float:
+    # in seconds, assuming a constant frame rate
+    return float(len(self) / self.average_rate)
+
+  def frames(self) -> Iterator[FrameStub]:
+    for pts, key in zip(self.pts.tolist(), self.key.tolist()):
+      yield FrameStub(pts=pts, time_base=self.time_base, is_keyframe=key)
+
+  def save(self, path: str) -> None:
+    """
+    Write the index to `path` (a .npy file of per frame records) and its metadata to `path` + ".json".
+    """
+    records = np.empty(len(self), dtype=[("pts", "<i8"), ("dbfs", self.dbfs.dtype.newbyteorder("<")), ("key", "?")])
+    records["pts"] = self.pts
+    records["dbfs"] = self.dbfs
+    records["key"] = self.key
+    # Written to temporary files first, so that readers never see a partially written index
+    with open(path + ".tmp", "wb") as f:
+      np.save(f, records)
+    with open(path + ".json.tmp", "w") as f:
+      json.dump({
+        "version": INDEX_VERSION,
+        "time_base": [self.time_base.numerator, self.time_base.denominator],
+        "average_rate": [self.average_rate.numerator, self.average_rate.denominator],
+        "audio_start_pts": self.audio_start_pts,
+      }, f)
+    os.replace(path + ".tmp", path)
+    os.replace(path + ".json.tmp", path + ".json")
+
+  @staticmethod
+  def load(path: str) -> LoudnessIndex:
+    """
+    Read an index written by `save`. The per frame records are memory-mapped rather than read.
+    """
+    with open(path + ".json") as f:
+      meta = json.load(f)
+    if meta.get("version") != INDEX_VERSION:
+      raise ValueError(f"{path} has index version {meta.get('version')}, expected {INDEX_VERSION}")
+    records = np.load(path, mmap_mode="r")
+    return LoudnessIndex(
+      time_base = fractions.Fraction(*meta["time_base"]),
+      average_rate = fractions.Fraction(*meta["average_rate"]),
+      pts       = records["pts"],
+      dbfs      = records["dbfs"],
+      key       = records["key"],
+      audio_start_pts = meta["audio_start_pts"],
+    )
+
+def stub_frames(
+  source: Source,
+  on_video_packet: Optional[Callable[[av.Packet], None]] = None,
+  ) -> Generator[av.AudioFrame | FrameStub]:
+  """
+  Decode only the audio stream of `source`. Video packets are demuxed but not decoded, and yielded as `FrameStub`s
+  in presentation order.
+
+  :param on_video_packet: Called on every demuxed video packet (including the final flushing one) before its stub is yielded
+  """
+  time_base = source.video_stream.time_base
+  pending: list[tuple[int, bool]] = [] # heap of (pts, is_keyframe)
+  for packet in source.demux():
+    if packet.stream.type == "audio":
+      yield from packet.decode()
+    else:
+      if on_video_packet is not None:
+        on_video_packet(packet)
+      pts = packet.pts if packet.pts is not None else packet.dts
+      if pts is None:
+        continue # flushing packet
+      heapq.heappush(pending, (pts, packet.is_keyframe))
+      if len(pending) > REORDER_DEPTH:
+        pts, key = heapq.heappop(pending)
+        yield FrameStub(pts=pts, time_base=time_base, is_keyframe=key)
+  while pending:
+    pts, key = heapq.heappop(pending)
+    yield FrameStub(pts=pts, time_base=time_base, is_keyframe=key)
+
+def analyze(source: Source, *, analysis_rate: Optional[int] = None) -> LoudnessIndex:
+  """
+  Compute the `LoudnessIndex` of `source` without decoding any video.
+
+  :param analysis_rate: If set, measure the loudness on the audio resampled to mono at this rate, see `Chunker`
+  """
+  pts: list[int] = []
+  dbfs: list[float] = []
+  key: list[bool] = []
+  chunker = Chunker(source, analysis_rate=analysis_rate)
+  for batch in batched(chunker.to_chunks(stub_frames(source)), ANALYSIS_BATCH_SIZE):
+    pts.extend(chunk.video_frame.pts for chunk in batch)
+    dbfs.extend(Sound.batch_dbfs([chunk.analysis_sound for chunk in batch]))
+    key.extend(chunk.video_frame.is_keyframe for chunk in batch)
+  logger.debug(f"analyzed {len(pts)} frames")
+  return LoudnessIndex(
+    time_base = source.video_stream.time_base,
+    average_rate = source.video_stream.average_rate,
+    pts       = np.array(pts, dtype=np.int64),
+    dbfs      = np.array(dbfs),
+    key       = np.array(key, dtype=bool),
+    audio_start_pts = chunker.audio_buffer.first_pts or 0,
+  )
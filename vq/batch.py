@@ -0,0 +1,224 @@
+from __future__ import annotations
+from typing import *
+
+from .chunker import BufferLimits
+from .core import cut
+from .cutter import DEFAULT_MAX_HELD_BYTES
+from .sink import HandleWriter
+from .source import FileReader
+from dataclasses import dataclass
+import av
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import glob
+import io
+import logging
+import os
+import time
+
+__all__ = [
+  "BatchJob",
+  "BatchOptions",
+  "BatchResult",
+  "find_inputs",
+  "plan_batch",
+  "run_batch",
+]
+
+logger = logging.getLogger(__name__)
+
+# Extensions of the files picked up from a directory
+VIDEO_EXTENSIONS = {".mkv", ".mp4", ".webm", ".mov", ".avi", ".flv", ".ts", ".m4v"}
+
+@dataclass
+class BatchOptions:
+  """
+  The `cut` options shared by all the jobs of a batch.
+  """
+  tolerance: float
+  after_loud_save_duration: float
+  before_loud_save_duration: float = 0.0
+  max_held_bytes: int = DEFAULT_MAX_HELD_BYTES
+  output_format: Optional[str] = None
+  threads: int = 1 # per codec, the batch itself already runs one job per core
+  analysis_rate: Optional[int] = None
+  buffer_limits: Optional[BufferLimits] = None
+
+@dataclass
+class BatchJob:
+  input_path: str
+  output_path: str
+  duration: float # probed, in seconds, 0 if unknown
+
+@dataclass
+class BatchResult:
+  job: BatchJob
+  skipped: bool = False
+  error: Optional[str] = None
+  seconds: float = 0.0 # wall clock time spent on the job
+
+  @property
+  def ok(self) -> bool:
+    return self.error is None
+
+def find_inputs(specs: Iterable[str]) -> list[str]:
+  """
+  Expand `specs` into input paths. Each spec is a directory (its video files, recursively), a glob pattern, a
+  manifest (a file ending in .txt listing one input per line, blank lines and lines starting with # are ignored) or
+  a path.
+  """
+  paths = []
+  for spec in specs:
+    if os.path.isdir(spec):
+      for dirpath, dirnames, filenames in os.walk(spec):
+        dirnames.sort()
+        for filename in sorted(filenames):
+          if os.path.splitext(filename)[1].lower() in VIDEO_EXTENSIONS:
+            paths.append(os.path.join(dirpath, filename))
+    elif glob.has_magic(spec):
+      paths.extend(sorted(glob.glob(spec, recursive=True)))
+    elif spec.endswith(".txt"):
+      base = os.path.dirname(spec)
+      with io.open(spec) as f:
+        for line in f:
+          line = line.strip()
+          if line and not line.startswith("#"):
+            paths.append(os.path.join(base, line))
+    else:
+      paths.append(spec)
+  # A file listed twice would be cut twice into the same output
+  return list(dict.fromkeys(paths))
+
+def probe_duration(path: str) -> float:
+  try:
+    with av.open(path) as container:
+      if container.duration is not None:
+        return container.duration / av.time_base
+  except av.AVError as e:
+    logger.warning(f"could not probe {path}: {e}")
+  return 0.0
+
+def plan_batch(input_paths: Iterable[str], output_dir: str, *, extension: str = ".mkv") -> list[BatchJob]:
+  """
+  One job per input, writing to `output_dir` under the input's name, ordered longest first so that the longest jobs
+  do not end up running alone at the end of the batch.
+  """
+  jobs = []
+  outputs: dict[str, str] = {}
+  for input_path in input_paths:
+    name = os.path.splitext(os.path.basename(input_path))[0] + extension
+    output_path = os.path.join(output_dir, name)
+    if output_path in outputs:
+      raise ValueError(f"{input_path} and {outputs[output_path]} would both be written to {output_path}")
+    outputs[output_path] = input_path
+    jobs.append(BatchJob(input_path=input_path, output_path=output_path, duration=probe_duration(input_path)))
+  jobs.sort(key=lambda job: job.duration, reverse=True)
+  return jobs
+
+def is_up_to_date(job: BatchJob) -> bool:
+  # Outputs are only moved in place once complete, so an existing output is never a partial one
+  try:
+    return os.path.getmtime(job.output_path) >= os.path.getmtime(job.input_path)
+  except OSError:
+    return False
+
+def _run_job(job: BatchJob, options: BatchOptions) -> BatchResult:
+  start = time.monotonic()
+  # The extension is kept last, as the format is guessed from it like `av.open` does unless set explicitly
+  root, extension = os.path.splitext(job.output_path)
+  tmp_path = root + ".part" + extension
+  try:
+    reader = FileReader(job.input_path)
+    with io.open(tmp_path, "wb") as handle:
+      writer = HandleWriter(handle, format=options.output_format)
+      with reader.open() as source, writer.open_like(source) as sink:
+        source.enable_threading(options.threads)
+        sink.enable_threading(options.threads)
+        cut(
+          source, sink, options.tolerance, options.after_loud_save_duration,
+          before_loud_save_duration = options.before_loud_save_duration,
+          max_held_bytes = options.max_held_bytes,
+          analysis_rate = options.analysis_rate,
+          buffer_limits = options.buffer_limits,
+        )
+    os.replace(tmp_path, job.output_path)
+  except Exception as e:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    return BatchResult(job=job, error=f"{type(e).__name__}: {e}", seconds=time.monotonic() - start)
+  return BatchResult(job=job, seconds=time.monotonic() - start)
+
+def run_batch(
+  jobs: list[BatchJob],
+  options: BatchOptions,
+  *,
+  workers: Optional[int] = None,
+  force: bool = False,
+  on_result: Optional[Callable[[BatchResult], None]] = None,
+  ) -> list[BatchResult]:
+  """
+  Run `jobs` in a pool of `workers` processes (one per core by default), in order. A failing job is reported in its
+  result and does not stop the others, even one whose worker process dies (e.g. killed by the OOM killer), see
+  `_run_pool`.
+
+  :param force: Also run the jobs whose output is already newer than their input
+  :param on_result: Called with the result of each job as soon as it is done
+  """
+  results = []
+  def report(result: BatchResult) -> None:
+    results.append(result)
+    if on_result is not None:
+      on_result(result)
+
+  pending = []
+  for job in jobs:
+    if not force and is_up_to_date(job):
+      report(BatchResult(job=job, skipped=True))
+    else:
+      pending.append(job)
+
+  if pending:
+    os.makedirs(os.path.dirname(os.path.abspath(pending[0].output_path)), exist_ok=True)
+    _run_pool(pending, options, workers or os.cpu_count() or 1, report)
+  return results
+
+def _run_pool(jobs: list[BatchJob], options: BatchOptions, workers: int, report: Callable[[BatchResult], None]) -> None:
+  """
+  Run `jobs` in order, `workers` at a time. A worker process that dies breaks the whole pool, and every job it was
+  running fails with `BrokenProcessPool`. The pool is then made anew: if a single job was running it is the one that
+  killed its worker and fails, otherwise the jobs that were running are run again one at a time to find out which one
+  it was. The jobs that had not started yet go on in the new pool.
+  """
+  waiting = collections.deque(jobs)
+  suspects: Deque[BatchJob] = collections.deque() # were running when a worker died, run alone
+  while waiting or suspects:
+    alone = bool(suspects)
+    queue = suspects if alone else waiting
+    size = 1 if alone else workers
+    running: dict[concurrent.futures.Future, BatchJob] = {}
+    crashed: list[BatchJob] = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=size) as executor:
+      while (queue or running) and not crashed:
+        while queue and len(running) < size:
+          job = queue.popleft()
+          running[executor.submit(_run_job, job, options)] = job
+        done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+        if any(isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool) for future in done):
+          # All the running jobs are done now, one way or the other
+          done, _ = concurrent.futures.wait(running)
+        for future in done:
+          job = running.pop(future)
+          error = future.exception()
+          if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+            crashed.append(job)
+          elif error is not None:
+            report(BatchResult(job=job, error=f"{type(error).__name__}: {error}"))
+          else:
+            report(future.result())
+    if len(crashed) == 1:
+      logger.warning(f"the worker cutting {crashed[0].input_path} died")
+      report(BatchResult(job=crashed[0], error="BrokenProcessPool: the worker process died, e.g. killed for lack of memory"))
+    elif crashed:
+      logger.warning(f"a worker died while {len(crashed)} jobs were running, running them again one at a time")
+      suspects.extend(crashed)
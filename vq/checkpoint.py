@@ -0,0 +1,223 @@
+from __future__ import annotations
+from typing import *
+
+from .chunker import Chunker
+from .concat import concat
+from .core import write_cut_chunks
+from .cutter import Cutter, CutChunk, DEFAULT_MAX_HELD_BYTES
+from .sink import HandleWriter
+from .source import FileReader, Source, SEEK_MARGIN
+from dataclasses import asdict, dataclass, field
+import av
+import io
+import json
+import logging
+import math
+import os
+
+__all__ = [
+  "Checkpoint",
+  "cut_resumable",
+  "DEFAULT_SEGMENT_DURATION",
+]
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 2
+
+# Default of `cut_resumable`'s `segment_duration`
+DEFAULT_SEGMENT_DURATION = 300.0
+
+@dataclass
+class Checkpoint:
+  """
+  Progress of `cut_resumable`: the segments completed so far, and the state to resume cutting right after them.
+  """
+  input: dict    # identity of the input file, a checkpoint of another input is not resumed
+  options: dict  # cutting options, a checkpoint made with other options is not resumed
+  segments: list[str] = field(default_factory=list) # file names of the completed segments, in the work directory
+  finished: bool = False # whether all of the input has been cut into segments
+  # Position of the first frame not yet cut
+  next_frame_index: int = 0
+  next_pts: Optional[int] = None
+  # `Chunker` state, `last_aread` follows from `next_frame_index` and is kept for reference
+  audio_start_pts: Optional[int] = None
+  last_aread: float = 0.0
+  # `Chunker.audio_anchor` of the next frame, which places its audio exactly when resuming, None if unknown
+  audio_anchor: Optional[list[int]] = None
+  # `Cutter` state
+  last_loud_t: Optional[float] = None # None for -inf, which JSON cannot hold
+  last_total_skip_t: float = 0.0
+
+  def save(self, path: str) -> None:
+    # Written to a temporary file first, so that a crash never leaves a partially written checkpoint
+    with open(path + ".tmp", "w") as f:
+      json.dump({"version": CHECKPOINT_VERSION, **asdict(self)}, f, indent=2)
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+  @staticmethod
+  def load(path: str) -> Checkpoint:
+    with open(path) as f:
+      data = json.load(f)
+    if data.pop("version", None) != CHECKPOINT_VERSION:
+      raise ValueError(f"{path} is not a version {CHECKPOINT_VERSION} checkpoint")
+    return Checkpoint(**data)
+
+def input_identity(path: str) -> dict:
+  stat = os.stat(path)
+  return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def cut_resumable(
+  reader: FileReader,
+  writer: HandleWriter,
+  tolerance: float,
+  after_loud_save_duration: float,
+  *,
+  work_dir: str,
+  segment_duration: float = DEFAULT_SEGMENT_DURATION,
+  before_loud_save_duration: float = 0.0,
+  max_held_bytes: int = DEFAULT_MAX_HELD_BYTES,
+  analysis_rate: Optional[int] = None,
+  ) -> None:
+  """
+  Like `vq.cut`, but write the output as segments of about `segment_duration` seconds of input into `work_dir`,
+  recording a `Checkpoint` there after each one. If `work_dir` holds the checkpoint of an interrupted run on the same
+  input with the same options, cutting resumes after its last completed segment instead of from the start. Once all of
+  the input is cut, the segments are concatenated into `writer` without re-encoding, then removed along with the
+  checkpoint. `work_dir` itself is removed too if nothing else is left in it.
+
+  Segments end at input keyframes, so that a resumed run can seek exactly there, and only while no silent chunks are
+  held back for `before_loud_save_duration`.
+  """
+  os.makedirs(work_dir, exist_ok=True)
+  checkpoint_path = os.path.join(work_dir, "checkpoint.json")
+  options = {
+    "tolerance": tolerance,
+    "after_loud_save_duration": after_loud_save_duration,
+    "before_loud_save_duration": before_loud_save_duration,
+    "max_held_bytes": max_held_bytes,
+  }
+  if analysis_rate is not None:
+    options["analysis_rate"] = analysis_rate
+  checkpoint = Checkpoint(input=input_identity(reader.path), options=options)
+  if os.path.exists(checkpoint_path):
+    try:
+      saved = Checkpoint.load(checkpoint_path)
+      if saved.input == checkpoint.input and saved.options == checkpoint.options:
+        checkpoint = saved
+        logger.info(f"resuming after {len(checkpoint.segments)} segments from {checkpoint_path}")
+      else:
+        logger.warning(f"ignoring {checkpoint_path}, made for another input or other options")
+    except (OSError, ValueError, TypeError) as e:
+      logger.warning(f"ignoring unreadable checkpoint {checkpoint_path}: {e}")
+
+  if not checkpoint.finished:
+    _cut_segments(reader, checkpoint, checkpoint_path, work_dir, segment_duration)
+
+  segment_paths = [os.path.join(work_dir, name) for name in checkpoint.segments]
+  if segment_paths:
+    concat(segment_paths, writer)
+  else:
+    logger.warning("every frame was cut, the output is empty")
+  _remove_work_files(work_dir, checkpoint_path, segment_paths)
+
+def _remove_work_files(work_dir: str, checkpoint_path: str, segment_paths: list[str]) -> None:
+  # Only the files written by `cut_resumable` are removed, `work_dir` may hold others
+  for path in segment_paths + [checkpoint_path]:
+    os.remove(path)
+  try:
+    os.rmdir(work_dir)
+  except OSError:
+    logger.debug(f"left {work_dir} in place, it holds other files")
+
+def _cut_segments(
+  reader: FileReader,
+  checkpoint: Checkpoint,
+  checkpoint_path: str,
+  work_dir: str,
+  segment_duration: float,
+  ) -> None:
+  with reader.open() as source:
+    options = dict(checkpoint.options)
+    chunker = Chunker(source, analysis_rate=options.pop("analysis_rate", None))
+    cutter = Cutter(source, **options)
+    if checkpoint.next_pts is None:
+      frames = source.decode()
+    else:
+      # Resume: restore the state, and decode from the keyframe the last segment ended at
+      cutter.last_loud_t = -math.inf if checkpoint.last_loud_t is None else checkpoint.last_loud_t
+      cutter.last_total_skip_t = checkpoint.last_total_skip_t
+      source.seek(checkpoint.next_pts - round(SEEK_MARGIN / source.video_stream.time_base))
+      frames = _frames_from(source.decode(), checkpoint.next_pts)
+      audio_anchor = None if checkpoint.audio_anchor is None else tuple(checkpoint.audio_anchor)
+      chunker.start_at(checkpoint.next_frame_index, checkpoint.audio_start_pts, audio_anchor=audio_anchor)
+
+    frame_index = checkpoint.next_frame_index
+    segment_start: Optional[float] = None
+    segment = _open_segment(source, work_dir, len(checkpoint.segments))
+    for chunk in chunker.to_chunks(frames):
+      frame = chunk.video_frame
+      if segment_start is None:
+        segment_start = frame.time
+      elif frame.key_frame and frame.time - segment_start >= segment_duration and not cutter.held:
+        # The state is the one from before cutting `chunk`, which starts the next segment
+        if _close_segment(segment):
+          checkpoint.segments.append(os.path.basename(segment.path))
+        checkpoint.next_frame_index = frame_index
+        checkpoint.next_pts = frame.pts
+        if checkpoint.audio_start_pts is None:
+          checkpoint.audio_start_pts = chunker.audio_buffer.first_pts
+        checkpoint.last_aread = float(frame_index * chunker.avg_num_samples)
+        checkpoint.audio_anchor = None if chunker.audio_anchor is None else list(chunker.audio_anchor)
+        checkpoint.last_loud_t = None if cutter.last_loud_t == -math.inf else cutter.last_loud_t
+        checkpoint.last_total_skip_t = cutter.last_total_skip_t
+        checkpoint.save(checkpoint_path)
+        logger.info(f"completed segment {len(checkpoint.segments)} up to {frame.time:.3f}s")
+        segment = _open_segment(source, work_dir, len(checkpoint.segments))
+        segment_start = frame.time
+      cut_chunk = CutChunk(video_frame=frame, sound=chunk.sound, dbfs=chunk.analysis_sound.dbfs())
+      write_cut_chunks(segment.sink, cutter.cut(cut_chunk))
+      frame_index += 1
+
+    if _close_segment(segment):
+      checkpoint.segments.append(os.path.basename(segment.path))
+    checkpoint.finished = True
+    checkpoint.save(checkpoint_path)
+
+def _frames_from(frames: Iterable[av.VideoFrame | av.AudioFrame], start_pts: int) -> Generator[av.VideoFrame | av.AudioFrame]:
+  # The audio from before `start_pts` is dropped by `Chunker.start_at`
+  for frame in frames:
+    if isinstance(frame, av.VideoFrame) and frame.pts < start_pts:
+      continue
+    yield frame
+
+@dataclass
+class _Segment:
+  path: str
+  handle: BinaryIO
+  context: ContextManager
+  sink: Any
+
+def _open_segment(source: Source, work_dir: str, number: int) -> _Segment:
+  # A segment left over by an interrupted run is overwritten
+  path = os.path.join(work_dir, f"segment-{number:05d}.mkv")
+  handle = io.open(path, "wb")
+  context = HandleWriter(handle, format="matroska").open_like(source)
+  return _Segment(path=path, handle=handle, context=context, sink=context.__enter__())
+
+def _close_segment(segment: _Segment) -> bool:
+  """
+  Finish writing `segment`, and tell whether it holds any frames. A segment whose every frame was cut is never muxed
+  into, not even its header, so it is removed rather than left for `concat` to fail on.
+  """
+  wrote = segment.sink.num_video_frames > 0
+  segment.context.__exit__(None, None, None)
+  segment.handle.flush()
+  os.fsync(segment.handle.fileno())
+  segment.handle.close()
+  if not wrote:
+    os.remove(segment.path)
+    logger.debug(f"removed {segment.path}, every frame of it was cut")
+  return wrote
@@ -1,51 +1,225 @@
 from __future__ import annotations
 
-from .sound import Sound
+from .sound import Sound, SoundBuffer
 from .source import Source
 from .utils import audio_format_to_dtype
 from dataclasses import dataclass
 from typing import *
 import av
 import collections
+import fractions
 import logging
+import math
 import numpy as np
 
 __all__ = [
+  "BufferLimits",
   "Chunk",
   "Chunker",
+  "ChunkerOverflowError",
+  "FrameStub",
+  "OVERFLOW_POLICIES",
 ]
 
 logger = logging.getLogger(__name__)
 
+# What a `Chunker` does when a buffer goes over its `BufferLimits`:
+# - "error": raise `ChunkerOverflowError`
+# - "silence": pair the buffered video frames with silence instead of waiting for their audio, and drop their audio if
+#   it comes later; audio buffered waiting for video is dropped as with "drop"
+# - "drop": drop the oldest buffered frames or samples, along with what the other stream has for them
+OVERFLOW_POLICIES = ("error", "silence", "drop")
+
+class ChunkerOverflowError(Exception):
+  pass
+
+@dataclass
+class BufferLimits:
+  """
+  Caps on what a `Chunker` buffers of one stream while waiting for the other one, which only depends on how the
+  input is interleaved: late audio piles up video frames, late video piles up audio. Each cap applies to the video and
+  audio buffers separately. None is unbounded.
+  """
+  max_bytes: Optional[int] = None
+  max_frames: Optional[int] = None # for the audio buffer, in video frames' worth of samples
+  overflow: str = "error" # one of `OVERFLOW_POLICIES`
+
+  def __post_init__(self) -> None:
+    if self.overflow not in OVERFLOW_POLICIES:
+      raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, not {self.overflow!r}")
+
+  def exceeded(self, num_frames: float, num_bytes: int) -> bool:
+    if self.max_frames is not None and num_frames > self.max_frames:
+      return True
+    return self.max_bytes is not None and num_bytes > self.max_bytes
+
+def video_frame_bytes(frame: av.VideoFrame | FrameStub) -> int:
+  if isinstance(frame, FrameStub):
+    return 0
+  return sum(plane.buffer_size for plane in frame.planes)
+
+@dataclass
+class FrameStub:
+  """
+  Stands in for a video frame that was demuxed but not decoded. Carries just enough to be chunked and cut.
+  """
+  pts: int
+  time_base: fractions.Fraction
+  is_keyframe: bool = False
+
+  @property
+  def time(self) -> float:
+    # Same arithmetic as `av.Frame.time`
+    return float(self.pts) * self.time_base.numerator / self.time_base.denominator
+
 @dataclass
 class Chunk:
-  video_frame: av.VideoFrame
+  video_frame: av.VideoFrame | FrameStub
   sound: Sound
+  analysis: Optional[Sound] = None # low-rate mono copy of `sound`, if the `Chunker` has an analysis rate
 
   @property
   def time(self) -> float:
     return self.video_frame.time
 
+  @property
+  def analysis_sound(self) -> Sound:
+    """
+    The sound to measure the loudness of: `analysis` if there is one, `sound` otherwise.
+    """
+    return self.sound if self.analysis is None else self.analysis
+
+class AnalysisBuffer:
+  """
+  A mono float32 copy of the audio resampled to a low rate, for loudness analysis only. Kept in step with the samples
+  read and dropped from an `AudioBuffer`, whose positions are given in samples of the source's rate.
+  """
+  def __init__(self, source: Source, rate: int) -> None:
+    self.resampler = av.AudioResampler(format="flt", layout="mono", rate=rate)
+    self.buffer = SoundBuffer(num_channels=1, dtype=np.float32)
+    self.ratio = rate / source.audio_stream.rate
+    self.consumed = 0 # samples read or skipped
+    self._missing = 0 # samples skipped or read as silence before they were received, to drop once they are
+    self._flushed = False
+
+  def send_frame(self, frame: Optional[av.AudioFrame]) -> None:
+    """
+    Resample and buffer `frame`, or flush the resampler if None.
+    """
+    for resampled in self.resampler.resample(frame):
+      self.buffer.push(resampled.to_ndarray())
+    self._flushed = frame is None
+    self._skip()
+
+  def skip_to(self, source_position: int) -> None:
+    # The resampler delays its output a little, so the samples to skip may still be to come
+    num_samples = int(source_position * self.ratio) - self.consumed
+    if num_samples > 0:
+      self.consumed += num_samples
+      self._missing += num_samples
+      self._skip()
+
+  @property
+  def buffered_bytes(self) -> int:
+    return self.buffer.num_samples * self.buffer.num_channels * self.buffer.dtype.itemsize
+
+  def _skip(self) -> None:
+    num_samples = min(self.buffer.num_samples, self._missing)
+    if num_samples > 0:
+      self.buffer.skip(num_samples)
+      self._missing -= num_samples
+
+  def can_read_to(self, source_position: int) -> bool:
+    if self._flushed:
+      return True # whatever is missing at the very end is made up with silence
+    return self._missing == 0 and int(source_position * self.ratio) - self.consumed <= self.buffer.num_samples
+
+  def read_to(self, source_position: int) -> Sound:
+    num_samples = int(source_position * self.ratio) - self.consumed
+    self.consumed += num_samples
+    available = min(num_samples, self.buffer.num_samples)
+    read = self.buffer.read(available)
+    if available < num_samples:
+      if not self._flushed:
+        self._missing += num_samples - available
+      return Sound(np.pad(read.samples, ((0, 0), (0, num_samples - available))))
+    return read
+
 class AudioBuffer:
-  def __init__(self, source: Source) -> None:
+  def __init__(self, source: Source, *, analysis_rate: Optional[int] = None) -> None:
     self.source = source # only here for extracting information
-    self.buffer = Sound.allocate(
+    self.analysis = None if analysis_rate is None else AnalysisBuffer(source, analysis_rate)
+    self.position = 0 # samples read or dropped
+    self.buffer = SoundBuffer(
       num_channels = self.source.audio_stream.channels,
-      num_samples  = 0,
       dtype        = audio_format_to_dtype(source.audio_stream.format),
     )
     self.got_first: bool = False
     self.pts_per_sample = 1.0 / (source.audio_stream.rate * source.audio_stream.time_base)
     self.current_pts: float = None 
-    self._drop_until_pts: int = 0
+    self.first_pts: Optional[int] = None
+    self._drop_until_pts: float = -math.inf # audio that starts before 0, like an encoder's priming, is kept too
+    self._missing = 0 # samples skipped or read as silence before they were received, to drop once they are
+    # (pts, position of the first sample) of the frames received, from the one holding the next sample to read
+    self._frame_starts: Deque[tuple[int, int]] = collections.deque()
+    self._start_pts: Optional[int] = None # frames before this pts are ignored, see `start_at_anchor`
 
   def send_frame(self, frame: av.AudioFrame) -> None:
-    self.buffer = self.buffer + Sound(frame.to_ndarray())
+    if self._start_pts is not None:
+      if frame.pts < self._start_pts:
+        return
+      if frame.pts != self._start_pts:
+        logger.warning(f"no audio frame at pts {self._start_pts} to start from, starting from the one at {frame.pts}")
+      self._start_pts = None
+    if frame.pts is not None:
+      self._frame_starts.append((frame.pts, self.position + self.buffer.num_samples - self._missing))
+      self._trim_frame_starts()
+    self.buffer.push(frame.to_ndarray())
+    if self.analysis is not None:
+      self.analysis.send_frame(frame)
     if not self.got_first:
-      self.current_pts = frame.pts # set current_pts to that of the very first audio frame
+      # set current_pts to that of the very first audio frame, past the samples already skipped or read as silence
+      self.current_pts = frame.pts + self.position * self.pts_per_sample
+      self.first_pts = frame.pts
       self.got_first = True
+    missing = min(self.buffer.num_samples, self._missing)
+    if missing > 0:
+      self.buffer.skip(missing)
+      self._missing -= missing
     self.consider_drop()
 
+  @property
+  def buffered_bytes(self) -> int:
+    num_bytes = self.buffer.num_samples * self.buffer.num_channels * self.buffer.dtype.itemsize
+    if self.analysis is not None:
+      num_bytes += self.analysis.buffered_bytes
+    return num_bytes
+
+  def anchor(self) -> Optional[tuple[int, int]]:
+    """
+    Where the next sample to read is, as the pts of the frame holding it and the number of samples before it in that
+    frame, or None if that frame was not received yet. Unlike a pts, which the stream's time base may round, this
+    places the sample exactly, see `start_at_anchor`.
+    """
+    self._trim_frame_starts()
+    if not self._frame_starts or self._frame_starts[0][1] > self.position:
+      return None
+    pts, start = self._frame_starts[0]
+    return pts, self.position - start
+
+  def start_at_anchor(self, pts: int, offset: int) -> None:
+    """
+    Start reading from an `anchor`: at the frame at `pts`, `offset` samples into it, ignoring the frames before it.
+    Must be called before any frame is sent.
+    """
+    assert not self.got_first
+    self._start_pts = pts
+    self.skip_samples(offset)
+
+  def _trim_frame_starts(self) -> None:
+    while len(self._frame_starts) > 1 and self._frame_starts[1][1] <= self.position:
+      self._frame_starts.popleft()
+
   def drop_until_pts(self, until_pts) -> None:
     assert self._drop_until_pts <= until_pts
     self._drop_until_pts = until_pts
@@ -53,45 +227,122 @@ class AudioBuffer:
   def consider_drop(self):
     want_to_drop = max(0, self._drop_until_pts - self.current_pts) / self.pts_per_sample
     curr_to_drop = int(min(want_to_drop, self.buffer.num_samples))
-    self.receive_samples(curr_to_drop)
+    self.buffer.skip(curr_to_drop)
+    self.current_pts += float(curr_to_drop * self.pts_per_sample)
+    self.position += curr_to_drop
+    if self.analysis is not None and curr_to_drop > 0:
+      self.analysis.skip_to(self.position)
 
-  def receive_samples(self, num_samples: int) -> Sound:
-    read = self.buffer[:num_samples]
-    self.buffer = self.buffer[num_samples:]
-    self.current_pts += float(num_samples * self.pts_per_sample)
-    return read
+  def receive_samples(self, num_samples: int, *, pad: bool = False) -> tuple[Sound, Optional[Sound]]:
+    """
+    Read `num_samples` samples, and their analysis samples if there is an analysis rate.
+
+    :param pad: Read silence in place of the samples not received yet, which are then dropped when they are
+    """
+    available = min(num_samples, self.buffer.num_samples) if pad else num_samples
+    read = self.buffer.read(available)
+    if available < num_samples:
+      read = Sound(np.pad(read.samples, ((0, 0), (0, num_samples - available))))
+      self._missing += num_samples - available
+    self._advance(num_samples)
+    if self.analysis is None:
+      return read, None
+    return read, self.analysis.read_to(self.position)
+
+  def skip_samples(self, num_samples: int) -> None:
+    """
+    Drop the next `num_samples` samples, including the ones not received yet.
+    """
+    available = min(num_samples, self.buffer.num_samples)
+    self.buffer.skip(available)
+    self._missing += num_samples - available
+    self._advance(num_samples)
+    if self.analysis is not None:
+      self.analysis.skip_to(self.position)
+
+  def _advance(self, num_samples: int) -> None:
+    if self.current_pts is not None:
+      self.current_pts += float(num_samples * self.pts_per_sample)
+    self.position += num_samples
 
   def can_receive_samples(self, num_samples: int) -> bool:
+    if self.analysis is not None and not self.analysis.can_read_to(self.position + num_samples):
+      return False
     return num_samples <= self.buffer.num_samples
 
+  def flush(self) -> None:
+    """
+    Called at the end of the stream, to get the last samples out of the resampler.
+    """
+    if self.analysis is not None:
+      self.analysis.send_frame(None)
+
 class VideoBuffer:
   def __init__(self, src: Source) -> None:
     self.src = src # only here for extracting information
     self.buffer: Deque[av.VideoFrame] = collections.deque()
+    self.buffered_bytes = 0
     self.got_first = False
+    self._missing = 0 # frames skipped before they were received, to drop once they are
 
   def send_frame(self, frame: av.VideoFrame) -> None:
-    self.buffer.append(frame)
     if not self.got_first:
       self.got_first = True
+    if self._missing > 0:
+      self._missing -= 1
+      return
+    self.buffer.append(frame)
+    self.buffered_bytes += video_frame_bytes(frame)
 
   def can_receive_one_frame(self) -> bool:
     return len(self.buffer) > 0
 
   def receive_one_frame(self) -> av.VideoFrame:
-    return self.buffer.popleft()
+    frame = self.buffer.popleft()
+    self.buffered_bytes -= video_frame_bytes(frame)
+    return frame
+
+  def skip_one_frame(self) -> None:
+    """
+    Drop the next frame, even if it was not received yet.
+    """
+    if self.buffer:
+      self.receive_one_frame()
+    else:
+      self._missing += 1
 
 class Chunker:
-  def __init__(self, source: Source) -> None:
+  def __init__(
+    self,
+    source: Source,
+    *,
+    analysis_rate: Optional[int] = None,
+    limits: Optional[BufferLimits] = None,
+    video_rate: Optional[fractions.Fraction] = None,
+  ) -> None:
+    """
+    :param analysis_rate: If set, also give each chunk its sound resampled to mono float32 at this rate, see `Chunk.analysis`
+    :param limits: If set, cap the frames buffered while waiting for the other stream, see `BufferLimits`
+    :param video_rate: Rate of the video frames sent, if they were decimated (see `vq.shape.decimate`) from the source's average rate. Each frame is then paired with as much more audio
+    """
     self.source = source # only here for extracting information
-    self.audio_buffer = AudioBuffer(source)
+    self.audio_buffer = AudioBuffer(source, analysis_rate=analysis_rate)
     self.video_buffer = VideoBuffer(source)
+    self.limits = limits
     self.aligning = True
     self.last_aread = 0
-    self.avg_num_samples = source.audio_stream.rate / source.video_stream.average_rate
+    self.video_rate = video_rate or source.video_stream.average_rate
+    self.avg_num_samples = source.audio_stream.rate / self.video_rate
+    self.num_overflowed = 0 # video frames paired with silence or dropped, and audio frames' worth dropped
+    self.audio_anchor: Optional[tuple[int, int]] = None # `AudioBuffer.anchor` of the audio of the last chunk received
+    self._overflowing = False
+
+  @property
+  def buffered_bytes(self) -> int:
+    return self.video_buffer.buffered_bytes + self.audio_buffer.buffered_bytes
 
-  def send_frame(self, frame: av.VideoFrame | av.AudioFrame) -> None:
-    if isinstance(frame, av.VideoFrame):
+  def send_frame(self, frame: av.VideoFrame | FrameStub | av.AudioFrame) -> None:
+    if isinstance(frame, (av.VideoFrame, FrameStub)):
       self.video_buffer.send_frame(frame)
     elif isinstance(frame, av.AudioFrame):
       self.audio_buffer.send_frame(frame)
@@ -100,26 +351,102 @@ class Chunker:
 
   def receive_chunks(self) -> Generator[Chunk]:
     while True:
+      asamples = int(self.last_aread + self.avg_num_samples) - int(self.last_aread)
       if not self.video_buffer.can_receive_one_frame(): # video buffer has no frames to read
+        if self.limits is not None and self._audio_overflows():
+          self._overflow("audio")
+          self.audio_buffer.skip_samples(asamples)
+          self.video_buffer.skip_one_frame()
+          self.last_aread += self.avg_num_samples
+          continue
         break
 
-      asamples = int(self.last_aread + self.avg_num_samples) - int(self.last_aread)
+      pad = False
       if not self.audio_buffer.can_receive_samples(asamples): # audio buffer has insufficient sample count
-        break
+        if self.limits is None or not self._video_overflows():
+          break
+        self._overflow("video")
+        if self.limits.overflow == "drop":
+          self.video_buffer.receive_one_frame()
+          self.audio_buffer.skip_samples(asamples)
+          self.last_aread += self.avg_num_samples
+          continue
+        pad = True
+      else:
+        self._overflowing = False
 
       v = self.video_buffer.receive_one_frame()
-      a = self.audio_buffer.receive_samples(asamples)
+      self.audio_anchor = self.audio_buffer.anchor()
+      a, analysis = self.audio_buffer.receive_samples(asamples, pad=pad)
       self.last_aread += self.avg_num_samples
-      yield Chunk(video_frame=v, sound=a)
+      yield Chunk(video_frame=v, sound=a, analysis=analysis)
+
+  def _video_overflows(self) -> bool:
+    return self.limits.exceeded(len(self.video_buffer.buffer), self.video_buffer.buffered_bytes)
+
+  def _audio_overflows(self) -> bool:
+    num_frames = self.audio_buffer.buffer.num_samples / self.avg_num_samples
+    return self.limits.exceeded(num_frames, self.audio_buffer.buffered_bytes)
+
+  def _overflow(self, stream: str) -> None:
+    if self.limits.overflow == "error":
+      raise ChunkerOverflowError(
+        f"buffered {len(self.video_buffer.buffer)} video frames and {self.audio_buffer.buffer.num_samples} audio"
+        f" samples ({self.buffered_bytes} bytes) waiting for the other stream, over {self.limits}"
+      )
+    self.num_overflowed += 1
+    if not self._overflowing:
+      # Warned once per overflow, not for every frame of it
+      other = "audio" if stream == "video" else "video"
+      action = "pairing video with silence" if stream == "video" and self.limits.overflow == "silence" else f"dropping {stream}"
+      logger.warning(f"{stream} buffer over its limits waiting for {other} at {self.last_aread / self.source.audio_stream.rate:.3f}s, {action}")
+      self._overflowing = True
+
+  def start_at(self, frame_index: int, audio_start_pts: int, *, audio_anchor: Optional[tuple[int, int]] = None) -> None:
+    """
+    Pair the next video frame sent as the `frame_index`-th frame of a stream whose audio starts at `audio_start_pts`.
+    Used when decoding starts from a seek instead of from the beginning of the stream.
+
+    :param audio_anchor: If set, the `audio_anchor` of the `frame_index`-th chunk of an earlier run, which the audio
+      then starts from exactly instead of from where its pts, rounded to the stream's time base, puts it
+    """
+    self.last_aread = frame_index * self.avg_num_samples
+    if audio_anchor is not None:
+      self.audio_buffer.start_at_anchor(*audio_anchor)
+    else:
+      self.audio_buffer.drop_until_pts(audio_start_pts + int(self.last_aread) * self.audio_buffer.pts_per_sample)
+
+  def start_at_first_video_frame(self, stream: Iterable[av.VideoFrame | FrameStub | av.AudioFrame]) -> Generator[av.VideoFrame | FrameStub | av.AudioFrame]:
+    """
+    Pass `stream` through, holding back its audio until its first video frame, which is then paired as the frame at
+    its position in the video stream with `start_at`. For streams that start from a seek at an unknown frame.
+    """
+    held: Optional[list[av.AudioFrame]] = []
+    for frame in stream:
+      if held is not None:
+        if isinstance(frame, av.AudioFrame):
+          held.append(frame)
+          continue
+        video_stream = self.source.video_stream
+        frame_index = round((frame.pts - (video_stream.start_time or 0)) * video_stream.time_base * self.video_rate)
+        self.start_at(frame_index, self.source.audio_stream.start_time or 0)
+        yield from held
+        held = None
+      yield frame
 
-  def to_chunks(self, stream: Generator[av.VideoFrame | av.AudioFrame]) -> Generator[Chunk]:
+  def to_chunks(self, stream: Generator[av.VideoFrame | FrameStub | av.AudioFrame]) -> Generator[Chunk]:
     for frame in stream:
       self.send_frame(frame)
       yield from self.receive_chunks()
+    self.audio_buffer.flush()
+    yield from self.receive_chunks()
 
   """
   Return the (LIKELY) number of chunks that will be produced. Helpful for making progress bars.
   """
   @property
-  def num_chunks(self) -> int:
-    return self.source.num_vframes
+  def num_chunks(self) -> Optional[int]:
+    num_vframes = self.source.num_vframes
+    if num_vframes is None or self.video_rate == self.source.video_stream.average_rate:
+      return num_vframes
+    return round(num_vframes * self.video_rate / self.source.video_stream.average_rate)
@@ -6,14 +6,12 @@ from .utils import format_time, parse_hhmmss
 from typing import *
 import argparse
 import av
-import cv2
-import datetime
 import io
 import logging
 import math
-import subprocess
+import os
 import sys
-import tqdm
+import time
 import vq
 
 logger = logging.getLogger(__name__)
@@ -24,6 +22,17 @@ LOG_LEVELS = {
   "error": logging.ERROR,
 }
 
+def parse_time(string: str) -> float:
+  # Seconds, or HH:MM:SS.NNN
+  try:
+    return float(string)
+  except ValueError:
+    pass
+  try:
+    return parse_hhmmss(string).total_seconds()
+  except ValueError as e:
+    raise argparse.ArgumentTypeError(str(e))
+
 def parse_command_line() -> argparse.Namespace:
   parser = argparse.ArgumentParser(
       "vq",
@@ -43,10 +52,42 @@ def parse_command_line() -> argparse.Namespace:
       "-m", "--after-loud-save-duration",
       type=float, default=0.3,
       help="Do not skip a silent chunk if between it and the most recent loud chunk is less than this amount of seconds")
+  parser.add_argument(
+      "-b", "--before-loud-save-duration",
+      type=float, default=0.0,
+      help="Do not skip a silent chunk if between it and the next loud chunk is less than this amount of seconds. Delays the output by as much")
+  parser.add_argument(
+      "--analysis-rate",
+      type=int, default=None,
+      help="Measure loudness on the audio resampled to mono at this rate (e.g. 16000), which is faster and independent of the sample format. The output audio is unaffected.")
+  parser.add_argument(
+      "--max-held-memory",
+      type=float, default=vq.DEFAULT_MAX_HELD_BYTES / 2**20,
+      help="Hold at most this many MiB of silent video for --before-loud-save-duration, older silence is skipped instead")
+  parser.add_argument(
+      "--max-buffer-memory",
+      type=float, default=None,
+      help="Buffer at most this many MiB of video, and as many of audio, while waiting for the other stream of an input that interleaves them badly. Unbounded by default.")
+  parser.add_argument(
+      "--max-buffer-frames",
+      type=int, default=None,
+      help="Buffer at most this many video frames, and as many frames' worth of audio, while waiting for the other stream. Unbounded by default.")
+  parser.add_argument(
+      "--buffer-overflow",
+      choices=vq.OVERFLOW_POLICIES, default="error",
+      help="What to do when --max-buffer-memory or --max-buffer-frames is exceeded: 'error' stops, 'silence' gives the waiting video frames silent audio, 'drop' drops the oldest frames with a warning.")
   parser.add_argument(
       "-f", "--output-format",
       type=str, default=None,
       help="Destination container format, defaults to 'matroska' if dest is - (stdout).")
+  parser.add_argument(
+      "--latency-profile",
+      choices=vq.LATENCY_PROFILES.keys(), default="quality",
+      help="'live' configures the encoder and muxer for the lowest latency when piping into a player, 'quality' for the best compression.")
+  parser.add_argument(
+      "--latency-target",
+      type=float, default=None,
+      help="Warn if the 95th percentile latency between reading a frame and writing it out exceeds this many milliseconds.")
   parser.add_argument(
       "-z", "--font-scale",
       type=float, default=0.4,
@@ -56,6 +97,107 @@ def parse_command_line() -> argparse.Namespace:
       action="store_true",
       help="Draw info at the bottom of the video?"
       )
+  parser.add_argument(
+      "--start",
+      type=parse_time, default=None,
+      help="Only process the input from this time on (seconds or HH:MM:SS.NNN). File inputs are seeked, so the part before it is not decoded.")
+  parser.add_argument(
+      "--end",
+      type=parse_time, default=None,
+      help="Only process the input up to this time (seconds or HH:MM:SS.NNN).")
+  parser.add_argument(
+      "--scale",
+      type=float, default=None,
+      help="Scale the output video down by this factor (e.g. 0.5), in the decoding thread before anything else touches the frames. Dimensions are rounded to even numbers.")
+  parser.add_argument(
+      "--max-height",
+      type=int, default=None,
+      help="Scale the output video down to at most this height (e.g. 720), keeping its aspect ratio. Smaller videos are not scaled up.")
+  parser.add_argument(
+      "--fps",
+      type=float, default=None,
+      help="Drop video frames to output at most this frame rate (e.g. 15). Dropped frames are never converted nor encoded. The audio is unaffected.")
+  parser.add_argument(
+      "--tee",
+      type=str, action="append", default=[],
+      help="Also write the output to this file ('-' for stdout), in the format its extension tells, from the same encoding. Can be given several times.")
+  parser.add_argument(
+      "--output-buffer",
+      type=float, default=vq.DEFAULT_OUTPUT_BUFFER_SIZE / 2**20,
+      help="With --tee, let each output fall at most this many MiB behind the encoder. Beyond that, outputs to files hold up encoding, and outputs to pipes (e.g. a paused player) skip ahead to the next keyframe.")
+  parser.add_argument(
+      "--edl",
+      choices=vq.EDL_FORMATS.keys(), default=None,
+      help="Instead of a video, write the kept parts of the input as an edit list for a player: 'mpv' (mpv EDL), 'ffconcat' (ffmpeg concat script) or 'json'. Only the audio is decoded.")
+  parser.add_argument(
+      "--remux",
+      action="store_true",
+      help="Decode only the audio to decide what to cut, then stream-copy the kept video without re-encoding it. Cuts snap to keyframes, and the input is re-encoded instead if that would keep too much more, see --remux-max-extra. Only works on file inputs."
+      )
+  parser.add_argument(
+      "--remux-max-extra",
+      type=float, default=vq.DEFAULT_MAX_REMUX_EXTRA,
+      help="With --remux, the share of the kept duration that snapping cuts to keyframes may add before the input is re-encoded instead.")
+  parser.add_argument(
+      "--lookahead",
+      type=float, default=None,
+      help="Decide what to cut from the audio before decoding the video, so that video which is cut is not decoded. Holds this many seconds of undecoded video (plus a GOP) beyond what is still waiting for its audio.")
+  parser.add_argument(
+      "--threads",
+      type=int, default=0,
+      help="Number of threads used by each decoder and encoder, 0 lets the codecs decide.")
+  parser.add_argument(
+      "--queue-size",
+      type=int, default=16,
+      help="Decode, analyze and encode in separate threads connected by queues of this many frames. 0 runs everything in one thread.")
+  parser.add_argument(
+      "-j", "--jobs",
+      type=int, default=1,
+      help="Cut and encode this many segments of the input in parallel processes. Only works on file inputs.")
+  parser.add_argument(
+      "--resume-dir",
+      type=str, default=None,
+      help="Cut the input in segments saved to this directory along with a checkpoint, so that an interrupted run started again with the same directory resumes after the last completed segment. Only works on file inputs.")
+  parser.add_argument(
+      "--segment-duration",
+      type=float, default=vq.DEFAULT_SEGMENT_DURATION,
+      help="Seconds of input per segment with --resume-dir.")
+  parser.add_argument(
+      "--prefetch-size",
+      type=float, default=vq.DEFAULT_PREFETCH_SIZE / 2**20,
+      help="Read YouTube inputs up to this many MiB ahead of the decoder, which absorbs download stalls. 0 disables prefetching.")
+  parser.add_argument(
+      "--prefetch-dir",
+      type=str, default=None,
+      help="Keep the data prefetched by --prefetch-size in a temporary file in this directory instead of memory.")
+  parser.add_argument(
+      "--probe-size",
+      type=int, default=None,
+      help="Read at most this many bytes of YouTube inputs to detect their streams before decoding starts. Lower values start the output sooner. Defaults to FFmpeg's 5000000.")
+  parser.add_argument(
+      "--analyze-duration",
+      type=float, default=None,
+      help="Read at most this many seconds of YouTube inputs to detect their streams before decoding starts. Defaults to FFmpeg's 5.")
+  parser.add_argument(
+      "--ytdl-command",
+      type=str, default="yt-dlp",
+      help="Command used to download YouTube inputs.")
+  parser.add_argument(
+      "--stats-file",
+      type=str, default=None,
+      help="Periodically export per-stage timings, queue depths, realtime factor and percent cut to this file.")
+  parser.add_argument(
+      "--stats-format",
+      choices=["jsonl", "prometheus"], default="jsonl",
+      help="'jsonl' appends a JSON object per export to --stats-file, 'prometheus' rewrites it for the node exporter's textfile collector.")
+  parser.add_argument(
+      "--stats-interval",
+      type=float, default=5.0,
+      help="Seconds between exports to --stats-file.")
+  parser.add_argument(
+      "--progress",
+      action="store_true",
+      help="Show a progress bar on stderr.")
   parser.add_argument(
       "input",
       type=str,
@@ -64,20 +206,98 @@ def parse_command_line() -> argparse.Namespace:
       "output",
       type=str, nargs="?", default="-",
       help="Set the output (can either be a file path, or '-' for stdout).")
-  return parser.parse_args()
+  args = parser.parse_args()
+  if args.remux and args.draw_info:
+    parser.error("--remux cannot be used with --draw-info, as nothing is re-encoded")
+  if args.remux_max_extra < 0:
+    parser.error("--remux-max-extra cannot be negative")
+  if args.before_loud_save_duration < 0:
+    parser.error("--before-loud-save-duration cannot be negative")
+  if args.analysis_rate is not None and args.analysis_rate <= 0:
+    parser.error("--analysis-rate must be positive")
+  if args.max_buffer_memory is not None and args.max_buffer_memory <= 0:
+    parser.error("--max-buffer-memory must be positive")
+  if args.max_buffer_frames is not None and args.max_buffer_frames < 1:
+    parser.error("--max-buffer-frames must be at least 1")
+  if args.lookahead is not None and args.lookahead <= args.before_loud_save_duration:
+    parser.error("--lookahead must be longer than --before-loud-save-duration")
+  if args.threads < 0:
+    parser.error("--threads cannot be negative")
+  if args.queue_size < 0:
+    parser.error("--queue-size cannot be negative")
+  if args.jobs < 1:
+    parser.error("--jobs must be at least 1")
+  if args.jobs > 1 and (args.remux or args.draw_info):
+    parser.error("--jobs cannot be used with --remux or --draw-info")
+  if args.start is not None and args.start < 0:
+    parser.error("--start cannot be negative")
+  if args.start is not None and args.end is not None and args.end <= args.start:
+    parser.error("--end must be after --start")
+  if (args.start is not None or args.end is not None) and (args.remux or args.jobs > 1):
+    parser.error("--start and --end cannot be used with --remux or --jobs")
+  if args.scale is not None and not 0 < args.scale <= 1:
+    parser.error("--scale must be in (0, 1]")
+  if args.max_height is not None and args.max_height < 2:
+    parser.error("--max-height must be at least 2")
+  if args.fps is not None and args.fps <= 0:
+    parser.error("--fps must be positive")
+  if (args.scale is not None or args.max_height is not None or args.fps is not None) and (args.remux or args.jobs > 1 or args.resume_dir is not None or args.edl is not None):
+    parser.error("--scale, --max-height and --fps cannot be used with --remux, --jobs, --resume-dir or --edl")
+  if args.tee and (args.remux or args.jobs > 1 or args.resume_dir is not None or args.edl is not None):
+    parser.error("--tee cannot be used with --remux, --jobs, --resume-dir or --edl")
+  if [args.output, *args.tee].count("-") > 1:
+    parser.error("stdout can only be given as one output")
+  if args.output_buffer <= 0:
+    parser.error("--output-buffer must be positive")
+  if args.edl is not None and (args.remux or args.jobs > 1 or args.draw_info or args.resume_dir is not None or args.lookahead is not None):
+    parser.error("--edl cannot be used with --remux, --jobs, --draw-info, --resume-dir or --lookahead")
+  if args.resume_dir is not None and (args.remux or args.jobs > 1 or args.lookahead is not None or args.draw_info or args.start is not None or args.end is not None):
+    parser.error("--resume-dir cannot be used with --remux, --jobs, --lookahead, --draw-info, --start or --end")
+  if args.segment_duration <= 0:
+    parser.error("--segment-duration must be positive")
+  if args.probe_size is not None and args.probe_size < 32:
+    parser.error("--probe-size must be at least 32")
+  if args.analyze_duration is not None and args.analyze_duration < 0:
+    parser.error("--analyze-duration cannot be negative")
+  if args.prefetch_size < 0:
+    parser.error("--prefetch-size cannot be negative")
+  if (args.max_buffer_memory is not None or args.max_buffer_frames is not None) and (args.remux or args.jobs > 1 or args.resume_dir is not None or args.edl is not None):
+    parser.error("--max-buffer-memory and --max-buffer-frames cannot be used with --remux, --jobs, --resume-dir or --edl")
+  if args.stats_interval <= 0:
+    parser.error("--stats-interval must be positive")
+  if (args.stats_file is not None or args.progress) and (args.remux or args.jobs > 1):
+    parser.error("--stats-file and --progress cannot be used with --remux or --jobs")
+  return args
+
+def make_buffer_limits(args: argparse.Namespace) -> Optional[vq.BufferLimits]:
+  if args.max_buffer_memory is None and args.max_buffer_frames is None:
+    return None
+  return vq.BufferLimits(
+    max_bytes = None if args.max_buffer_memory is None else int(args.max_buffer_memory * 2**20),
+    max_frames = args.max_buffer_frames,
+    overflow = args.buffer_overflow,
+  )
 
 def make_reader(args: argparse.Namespace) -> Reader:
   if args.input.startswith("https://"):
     # also handles the '-F -' logic
     logger.info(f"detected source input as from YouTube url {args.input}")
-    return YtdlReader(args.input)
+    return YtdlReader(
+      args.input,
+      command = args.ytdl_command,
+      prefetch_size = int(args.prefetch_size * 2**20),
+      prefetch_dir = args.prefetch_dir,
+      start = args.start,
+      end = args.end,
+      probe_size = args.probe_size,
+      analyze_duration = args.analyze_duration,
+    )
   else:
     logger.info(f"detected source input as file input")
-    return FileReader(args.input)
+    return FileReader(args.input, start=args.start, end=args.end)
 
-def make_writer(args: argparse.Namespace) -> Writer:
-  format: str = args.output_format
-  if args.output == "-":
+def make_handle_writer(args: argparse.Namespace, output: str, format: Optional[str], latency: Optional[vq.LatencyMeter] = None) -> HandleWriter:
+  if output == "-":
     # Output is stdout
     if format is None:
       format = "matroska"
@@ -85,8 +305,24 @@ def make_writer(args: argparse.Namespace) -> Writer:
     handle = sys.stdout.buffer
   else:
     # Output is (probably) a file
-    handle = io.open(args.output, "wb")
-  return HandleWriter(handle, format=format)
+    handle = io.open(output, "wb")
+  return HandleWriter(
+    handle,
+    format = format,
+    latency_profile = args.latency_profile,
+    latency = latency,
+    scale = args.scale,
+    max_height = args.max_height,
+    fps = args.fps,
+  )
+
+def make_writer(args: argparse.Namespace, latency: Optional[vq.LatencyMeter] = None) -> Writer:
+  writer = make_handle_writer(args, args.output, args.output_format, latency)
+  if not args.tee:
+    return writer
+  # The format of the other outputs is guessed from their file name
+  writers = [writer] + [make_handle_writer(args, output, None) for output in args.tee]
+  return vq.TeeWriter(writers, max_buffered_bytes=int(args.output_buffer * 2**20))
 
 class InfoDrawer:
   def __init__(self, source: Source, args: argparse.Namespace):
@@ -97,36 +333,34 @@ class InfoDrawer:
     self.total_cut_duration: float = 0
     self.last_cut_time: float = None
     self.last_cut_duration: float = 0
+    # Imported here as it imports cv2, which is slow to import and only needed to draw
+    from .overlay import TextOverlay
+    self.overlay = TextOverlay(args.font_scale)
 
-  def on_callback(self, cut_chunk: vq.CutChunk, frame: vq.RgbFrame) -> vq.RgbFrame:
+  def on_callback(self, cut_chunk: vq.CutChunk, frame: av.VideoFrame) -> av.VideoFrame:
     # Update statistics
     if cut_chunk.prev_cut_duration is not None:
       self.total_cut_duration += cut_chunk.prev_cut_duration
       self.last_cut_duration = cut_chunk.prev_cut_duration
       self.last_cut_time = cut_chunk.time
 
-    # Draw on frame
-    frame_height, frame_width, _ = frame.shape
-
-    def draw_line(at_line: int, string: str, color) -> Noen:
-      bottom_pad = 5 * self.args.font_scale
-      line_height = 25 * self.args.font_scale
-      y = int(frame_height - bottom_pad - (bottom_pad + line_height) * at_line)
-      cv2.putText(frame, string, (0, y), cv2.FONT_HERSHEY_SIMPLEX, self.args.font_scale, (0, 0, 0), 2)
-      cv2.putText(frame, string, (0, y), cv2.FONT_HERSHEY_SIMPLEX, self.args.font_scale, color)
+    # Lines of info, from the bottom of the frame up, with their RGB colors
+    lines = []
 
     # Draw realtime info
     realtime = format_time(cut_chunk.time)
     totalcut = format_time(self.total_cut_duration)
-    draw_line(0, f"realtime={realtime}", (255, 255, 255))
+    lines.append((f"realtime={realtime}", (255, 255, 255)))
 
     # brightness calculation
     factor = 0.05
     bright = factor ** (cut_chunk.time - (self.last_cut_time or -math.inf))
 
     # Draw totalcut info
-    cut_percent = self.total_cut_duration/(cut_chunk.time + 1/self.source.video_stream.average_rate)*100
-    draw_line(1, f"totalcut={totalcut}[{cut_percent:.03f}%]", (255 * (1-bright), 255, 255))
+    range_start = self.source.start if self.source.start is not None else self.source.start_time
+    processed_duration = cut_chunk.time - range_start + 1/self.source.video_stream.average_rate
+    cut_percent = self.total_cut_duration/processed_duration*100
+    lines.append((f"totalcut={totalcut}[{cut_percent:.03f}%]", (255 * (1-bright), 255, 255)))
 
     # Draw recent cut info
     text: str
@@ -134,18 +368,317 @@ class InfoDrawer:
       text = f"[never cut]"
     else:
       text = f"[cut +{format_time(self.last_cut_duration)}@{format_time(self.last_cut_time)}]"
-    draw_line(2, text, (0, 255*bright, 255*bright))
+    lines.append((text, (0, 255*bright, 255*bright)))
 
     # Draw dBFS info, and the color shall be reflective of how loud it is with respect to the specified tolerance level
     max_diff = 20
-    diff  = min(max_diff, cut_chunk.dbfs - self.args.tolerance)
-    red   = min(0xFF, 0xFF * 2 * (1 - diff / max_diff))
-    green = min(0xFF, 0xFF * 2 * diff / max_diff)
-    draw_line(3, f"tolerance={self.args.tolerance}<dBFS={cut_chunk.dbfs:.2f}", (red, green, 0))
-    return frame
+    # Clamped on both sides, as digital silence has a dBFS of -inf, which no color can be made of
+    diff  = max(-max_diff, min(max_diff, cut_chunk.dbfs - self.args.tolerance))
+    red   = max(0, min(0xFF, 0xFF * 2 * (1 - diff / max_diff)))
+    green = max(0, min(0xFF, 0xFF * 2 * diff / max_diff))
+    lines.append((f"tolerance={self.args.tolerance}<dBFS={cut_chunk.dbfs:.2f}", (red, green, 0)))
+
+    # Only the pixels under the text are touched, the frame is never converted to RGB
+    return self.overlay.draw(frame, lines)
+
+
+def parse_preview_command_line(argv: list[str]) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(
+      "vq preview",
+      description="Print how much of a file would be cut, without writing any video. The loudness of the file is analyzed once and cached, later previews are instant.",
+      formatter_class=argparse.ArgumentDefaultsHelpFormatter
+      )
+  parser.add_argument(
+      "-v", "--log-level",
+      choices=LOG_LEVELS.keys(), type=lambda x: LOG_LEVELS[x],
+      default=logging.INFO,
+      help="Set the log level")
+  parser.add_argument(
+      "-t", "--tolerance",
+      type=float, nargs="+", default=[-20.0],
+      help="Set the tolerance level (in dBFS). Several levels can be previewed at once.")
+  parser.add_argument(
+      "-m", "--after-loud-save-duration",
+      type=float, default=0.3,
+      help="Do not skip a silent chunk if between it and the most recent loud chunk is less than this amount of seconds")
+  parser.add_argument(
+      "-b", "--before-loud-save-duration",
+      type=float, default=0.0,
+      help="Do not skip a silent chunk if between it and the next loud chunk is less than this amount of seconds. Delays the output by as much")
+  parser.add_argument(
+      "--analysis-rate",
+      type=int, default=None,
+      help="Measure loudness on the audio resampled to mono at this rate (e.g. 16000), which is faster and independent of the sample format. The output audio is unaffected.")
+  parser.add_argument(
+      "input",
+      type=str,
+      help="Set the file path of the input.")
+  return parser.parse_args(argv)
+
+def preview_main(argv: list[str]) -> None:
+  args = parse_preview_command_line(argv)
+
+  logging.basicConfig(
+    stream=sys.stderr,
+    level=args.log_level,
+  )
+
+  reader = FileReader(args.input)
+  index = vq.cached_analyze(reader, analysis_rate=args.analysis_rate)
+  with reader.open() as source:
+    for tolerance in args.tolerance:
+      cutter = vq.Cutter(
+        source,
+        tolerance = tolerance,
+        after_loud_save_duration = args.after_loud_save_duration,
+        before_loud_save_duration = args.before_loud_save_duration,
+      )
+      num_kept = int(cutter.keep_mask(index).sum())
+      kept_duration = float(num_kept / index.average_rate)
+      cut_percent = 100 * (1 - num_kept / len(index)) if len(index) > 0 else 0.0
+      print(f"tolerance={tolerance} duration={format_time(kept_duration)}/{format_time(index.duration)} cut={cut_percent:.03f}%")
+
+def parse_batch_command_line(argv: list[str]) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(
+      "vq batch",
+      description="Cut many files in a pool of worker processes, longest first. Outputs newer than their input are skipped.",
+      formatter_class=argparse.ArgumentDefaultsHelpFormatter
+      )
+  parser.add_argument(
+      "-v", "--log-level",
+      choices=LOG_LEVELS.keys(), type=lambda x: LOG_LEVELS[x],
+      default=logging.INFO,
+      help="Set the log level")
+  parser.add_argument(
+      "-t", "--tolerance",
+      type=float, default=-20.0,
+      help="Set the tolerance level (in dBFS)."
+      )
+  parser.add_argument(
+      "-m", "--after-loud-save-duration",
+      type=float, default=0.3,
+      help="Do not skip a silent chunk if between it and the most recent loud chunk is less than this amount of seconds")
+  parser.add_argument(
+      "-b", "--before-loud-save-duration",
+      type=float, default=0.0,
+      help="Do not skip a silent chunk if between it and the next loud chunk is less than this amount of seconds. Delays the output by as much")
+  parser.add_argument(
+      "--analysis-rate",
+      type=int, default=None,
+      help="Measure loudness on the audio resampled to mono at this rate (e.g. 16000), which is faster and independent of the sample format. The output audio is unaffected.")
+  parser.add_argument(
+      "--max-held-memory",
+      type=float, default=vq.DEFAULT_MAX_HELD_BYTES / 2**20,
+      help="Hold at most this many MiB of silent video per job for --before-loud-save-duration, older silence is skipped instead")
+  parser.add_argument(
+      "--max-buffer-memory",
+      type=float, default=None,
+      help="Buffer at most this many MiB of video, and as many of audio, while waiting for the other stream of an input that interleaves them badly. Unbounded by default.")
+  parser.add_argument(
+      "--max-buffer-frames",
+      type=int, default=None,
+      help="Buffer at most this many video frames, and as many frames' worth of audio, while waiting for the other stream. Unbounded by default.")
+  parser.add_argument(
+      "--buffer-overflow",
+      choices=vq.OVERFLOW_POLICIES, default="error",
+      help="What to do when --max-buffer-memory or --max-buffer-frames is exceeded: 'error' stops, 'silence' gives the waiting video frames silent audio, 'drop' drops the oldest frames with a warning.")
+  parser.add_argument(
+      "-f", "--output-format",
+      type=str, default=None,
+      help="Destination container format, guessed from the output extension by default.")
+  parser.add_argument(
+      "-e", "--output-extension",
+      type=str, default=".mkv",
+      help="Extension of the output files.")
+  parser.add_argument(
+      "-j", "--jobs",
+      type=int, default=None,
+      help="Number of files cut at once, defaults to the number of cores.")
+  parser.add_argument(
+      "--threads",
+      type=int, default=1,
+      help="Number of threads used by each decoder and encoder of a job, 0 lets the codecs decide.")
+  parser.add_argument(
+      "--force",
+      action="store_true",
+      help="Also cut the files whose output is up to date.")
+  parser.add_argument(
+      "-o", "--output-dir",
+      type=str, required=True,
+      help="Directory to write the outputs to.")
+  parser.add_argument(
+      "inputs",
+      type=str, nargs="+",
+      help="Directories, glob patterns, manifests (.txt files listing one input per line) or file paths.")
+  args = parser.parse_args(argv)
+  if args.jobs is not None and args.jobs < 1:
+    parser.error("--jobs must be at least 1")
+  if args.threads < 0:
+    parser.error("--threads cannot be negative")
+  if args.before_loud_save_duration < 0:
+    parser.error("--before-loud-save-duration cannot be negative")
+  if args.analysis_rate is not None and args.analysis_rate <= 0:
+    parser.error("--analysis-rate must be positive")
+  if args.max_buffer_memory is not None and args.max_buffer_memory <= 0:
+    parser.error("--max-buffer-memory must be positive")
+  if args.max_buffer_frames is not None and args.max_buffer_frames < 1:
+    parser.error("--max-buffer-frames must be at least 1")
+  return args
+
+def batch_main(argv: list[str]) -> int:
+  args = parse_batch_command_line(argv)
+
+  logging.basicConfig(
+    stream=sys.stderr,
+    level=args.log_level,
+  )
+
+  input_paths = vq.find_inputs(args.inputs)
+  if not input_paths:
+    logger.error("no inputs found")
+    return 1
+  try:
+    jobs = vq.plan_batch(input_paths, args.output_dir, extension=args.output_extension)
+  except ValueError as e:
+    logger.error(e)
+    return 1
+  logger.info(f"{len(jobs)} inputs, {format_time(sum(job.duration for job in jobs))} in total")
+
+  options = vq.BatchOptions(
+    tolerance = args.tolerance,
+    after_loud_save_duration = args.after_loud_save_duration,
+    before_loud_save_duration = args.before_loud_save_duration,
+    max_held_bytes = int(args.max_held_memory * 2**20),
+    output_format = args.output_format,
+    threads = args.threads,
+    analysis_rate = args.analysis_rate,
+    buffer_limits = make_buffer_limits(args),
+  )
+  def on_result(result: vq.BatchResult) -> None:
+    if result.skipped:
+      logger.info(f"skipped {result.job.input_path}: {result.job.output_path} is up to date")
+    elif result.ok:
+      logger.info(f"cut {result.job.input_path} in {format_time(result.seconds)}")
+    else:
+      logger.error(f"failed to cut {result.job.input_path}: {result.error}")
+
+  start = time.monotonic()
+  results = vq.run_batch(jobs, options, workers=args.jobs, force=args.force, on_result=on_result)
+  elapsed = time.monotonic() - start
+
+  done = [result for result in results if result.ok and not result.skipped]
+  failed = [result for result in results if not result.ok]
+  media_duration = sum(result.job.duration for result in done)
+  speed = media_duration / elapsed if elapsed > 0 else 0.0
+  logger.info(
+    f"done={len(done)} skipped={len(results) - len(done) - len(failed)} failed={len(failed)} "
+    f"media={format_time(media_duration)} wall={format_time(elapsed)} speed={speed:.2f}x"
+  )
+  for result in failed:
+    logger.error(f"failed: {result.job.input_path}")
+  return 1 if failed else 0
 
+def parse_serve_command_line(argv: list[str]) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(
+      "vq serve",
+      description="Serve cut streams of the files of a directory over HTTP: GET /cut?src=PATH&t=TOLERANCE&m=AFTER&b=BEFORE streams chunked matroska. Requests for the same file share one loudness analysis.",
+      formatter_class=argparse.ArgumentDefaultsHelpFormatter
+      )
+  parser.add_argument(
+      "-v", "--log-level",
+      choices=LOG_LEVELS.keys(), type=lambda x: LOG_LEVELS[x],
+      default=logging.INFO,
+      help="Set the log level")
+  parser.add_argument(
+      "--host",
+      type=str, default="127.0.0.1",
+      help="Address to listen on.")
+  parser.add_argument(
+      "-p", "--port",
+      type=int, default=8080,
+      help="Port to listen on.")
+  parser.add_argument(
+      "-j", "--max-jobs",
+      type=int, default=vq.DEFAULT_MAX_JOBS,
+      help="Number of streams cut at once, further requests are turned down with 503 until one ends.")
+  parser.add_argument(
+      "--threads",
+      type=int, default=0,
+      help="Number of threads used by each decoder and encoder of a stream, 0 lets the codecs decide.")
+  parser.add_argument(
+      "--latency-profile",
+      choices=vq.LATENCY_PROFILES.keys(), default="live",
+      help="Encoder and muxer settings of the streams.")
+  parser.add_argument(
+      "--analysis-rate",
+      type=int, default=None,
+      help="Measure loudness on the audio resampled to mono at this rate (e.g. 16000), which is faster and independent of the sample format. The output audio is unaffected.")
+  parser.add_argument(
+      "root",
+      type=str,
+      help="Directory of the files that can be requested.")
+  args = parser.parse_args(argv)
+  if args.max_jobs < 1:
+    parser.error("--max-jobs must be at least 1")
+  if args.threads < 0:
+    parser.error("--threads cannot be negative")
+  if args.analysis_rate is not None and args.analysis_rate <= 0:
+    parser.error("--analysis-rate must be positive")
+  if not os.path.isdir(args.root):
+    parser.error(f"{args.root} is not a directory")
+  return args
+
+def serve_main(argv: list[str]) -> None:
+  args = parse_serve_command_line(argv)
+
+  logging.basicConfig(
+    stream=sys.stderr,
+    level=args.log_level,
+  )
+
+  server = vq.CutServer(
+    args.root,
+    max_jobs = args.max_jobs,
+    threads = args.threads,
+    latency_profile = args.latency_profile,
+    analysis_rate = args.analysis_rate,
+  )
+  # Imported here as only serving needs it
+  import asyncio
+  try:
+    asyncio.run(server.serve(args.host, args.port))
+  except KeyboardInterrupt:
+    pass
+
+def edl_main(args: argparse.Namespace, reader: Reader) -> None:
+  # Players open the media relative to the edit list, so files are given by absolute path
+  media = args.input if isinstance(reader, YtdlReader) else os.path.abspath(args.input)
+  handle = sys.stdout if args.output == "-" else io.open(args.output, "w")
+  try:
+    with reader.open() as source:
+      vq.write_edl(
+        source, handle, args.tolerance, args.after_loud_save_duration,
+        format = args.edl,
+        media = media,
+        before_loud_save_duration = args.before_loud_save_duration,
+        analysis_rate = args.analysis_rate,
+      )
+  except BrokenPipeError as e:
+    logger.error(f"Pipe broken! {e}")
+  except KeyboardInterrupt:
+    pass
+  finally:
+    if handle is not sys.stdout:
+      handle.close()
 
 def main():
+  if sys.argv[1:2] == ["preview"]:
+    return preview_main(sys.argv[2:])
+  if sys.argv[1:2] == ["batch"]:
+    return batch_main(sys.argv[2:])
+  if sys.argv[1:2] == ["serve"]:
+    return serve_main(sys.argv[2:])
+
   args = parse_command_line()
 
   logging.basicConfig(
@@ -154,16 +687,77 @@ def main():
   )
 
   reader = make_reader(args)
-  writer = make_writer(args)
+  if (args.remux or args.jobs > 1 or args.resume_dir is not None) and not isinstance(reader, FileReader):
+    logger.error("--remux, --jobs and --resume-dir only work on file inputs")
+    return
+  if args.edl is not None:
+    return edl_main(args, reader)
+
+  latency = vq.LatencyMeter()
+  writer = make_writer(args, latency)
 
   try:
+    if args.remux:
+      with reader.open() as source:
+        vq.remux(
+          source, writer, args.tolerance, args.after_loud_save_duration,
+          before_loud_save_duration=args.before_loud_save_duration,
+          index=vq.cached_analyze(reader, analysis_rate=args.analysis_rate),
+          analysis_rate=args.analysis_rate,
+          max_extra=args.remux_max_extra,
+        )
+      return
+
+    if args.resume_dir is not None:
+      vq.cut_resumable(
+        reader, writer, args.tolerance, args.after_loud_save_duration,
+        work_dir = args.resume_dir,
+        segment_duration = args.segment_duration,
+        before_loud_save_duration = args.before_loud_save_duration,
+        max_held_bytes = int(args.max_held_memory * 2**20),
+        analysis_rate = args.analysis_rate,
+      )
+      return
+
+    if args.jobs > 1:
+      vq.cut_parallel(
+        reader, writer, args.tolerance, args.after_loud_save_duration,
+        jobs=args.jobs,
+        before_loud_save_duration=args.before_loud_save_duration,
+        analysis_rate=args.analysis_rate,
+      )
+      return
+
     with reader.open() as source, writer.open_like(source) as sink:
+      source.enable_threading(args.threads)
+      sink.enable_threading(args.threads)
+      options = dict(
+        before_loud_save_duration = args.before_loud_save_duration,
+        max_held_bytes = int(args.max_held_memory * 2**20),
+        lookahead = args.lookahead,
+        queue_size = args.queue_size or None,
+        analysis_rate = args.analysis_rate,
+        buffer_limits = make_buffer_limits(args),
+        batch_size = vq.LATENCY_PROFILES[args.latency_profile].cut_batch_size,
+      )
+      if args.stats_file is not None or args.progress:
+        options["stats"] = vq.Stats(
+          path = args.stats_file,
+          format = args.stats_format,
+          interval = args.stats_interval,
+          progress = args.progress,
+        )
       drawer = None
       if args.draw_info:
         drawer = InfoDrawer(source, args)
-        vq.cut(source, sink, args.tolerance, args.after_loud_save_duration, drawer.on_callback)
+        vq.cut(source, sink, args.tolerance, args.after_loud_save_duration, native_frame_modifier=drawer.on_callback, **options)
       else:
-        vq.cut(source, sink, args.tolerance, args.after_loud_save_duration)
+        vq.cut(source, sink, args.tolerance, args.after_loud_save_duration, **options)
+    logger.info(latency.summary())
+    if isinstance(reader, YtdlReader) and reader.prefetch_stats is not None:
+      logger.info(reader.prefetch_stats.summary())
+    if args.latency_target is not None and latency.percentile(95) * 1000 > args.latency_target:
+      logger.warning(f"95th percentile latency exceeds the target of {args.latency_target}ms")
   except BrokenPipeError as e:
     logger.error(f"Pipe broken! {e}")
   except KeyboardInterrupt:
@@ -0,0 +1,71 @@
+from __future__ import annotations
+from typing import *
+
+from .sink import HandleWriter
+from .source import Source
+import av
+import logging
+
+__all__ = [
+  "concat",
+]
+
+logger = logging.getLogger(__name__)
+
+def concat(paths: Sequence[str], writer: HandleWriter) -> None:
+  """
+  Concatenate the containers at `paths` into `writer` by copying their packets, without re-encoding.
+
+  All containers must hold one video and one audio stream encoded with the same parameters, both starting at the same
+  time apart from the audio encoder's priming. Each part is placed at the end of the video of the previous ones, so
+  that the output stays in sync however much longer than its video the audio of a part is. The audio of a part before
+  its video starts, which is the priming of its encoder (`initial_padding`), is dropped from all parts but the first:
+  it would overlap the end of the previous part. The decoder then primes itself on the previous part's last frame,
+  which may leave an artifact of up to a frame of audio at each seam.
+  """
+  assert len(paths) > 0
+  first = av.open(paths[0])
+  try:
+    with writer.open_copy_like(Source.from_container(first)) as sink:
+      start = 0.0 # where the video of the current part starts in the output, in seconds
+      for number, path in enumerate(paths):
+        with av.open(path) as container:
+          source = Source.from_container(container)
+          video_stream = source.video_stream
+          part_start = 0.0 if video_stream.start_time is None else float(video_stream.start_time * video_stream.time_base)
+          part_end = part_start
+          last_time: dict[str, float] = {} # of the last packet of each stream
+          last_gap: dict[str, float] = {} # between the last two packets of each stream
+          num_dropped = 0
+          for packet in source.demux():
+            if packet.pts is None and packet.dts is None:
+              continue # flushing packet, demuxers may leave the dts of the first video packets unset
+            kind = packet.stream.type
+            time = float(packet.pts if packet.pts is not None else packet.dts) * packet.time_base
+            if kind in last_time and time > last_time[kind]:
+              last_gap[kind] = time - last_time[kind]
+            last_time[kind] = time
+            if kind == "video":
+              part_end = max(part_end, time + packet_duration(packet, last_gap.get(kind, 0.0)))
+            elif number > 0 and time < part_start:
+              num_dropped += 1
+              continue
+            sink.write_packet(packet, offset=part_start - start)
+          start += part_end - part_start
+          logger.debug(f"concatenated {path}, dropped {num_dropped} priming audio packets, output is now {start:.3f}s long")
+  finally:
+    first.close()
+
+def packet_duration(packet: av.Packet, gap: float) -> float:
+  """
+  Duration of `packet` in seconds. Muxers often leave it unset, it is then the duration of a frame of its stream, or
+  `gap`, the time between the previous packets of its stream, when that is unknown too.
+  """
+  if packet.duration:
+    return float(packet.duration * packet.time_base)
+  stream = packet.stream
+  if stream.type == "video" and stream.average_rate:
+    return float(1 / stream.average_rate)
+  if stream.type == "audio" and stream.codec_context.frame_size and stream.rate:
+    return stream.codec_context.frame_size / stream.rate
+  return gap
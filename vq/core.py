@@ -5,6 +5,12 @@ from .source import *
 from .sink import *
 from .chunker import *
 from .cutter import *
+from .latency import LatencyMeter
+from .lookahead import LookaheadDecoder
+from .pipeline import ThreadedStage
+from .shape import decimate, scale_cut_chunks, scale_frames
+from .stats import Stats
+from .utils import plane_view, rgb_view
 
 import av
 import numpy as np
@@ -12,38 +18,181 @@ import numpy as np
 __all__ = [
   "RgbFrame",
   "VideoFrameModifier",
+  "NativeFrameModifier",
   "cut",
+  "write_cut_chunks",
   "CutChunk", # re-export
 ]
 
 RgbFrame = np.ndarray
+# May draw on the given frame in place and return it, which avoids copying the frame
 VideoFrameModifier = Callable[[CutChunk, RgbFrame], RgbFrame]
+# Like `VideoFrameModifier`, but given a copy of the frame in its decoded format, which avoids converting it to RGB and
+# back. May return a frame in another format, which the encoder converts
+NativeFrameModifier = Callable[[CutChunk, av.VideoFrame], av.VideoFrame]
 
 def cut(
   source: Source,
   sink: Sink,
   tolerance: float,
   after_loud_save_duration: float,
-  video_frame_modifier: Optional[VideoFrameModifier] = None
+  video_frame_modifier: Optional[VideoFrameModifier] = None,
+  *,
+  before_loud_save_duration: float = 0.0,
+  max_held_bytes: int = DEFAULT_MAX_HELD_BYTES,
+  lookahead: Optional[float] = None,
+  queue_size: Optional[int] = None,
+  stats: Optional[Stats] = None,
+  native_frame_modifier: Optional[NativeFrameModifier] = None,
+  analysis_rate: Optional[int] = None,
+  buffer_limits: Optional[BufferLimits] = None,
+  batch_size: int = 8,
   ) -> None:
-  chunker = Chunker(source)
+  """
+  See `Cutter` for `tolerance`, `after_loud_save_duration`, `before_loud_save_duration`, `max_held_bytes` and
+  `batch_size`.
+
+  :param lookahead: If set, decide what to cut from the audio before decoding the video, holding undecoded video for up to this many seconds. Video that is cut is then never decoded.
+  :param queue_size: If set, run decoding, analysis (chunking and cutting) and encoding in separate threads, connected by queues of at most this many items.
+  :param stats: If set, time every stage with it. Nothing is timed otherwise.
+  :param native_frame_modifier: Alternative to `video_frame_modifier` working on the decoded format of the frames.
+  :param analysis_rate: If set, measure the loudness on the audio resampled to mono at this rate (e.g. 16000) instead of the full audio. The output audio is unaffected.
+  :param buffer_limits: If set, cap what is buffered of one stream while waiting for the other, see `BufferLimits`.
+
+  The video is scaled and decimated to the size and rate `sink` encodes at (see `HandleWriter`), right after decoding:
+  dropped frames are never converted nor encoded, and the modifiers draw on frames of the output size.
+  """
+  source_rate = source.video_stream.average_rate
+  video_rate = sink.video_rate
+  width, height = sink.video_size
+  chunker = Chunker(source, analysis_rate=analysis_rate, limits=buffer_limits, video_rate=video_rate)
   cutter = Cutter(
     source,
     tolerance = tolerance,
-    after_loud_save_duration = after_loud_save_duration
+    after_loud_save_duration = after_loud_save_duration,
+    before_loud_save_duration = before_loud_save_duration,
+    max_held_bytes = max_held_bytes,
+    batch_size = batch_size,
+    video_rate = video_rate,
     )
 
-  cut_chunk_stream = cutter.cut_chunks(chunker.to_chunks(source.decode()))
-  for cut_chunk in cut_chunk_stream:
-    sound = cut_chunk.sound
+  if video_frame_modifier is not None and native_frame_modifier is not None:
+    raise ValueError("only one of video_frame_modifier and native_frame_modifier can be given")
+  if lookahead is not None and lookahead <= before_loud_save_duration:
+    raise ValueError(f"lookahead (={lookahead}) must be longer than before_loud_save_duration (={before_loud_save_duration}), as held chunks are only decoded once they are kept")
+
+  if stats is not None:
+    sink.stats = stats
+    stats.start(chunker.num_chunks)
+    stats.gauges["chunker_buffered_bytes"] = lambda: chunker.buffered_bytes
+
+  def timed(name: str, iterable: Iterable, on_item: Optional[Callable[[Any], None]] = None) -> Iterable:
+    return stats.timed(name, iterable, on_item) if stats is not None else iterable
+
+  stages: list[ThreadedStage] = []
+  def threaded(iterable: Iterable, name: str) -> Iterable:
+    stage = ThreadedStage(iterable, maxsize=queue_size, name=name)
+    stages.append(stage)
+    if stats is not None:
+      stats.gauges[f"{name}_queue_depth"] = lambda: stage.depth
+    return stage
+
+  def decimated(frames: Iterable) -> Iterable:
+    if video_rate == source_rate:
+      return frames
+    video_stream = source.video_stream
+    start_time = float((video_stream.start_time or 0) * video_stream.time_base)
+    return decimate(frames, rate=video_rate, source_rate=source_rate, start_time=start_time)
+
+  if lookahead is None:
+    frames = decimated(timed("decode", source.decode()))
+    if (width, height) != (source.video_stream.width, source.video_stream.height):
+      # Before the decode thread's queue, so that the queue holds scaled frames and the scaling runs in that thread
+      frames = timed("scale", scale_frames(frames, width, height))
+    if source.start is not None:
+      frames = chunker.start_at_first_video_frame(frames)
+    if sink.latency is not None:
+      frames = mark_read(frames, sink.latency)
+    if queue_size is not None:
+      frames = threaded(frames, "decode")
+    chunks = timed("chunk", chunker.to_chunks(frames), stats and stats.count_input)
+    cut_chunk_stream = timed("cut", cutter.cut_chunks(chunks))
+  else:
+    # Demuxing and resolving share the decoder's packet buffer, so they stay in the same thread
+    decoder = LookaheadDecoder(source, window=lookahead, delay=float(cutter.batch_size / video_rate))
+    frames = timed("demux", decoder.frames())
+    if source.start is not None or source.end is not None:
+      frames = source.trim(frames)
+    frames = decimated(frames)
+    if source.start is not None:
+      frames = chunker.start_at_first_video_frame(frames)
+    if sink.latency is not None:
+      frames = mark_read(frames, sink.latency)
+    chunks = timed("chunk", chunker.to_chunks(frames), stats and stats.count_input)
+    cut_chunk_stream = timed("decode", decoder.resolve_chunks(timed("cut", cutter.cut_chunks(chunks))))
+    if (width, height) != (source.video_stream.width, source.video_stream.height):
+      # Only kept frames are decoded, so only they are scaled
+      cut_chunk_stream = timed("scale", scale_cut_chunks(cut_chunk_stream, width, height))
+  if queue_size is not None:
+    cut_chunk_stream = threaded(cut_chunk_stream, "analyze")
+  # Encoding and muxing happen in the calling thread
+  try:
+    write_cut_chunks(sink, cut_chunk_stream, video_frame_modifier, native_frame_modifier=native_frame_modifier)
+  finally:
+    # The decode thread must be done with the source before the caller closes it, even when encoding failed. The later
+    # stages iterate over the earlier ones, so they are stopped first
+    for stage in reversed(stages):
+      stage.close()
+    if stats is not None:
+      stats.close()
+
+def mark_read(frames: Iterable[av.VideoFrame | FrameStub | av.AudioFrame], latency: LatencyMeter) -> Generator[av.VideoFrame | FrameStub | av.AudioFrame]:
+  for frame in frames:
+    if not isinstance(frame, av.AudioFrame):
+      latency.mark_read(frame.pts)
+    yield frame
+
+def write_cut_chunks(
+  sink: Sink,
+  cut_chunks: Iterable[CutChunk],
+  video_frame_modifier: Optional[VideoFrameModifier] = None,
+  *,
+  native_frame_modifier: Optional[NativeFrameModifier] = None,
+  ) -> None:
+  for cut_chunk in cut_chunks:
+    # Without a modifier, the decoded frame goes to the encoder as is (no copy), `Sink` restamps it
     video_frame = cut_chunk.video_frame
     if video_frame_modifier is not None:
-      ndframe = video_frame.to_rgb().to_ndarray()
-      ndframe = video_frame_modifier(cut_chunk, ndframe)
-      video_frame = av.VideoFrame.from_ndarray(ndframe, format="rgb24")
-    else:
-      # to ndarray and go back creating a new VideoFrame to reset the pts or something idk
-      ndframe = video_frame.to_ndarray()
-      video_frame = av.VideoFrame.from_ndarray(ndframe, format=video_frame.format.name)
-    sink.write_sound(sound)
-    sink.write_video_frame(video_frame)
+      with sink.timing("draw"):
+        video_frame = to_rgb_frame(video_frame)
+        ndframe = rgb_view(video_frame)
+        modified = video_frame_modifier(cut_chunk, ndframe)
+        if modified is not ndframe:
+          video_frame = av.VideoFrame.from_ndarray(modified, format="rgb24")
+    elif native_frame_modifier is not None:
+      with sink.timing("draw"):
+        video_frame = native_frame_modifier(cut_chunk, copy_video_frame(video_frame))
+    sink.write_sound(cut_chunk.sound)
+    sink.write_video_frame(video_frame, source_pts=cut_chunk.video_frame.pts)
+
+def copy_video_frame(video_frame: av.VideoFrame) -> av.VideoFrame:
+  """
+  Copy `video_frame` into a new frame of the same format that can be modified in place. Decoded frames may still be
+  referenced by the decoder for predicting later frames, so they must not be modified themselves.
+  """
+  copy = av.VideoFrame(video_frame.width, video_frame.height, video_frame.format.name)
+  for source_plane, plane in zip(video_frame.planes, copy.planes):
+    row_bytes = min(source_plane.line_size, plane.line_size)
+    plane_view(plane, plane.height, row_bytes)[:] = plane_view(source_plane, source_plane.height, row_bytes)
+  copy.pts = video_frame.pts
+  copy.time_base = video_frame.time_base
+  return copy
+
+def to_rgb_frame(video_frame: av.VideoFrame) -> av.VideoFrame:
+  """
+  Convert `video_frame` to a new rgb24 frame that can be drawn on in place.
+  """
+  if video_frame.format.name == "rgb24":
+    # `reformat` would return `video_frame` itself, which may still be referenced by the decoder
+    return av.VideoFrame.from_ndarray(video_frame.to_ndarray(), format="rgb24")
+  return video_frame.reformat(format="rgb24")
@@ -4,16 +4,20 @@ from typing import *
 from .sound import *
 from .chunker import *
 from .source import *
-from .utils import center_viewed
+from .analysis import LoudnessIndex
+from .utils import batched, center_viewed
 from dataclasses import dataclass
 import av
 import collections
+import fractions
 import logging
 import math
+import numpy as np
 
 __all__ = [
   "CutChunk",
   "Cutter",
+  "DEFAULT_MAX_HELD_BYTES",
 ]
 
 logger = logging.getLogger(__name__)
@@ -29,46 +33,135 @@ class CutChunk:
   def time(self) -> float:
     return self.video_frame.time
 
+# Default of `Cutter.max_held_bytes`
+DEFAULT_MAX_HELD_BYTES = 512 * 2**20
+
+def chunk_bytes(cut_chunk: CutChunk) -> int:
+  """
+  Memory held by the samples and decoded frame of `cut_chunk`.
+  """
+  num_bytes = cut_chunk.sound.samples.nbytes
+  if isinstance(cut_chunk.video_frame, av.VideoFrame):
+    num_bytes += sum(plane.buffer_size for plane in cut_chunk.video_frame.planes)
+  return num_bytes
+
 class Cutter:
   def __init__(
     self,
     source: Source,
     *,
     tolerance: float,
-    after_loud_save_duration: float
+    after_loud_save_duration: float,
+    before_loud_save_duration: float = 0.0,
+    max_held_bytes: int = DEFAULT_MAX_HELD_BYTES,
+    batch_size: int = 8,
+    video_rate: Optional[fractions.Fraction] = None,
   ) -> None:
     """
     :param tolerance: Threshold (in dBFS) defining the boundary between a loud chunk and a silent chunk
     :param after_loud_save_duration: Do not skip a silent chunk if between it and the most recent loud chunk is less than this amount of seconds
+    :param before_loud_save_duration: Do not skip a silent chunk if between it and the next loud chunk is less than this amount of seconds. Silent chunks are held back for up to this amount of seconds to find out, which delays the output by as much
+    :param max_held_bytes: Never hold back more than this amount of bytes of silent chunks for `before_loud_save_duration`, the oldest ones are skipped instead
+    :param batch_size: Number of chunks whose dBFS is computed at once in `cut_chunks`. Larger batches are faster but delay the output by as many chunks
+    :param video_rate: Rate of the chunks, if their video frames were decimated from the source's average rate, see `Chunker`
     """
     self.source = source
+    self.frame_duration = 1.0 / (video_rate or source.video_stream.average_rate)
     self.tolerance = tolerance
     self.after_loud_save_duration = after_loud_save_duration
+    self.before_loud_save_duration = before_loud_save_duration
+    self.max_held_bytes = max_held_bytes
+    self.batch_size = batch_size
+    # Cutting state
+    self.last_loud_t = -math.inf # Initialized to -math.inf because it makes the programming logic more convenient
+    self.last_total_skip_t = 0
+    # Skipped chunks that are kept after all if a loud chunk follows within `before_loud_save_duration`
+    self.held: Deque[CutChunk] = collections.deque()
+    self.held_bytes = 0
 
-  def cut_chunks(self, chunks: Generator[Chunk]) -> Generator[CutChunk]:
-    last_loud_t = -math.inf # Initialized to math.inf because it makes the programming logic more convenient
-    last_total_skip_t = 0
-
-    for chunk in chunks:
-      cut_chunk = CutChunk(
-        video_frame = chunk.video_frame,
-        sound       = chunk.sound,
-        dbfs        = chunk.sound.dbfs(),
-        )
-      is_silent = cut_chunk.dbfs < self.tolerance
-      if is_silent:
-        # `cut_chunk` is silent
-        if cut_chunk.time - last_loud_t <= self.after_loud_save_duration:
-          # Within `after_loud_save_duration`, accept this silent chunk
-          yield cut_chunk
-        else:
-          last_total_skip_t += 1.0 / self.source.video_stream.average_rate
-          pass # Skip this chunk
+  def judge(self, cut_chunk: CutChunk) -> bool:
+    """
+    Decide whether `cut_chunk` is kept, updating the cutting state. Chunks must be judged in time order.
+    """
+    is_silent = cut_chunk.dbfs < self.tolerance
+    if is_silent:
+      # `cut_chunk` is silent
+      if cut_chunk.time - self.last_loud_t <= self.after_loud_save_duration:
+        # Within `after_loud_save_duration`, accept this silent chunk
+        return True
       else:
-        # `cut_chunk` is loud
-        # Update state
-        last_loud_t = cut_chunk.time
-        if last_total_skip_t > 0:
-          cut_chunk.prev_cut_duration = last_total_skip_t
-          last_total_skip_t = 0
-        yield cut_chunk
\ No newline at end of file
+        self.last_total_skip_t += self.frame_duration
+        return False # Skip this chunk
+    else:
+      # `cut_chunk` is loud
+      # Update state
+      self.last_loud_t = cut_chunk.time
+      if self.last_total_skip_t > 0:
+        cut_chunk.prev_cut_duration = self.last_total_skip_t
+        self.last_total_skip_t = 0
+      return True
+
+  def cut(self, cut_chunk: CutChunk) -> Iterator[CutChunk]:
+    """
+    Judge `cut_chunk`, and return the chunks that are now known to be kept, in time order. Unlike `judge`, this
+    accounts for `before_loud_save_duration`.
+    """
+    # Held chunks too far from any later chunk can never be kept
+    while self.held and cut_chunk.time - self.held[0].time > self.before_loud_save_duration:
+      self._pop_held()
+
+    is_loud = not (cut_chunk.dbfs < self.tolerance)
+    if is_loud and self.held:
+      released = list(self.held)
+      self.held.clear()
+      self.held_bytes = 0
+      # The released chunks are not skipped after all
+      self.last_total_skip_t -= len(released) * self.frame_duration
+      if self.last_total_skip_t < self.frame_duration / 2:
+        self.last_total_skip_t = 0
+      elif self.last_total_skip_t > 0:
+        released[0].prev_cut_duration = self.last_total_skip_t
+        self.last_total_skip_t = 0
+      yield from released
+
+    if self.judge(cut_chunk):
+      yield cut_chunk
+    elif self.before_loud_save_duration > 0:
+      self._hold(cut_chunk)
+
+  def _hold(self, cut_chunk: CutChunk) -> None:
+    self.held.append(cut_chunk)
+    self.held_bytes += chunk_bytes(cut_chunk)
+    while self.held_bytes > self.max_held_bytes:
+      logger.debug(f"dropping held chunk at {self.held[0].time:.3f}s, holding {self.held_bytes} bytes")
+      self._pop_held()
+
+  def _pop_held(self) -> None:
+    self.held_bytes -= chunk_bytes(self.held.popleft())
+
+  def cut_chunks(self, chunks: Generator[Chunk]) -> Generator[CutChunk]:
+    for batch in batched(chunks, self.batch_size):
+      for chunk, dbfs in zip(batch, Sound.batch_dbfs([chunk.analysis_sound for chunk in batch])):
+        cut_chunk = CutChunk(
+          video_frame = chunk.video_frame,
+          sound       = chunk.sound,
+          dbfs        = dbfs,
+          )
+        yield from self.cut(cut_chunk)
+
+  def keep_mask(self, index: LoudnessIndex) -> np.ndarray:
+    """
+    Tell which frames of `index` are kept, as a boolean array. Vectorized equivalent of cutting every frame of
+    `index` in order with a fresh `Cutter`; the state of this one is left untouched. `max_held_bytes` is not enforced,
+    as frames of an index take no memory.
+    """
+    time = index.time
+    is_loud = ~(np.asarray(index.dbfs, dtype=np.float64) < self.tolerance)
+    if len(index) == 0:
+      return is_loud
+    last_loud_t = np.maximum.accumulate(np.where(is_loud, time, -np.inf))
+    keep = is_loud | (time - last_loud_t <= self.after_loud_save_duration)
+    if self.before_loud_save_duration > 0:
+      next_loud_t = np.minimum.accumulate(np.where(is_loud, time, np.inf)[::-1])[::-1]
+      keep |= next_loud_t - time <= self.before_loud_save_duration
+    return keep
@@ -0,0 +1,141 @@
+from __future__ import annotations
+from typing import *
+
+from .analysis import stub_frames
+from .chunker import Chunker
+from .cutter import Cutter
+from .remux import KeptRange
+from .source import Source
+import abc
+import json
+
+__all__ = [
+  "EDL_FORMATS",
+  "EdlWriter",
+  "stream_kept_ranges",
+  "write_edl",
+]
+
+def stream_kept_ranges(cutter: Cutter, source: Source, *, analysis_rate: Optional[int] = None) -> Generator[KeptRange]:
+  """
+  Decode only the audio of `source`, cut it with `cutter`, and yield the time ranges of the kept frames as soon as
+  each one ends. The frames are the ones `vq.cut` would keep with the same `cutter`, frame for frame.
+  """
+  frame_duration = 1.0 / source.video_stream.average_rate
+  chunker = Chunker(source, analysis_rate=analysis_rate)
+  frames = stub_frames(source)
+  if source.start is not None or source.end is not None:
+    frames = source.trim(frames)
+  if source.start is not None:
+    frames = chunker.start_at_first_video_frame(frames)
+
+  current: Optional[KeptRange] = None
+  removed = 0.0
+  last_end = source.start if source.start is not None else source.start_time
+  for cut_chunk in cutter.cut_chunks(chunker.to_chunks(frames)):
+    start = cut_chunk.time
+    # Frames are contiguous if they start within half a frame of the end of the previous one
+    if current is not None and start - current.end < frame_duration / 2:
+      current.end = start + frame_duration
+      continue
+    if current is not None:
+      yield current
+      last_end = current.end
+    removed += max(0.0, start - last_end)
+    current = KeptRange(start=start, end=start + frame_duration, offset=removed)
+  if current is not None:
+    yield current
+
+class EdlWriter(abc.ABC):
+  """
+  Writes kept ranges of a media file as a playlist that players can play without the cut parts.
+  """
+  def __init__(self, handle: TextIO, media: str) -> None:
+    """
+    :param media: Path or URL of the media, as the player should open it
+    """
+    self.handle = handle
+    self.media = media
+
+  def begin(self) -> None:
+    pass
+
+  @abc.abstractmethod
+  def write_range(self, kept: KeptRange) -> None:
+    pass
+
+  def end(self) -> None:
+    pass
+
+class MpvEdlWriter(EdlWriter):
+  # https://github.com/mpv-player/mpv/blob/master/DOCS/edl-mpv.rst
+  def begin(self) -> None:
+    self.handle.write("# mpv EDL v0\n")
+
+  def write_range(self, kept: KeptRange) -> None:
+    # The %length% prefix lets the path contain commas and newlines
+    media = f"%{len(self.media.encode())}%{self.media}"
+    self.handle.write(f"{media},{kept.start:.6f},{kept.end - kept.start:.6f}\n")
+
+class FfconcatWriter(EdlWriter):
+  # https://ffmpeg.org/ffmpeg-formats.html#concat-1
+  def begin(self) -> None:
+    self.handle.write("ffconcat version 1.0\n")
+
+  def write_range(self, kept: KeptRange) -> None:
+    media = self.media.replace("'", "'\\''")
+    self.handle.write(f"file '{media}'\ninpoint {kept.start:.6f}\noutpoint {kept.end:.6f}\n")
+
+class JsonEdlWriter(EdlWriter):
+  """
+  A JSON array of {"start", "end", "offset"} objects in seconds, written one element per line so that it can be read
+  while it is being written.
+  """
+  def begin(self) -> None:
+    self.handle.write("[\n")
+    self._first = True
+
+  def write_range(self, kept: KeptRange) -> None:
+    if not self._first:
+      self.handle.write(",\n")
+    self._first = False
+    self.handle.write(json.dumps({"start": kept.start, "end": kept.end, "offset": kept.offset}))
+
+  def end(self) -> None:
+    self.handle.write("\n]\n")
+
+EDL_FORMATS: dict[str, type[EdlWriter]] = {
+  "mpv": MpvEdlWriter,
+  "ffconcat": FfconcatWriter,
+  "json": JsonEdlWriter,
+}
+
+def write_edl(
+  source: Source,
+  handle: TextIO,
+  tolerance: float,
+  after_loud_save_duration: float,
+  *,
+  format: str,
+  media: str,
+  before_loud_save_duration: float = 0.0,
+  analysis_rate: Optional[int] = None,
+  ) -> None:
+  """
+  Write the parts of `source` that `vq.cut` would keep into `handle` as an edit list in `format` (one of
+  `EDL_FORMATS`), without decoding any video. Each range is written and flushed as soon as it is known, so live
+  sources can be followed.
+  """
+  cutter = Cutter(
+    source,
+    tolerance = tolerance,
+    after_loud_save_duration = after_loud_save_duration,
+    before_loud_save_duration = before_loud_save_duration,
+    )
+  writer = EDL_FORMATS[format](handle, media)
+  writer.begin()
+  for kept in stream_kept_ranges(cutter, source, analysis_rate=analysis_rate):
+    writer.write_range(kept)
+    handle.flush()
+  writer.end()
+  handle.flush()
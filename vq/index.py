@@ -0,0 +1,61 @@
+from __future__ import annotations
+from typing import *
+
+from .analysis import INDEX_VERSION, LoudnessIndex, analyze
+from .source import FileReader
+import hashlib
+import logging
+import os
+
+__all__ = [
+  "index_cache_dir",
+  "index_path",
+  "cached_analyze",
+]
+
+logger = logging.getLogger(__name__)
+
+def index_cache_dir() -> str:
+  """
+  Where loudness indices are kept: $VQ_CACHE_DIR, or vq/ in $XDG_CACHE_HOME (defaulting to ~/.cache).
+  """
+  if "VQ_CACHE_DIR" in os.environ:
+    return os.environ["VQ_CACHE_DIR"]
+  cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+  return os.path.join(cache_home, "vq")
+
+def index_path(path: str, *, analysis_rate: Optional[int] = None) -> str:
+  """
+  Path of the cached loudness index of the file at `path`. It is keyed by the file's identity (absolute path, size
+  and modification time), so modifying or replacing the file invalidates it.
+  """
+  stat = os.stat(path)
+  identity = f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{INDEX_VERSION}"
+  if analysis_rate is not None:
+    # Loudness measured on the analysis stream differs from the full-rate one
+    identity += f"\0{analysis_rate}"
+  key = hashlib.sha256(identity.encode()).hexdigest()[:32]
+  return os.path.join(index_cache_dir(), f"{key}.npy")
+
+def cached_analyze(reader: FileReader, *, analysis_rate: Optional[int] = None) -> LoudnessIndex:
+  """
+  Like `analyze`, but reuse the cached index of `reader`'s file if there is one, and cache it otherwise.
+  """
+  cached = index_path(reader.path, analysis_rate=analysis_rate)
+  if os.path.exists(cached) and os.path.exists(cached + ".json"):
+    try:
+      index = LoudnessIndex.load(cached)
+      logger.info(f"reusing loudness index {cached}")
+      return index
+    except (OSError, ValueError, KeyError) as e:
+      logger.warning(f"ignoring unreadable loudness index {cached}: {e}")
+
+  with reader.open() as source:
+    index = analyze(source, analysis_rate=analysis_rate)
+  try:
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    index.save(cached)
+    logger.debug(f"saved loudness index {cached}")
+  except OSError as e:
+    logger.warning(f"could not save loudness index {cached}: {e}")
+  return index
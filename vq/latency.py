@@ -0,0 +1,133 @@
+from __future__ import annotations
+from typing import *
+
+from dataclasses import dataclass, field
+import collections
+import logging
+import threading
+import time
+
+__all__ = [
+  "LatencyProfile",
+  "LATENCY_PROFILES",
+  "LatencyMeter",
+]
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class LatencyProfile:
+  video_options: dict[str, str] # encoder options of the output video stream
+  container_options: dict[str, str] # muxer options of the output container
+  flush_handle: bool # whether to flush the output handle after every muxed packet
+  gop_seconds: Optional[float] = None # keyframe interval, None leaves it to the encoder
+  cut_batch_size: int = 8 # `Cutter.batch_size`, a batch of chunks waits until it is full before any of it is cut
+  # Further options only understood by some encoders and muxers, by their names
+  encoder_video_options: dict[str, dict[str, str]] = field(default_factory=dict)
+  format_container_options: dict[str, dict[str, str]] = field(default_factory=dict)
+
+  def video_options_for(self, encoder: str) -> dict[str, str]:
+    return {**self.video_options, **self.encoder_video_options.get(encoder, {})}
+
+# Options of the live profile for matroska and webm
+_LIVE_MATROSKA_OPTIONS = {
+  "cluster_time_limit": "100", # in milliseconds, matroska only writes a cluster out when it is closed
+  "live": "1", # do not seek back to write sizes and cues
+}
+
+# Options of the live profile for x264 and x265, which share them
+_LIVE_X26X_OPTIONS = {
+  "preset": "veryfast",
+  "tune": "zerolatency", # no lookahead, no frame threading delay
+}
+
+LATENCY_PROFILES: dict[str, LatencyProfile] = {
+  "quality": LatencyProfile(
+    video_options = {
+      "crf": "18", # Output high quality images
+    },
+    container_options = {},
+    flush_handle = False,
+  ),
+  "live": LatencyProfile(
+    video_options = {
+      "crf": "18",
+      "bf": "0", # no B-frames, so that packets come out in presentation order right away
+    },
+    container_options = {
+      "flush_packets": "1", # write out every packet as soon as it is muxed
+      "max_interleave_delta": "100000", # in microseconds
+    },
+    flush_handle = True,
+    gop_seconds = 1.0,
+    cut_batch_size = 1,
+    encoder_video_options = {
+      "libx264": _LIVE_X26X_OPTIONS,
+      "libx265": _LIVE_X26X_OPTIONS,
+    },
+    format_container_options = {
+      "matroska": _LIVE_MATROSKA_OPTIONS,
+      "webm": _LIVE_MATROSKA_OPTIONS,
+    },
+  ),
+}
+
+class LatencyMeter:
+  """
+  Measures how long video frames take from when they are read from the source to when their packet's bytes are written
+  to the output. Frames are identified by their source pts. Thread-safe.
+
+  Frames are read before they are chunked, so the latency includes the time a frame waits for the rest of its
+  `Cutter` batch (`LatencyProfile.cut_batch_size` frames) and, if it is silent, the pre-roll it is held back for.
+  """
+  def __init__(self, *, window: int = 1000, max_age: float = 60.0) -> None:
+    """
+    :param window: Number of recent frames that percentiles are computed over
+    :param max_age: Forget frames read more than this many seconds ago, they have most likely been cut
+    """
+    self.max_age = max_age
+    self._lock = threading.Lock()
+    self._read_times: collections.OrderedDict[int, float] = collections.OrderedDict()
+    self._recent: Deque[float] = collections.deque(maxlen=window) # in seconds
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+  def mark_read(self, key: int) -> None:
+    now = time.monotonic()
+    with self._lock:
+      self._read_times[key] = now
+      while next(iter(self._read_times.values())) < now - self.max_age:
+        self._read_times.popitem(last=False)
+
+  def mark_written(self, key: int) -> None:
+    now = time.monotonic()
+    with self._lock:
+      read_time = self._read_times.pop(key, None)
+      if read_time is None:
+        return
+      latency = now - read_time
+      self._recent.append(latency)
+      self.count += 1
+      self.total += latency
+      self.max = max(self.max, latency)
+
+  def percentile(self, q: float) -> float:
+    """
+    `q`-th percentile (0 <= q <= 100) of the latency of the recent frames, in seconds.
+    """
+    with self._lock:
+      recent = sorted(self._recent)
+    if not recent:
+      return 0.0
+    return recent[min(len(recent) - 1, int(len(recent) * q / 100))]
+
+  @property
+  def mean(self) -> float:
+    return self.total / self.count if self.count > 0 else 0.0
+
+  def summary(self) -> str:
+    return (
+      f"latency over {self.count} frames: mean={self.mean * 1000:.1f}ms"
+      f" p50={self.percentile(50) * 1000:.1f}ms p95={self.percentile(95) * 1000:.1f}ms max={self.max * 1000:.1f}ms"
+    )
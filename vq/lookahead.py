@@ -0,0 +1,146 @@
+from __future__ import annotations
+from typing import *
+
+from .analysis import REORDER_DEPTH, stub_frames
+from .chunker import FrameStub
+from .cutter import CutChunk
+from .source import Source
+import av
+import bisect
+import collections
+import logging
+import math
+
+__all__ = [
+  "LookaheadDecoder",
+]
+
+logger = logging.getLogger(__name__)
+
+class LookaheadDecoder:
+  """
+  Demuxes a source ahead of its decoding. Audio is decoded right away, while video packets are held back undecoded
+  and stood in for by `FrameStub`s. A stub is only decoded when `resolve` is called on it, i.e. when it has been kept,
+  so video that is cut is never decoded unless a kept frame depends on it.
+
+  Undecoded video packets are held for `window` seconds (plus a GOP) after the stubs could first be decided on, so
+  stubs must be resolved within that window after they are yielded. A stub can be decided on once the audio of its
+  time and the stubs reordered before it have been demuxed too, and `delay` seconds later, e.g. once the `Cutter`'s
+  batch it is in is full.
+  """
+  def __init__(self, source: Source, *, window: float, delay: float = 0.0) -> None:
+    self.source = source
+    self.window = window
+    self.delay = delay
+    self._reorder_duration = float(REORDER_DEPTH / source.video_stream.average_rate)
+    self._audio_time = -math.inf # of the last audio frame demuxed
+    # Undecoded video packets in decode order, `_packets[0]` has sequence number `_first_seq`
+    self._packets: Deque[av.Packet] = collections.deque()
+    self._first_seq = 0
+    self._seq_of_pts: dict[int, int] = {}
+    self._keyframe_seqs: list[int] = [] # sequence numbers of the keyframes still in `_packets`
+    self._keyframe_times: list[float] = []
+    self._eof = False
+    # Decoding state
+    self._next_seq: Optional[int] = None # next packet to feed the decoder, None if the decoder is reset
+    self._decoded: Deque[av.VideoFrame] = collections.deque()
+    # Statistics
+    self.num_packets = 0
+    self.num_decoded_packets = 0
+
+  def frames(self) -> Generator[av.AudioFrame | FrameStub]:
+    for frame in stub_frames(self.source, self._on_video_packet):
+      if isinstance(frame, av.AudioFrame) and frame.time is not None:
+        self._audio_time = frame.time
+      yield frame
+    logger.info(f"decoded {self.num_decoded_packets} of {self.num_packets} video packets")
+
+  def _on_video_packet(self, packet: av.Packet) -> None:
+    if packet.pts is None and packet.dts is None:
+      self._eof = True # flushing packet, demuxers may leave the dts of the first video packets unset
+      return
+    seq = self._first_seq + len(self._packets)
+    self._packets.append(packet)
+    self.num_packets += 1
+    if packet.pts is not None:
+      self._seq_of_pts[packet.pts] = seq
+    if packet.is_keyframe:
+      self._keyframe_seqs.append(seq)
+      time = float((packet.dts if packet.dts is not None else packet.pts) * packet.time_base)
+      self._keyframe_times.append(time)
+      # Nothing after the stubs still waiting for their audio or for reordering has been decided on yet
+      decided_until = min(time - self._reorder_duration, self._audio_time) - self.delay
+      self._trim(decided_until - self.window)
+
+  def _trim(self, before_time: float) -> None:
+    # Drop the packets of GOPs that start before the last keyframe at or before `before_time`
+    i = bisect.bisect_right(self._keyframe_times, before_time) - 1
+    if i <= 0:
+      return
+    until_seq = self._keyframe_seqs[i]
+    if self._next_seq is not None and self._next_seq < until_seq:
+      # Nothing kept since a while, the packets the decoder would continue from are too old to be kept around
+      self._next_seq = None
+      self._decoded.clear()
+    while self._first_seq < until_seq:
+      packet = self._packets.popleft()
+      self._first_seq += 1
+      self._seq_of_pts.pop(packet.pts, None)
+    k = bisect.bisect_left(self._keyframe_seqs, self._first_seq)
+    del self._keyframe_seqs[:k]
+    del self._keyframe_times[:k]
+
+  def _reset_decoder(self, seq: int) -> None:
+    self.source.video_stream.codec_context.flush_buffers()
+    self._decoded.clear()
+    self._next_seq = seq
+
+  def _decode_more(self) -> bool:
+    if self._next_seq is None:
+      return False
+    if self._next_seq < self._first_seq + len(self._packets):
+      packet = self._packets[self._next_seq - self._first_seq]
+      self._next_seq += 1
+      self.num_decoded_packets += 1
+      self._decoded.extend(packet.decode())
+      return True
+    if self._eof:
+      self._decoded.extend(self.source.video_stream.codec_context.decode(None))
+      self._next_seq = None
+      return len(self._decoded) > 0
+    return False
+
+  def resolve(self, stub: FrameStub) -> Optional[av.VideoFrame]:
+    """
+    Decode the frame `stub` stands in for. Stubs must be resolved in presentation order.
+    """
+    seq = self._seq_of_pts.get(stub.pts)
+    if seq is None:
+      logger.warning(f"video packet of frame at {stub.time:.3f}s was dropped before it could be decoded, consider a larger lookahead window")
+      return None
+    i = bisect.bisect_right(self._keyframe_seqs, seq) - 1
+    key_seq = self._keyframe_seqs[i] if i >= 0 else self._first_seq
+    if self._next_seq is None or self._next_seq < key_seq:
+      # The decoder is not fed up to this GOP, restart decoding from its keyframe to skip the packets before it
+      self._reset_decoder(key_seq)
+
+    while True:
+      while self._decoded:
+        frame = self._decoded.popleft()
+        if frame.pts == stub.pts:
+          return frame
+        if frame.pts is not None and frame.pts > stub.pts:
+          self._decoded.appendleft(frame)
+          logger.warning(f"decoder skipped frame at {stub.time:.3f}s")
+          return None
+        # Otherwise `frame` precedes `stub` and is cut
+      if not self._decode_more():
+        logger.warning(f"ran out of video packets while decoding frame at {stub.time:.3f}s")
+        return None
+
+  def resolve_chunks(self, cut_chunks: Iterable[CutChunk]) -> Generator[CutChunk]:
+    for cut_chunk in cut_chunks:
+      frame = self.resolve(cut_chunk.video_frame)
+      if frame is not None:
+        cut_chunk.video_frame = frame
+        yield cut_chunk
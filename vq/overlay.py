@@ -0,0 +1,141 @@
+from __future__ import annotations
+from typing import *
+
+from .utils import plane_view
+from dataclasses import dataclass
+import av
+import cv2
+import numpy as np
+
+__all__ = [
+  "TextOverlay",
+]
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+OUTLINE_THICKNESS = 2
+
+Color = tuple[float, float, float] # RGB
+
+def rgb_to_yuv(rgb: np.ndarray, *, full_range: bool) -> np.ndarray:
+  """
+  BT.601 conversion of (..., 3) RGB values to float YUV, as swscale does by default.
+  """
+  r, g, b = (rgb[..., i].astype(np.float32) / 255 for i in range(3))
+  if full_range:
+    y = 255 * (0.299 * r + 0.587 * g + 0.114 * b)
+    u = 128 + 255 * (-0.168736 * r - 0.331264 * g + 0.5 * b)
+    v = 128 + 255 * (0.5 * r - 0.418688 * g - 0.081312 * b)
+  else:
+    y = 16 + 65.481 * r + 128.553 * g + 24.966 * b
+    u = 128 - 37.797 * r - 74.203 * g + 112.0 * b
+    v = 128 + 112.0 * r - 93.786 * g - 18.214 * b
+  return np.stack([y, u, v], axis=-1)
+
+@dataclass
+class _Patch:
+  """
+  One rendered line of text: the pixels it covers in a yuv420p frame, and their values.
+  """
+  key: tuple
+  top: int  # even, so that chroma blocks line up
+  left: int # even
+  y_mask: np.ndarray   # (rows, cols) bool
+  y_values: np.ndarray # uint8, of the pixels in `y_mask`
+  c_mask: np.ndarray   # (rows / 2, cols / 2) bool, chroma blocks partly covered by the text
+  c_coverage: np.ndarray # float32, fraction of each block of `c_mask` covered by the text
+  u_values: np.ndarray # float32, mean chroma of the text in each block of `c_mask`
+  v_values: np.ndarray
+
+  def composite(self, y_plane: np.ndarray, u_plane: np.ndarray, v_plane: np.ndarray) -> None:
+    rows, cols = self.y_mask.shape
+    y_plane[self.top:self.top + rows, self.left:self.left + cols][self.y_mask] = self.y_values
+    # Chroma is shared by 2x2 pixels, blend the text's into it by how much of the block the text covers
+    c_rows, c_cols = self.c_mask.shape
+    c_top, c_left = self.top // 2, self.left // 2
+    for plane, values in ((u_plane, self.u_values), (v_plane, self.v_values)):
+      region = plane[c_top:c_top + c_rows, c_left:c_left + c_cols]
+      original = region[self.c_mask].astype(np.float32)
+      region[self.c_mask] = np.rint(original + (values - original) * self.c_coverage).astype(np.uint8)
+
+class TextOverlay:
+  """
+  Draws lines of outlined text at the bottom of video frames, looking like `cv2.putText` on an RGB conversion of the
+  frame, but straight onto the planes of yuv420p frames so that the frame is never converted. Each line is rendered
+  once into a small patch, and only rendered again when its text or color changes. Only the pixels under the text are
+  written.
+  """
+  def __init__(self, font_scale: float) -> None:
+    self.font_scale = font_scale
+    self._patches: dict[int, _Patch] = {} # by line number
+
+  def baseline(self, line: int, frame_height: int) -> int:
+    """
+    Row of the baseline of the text of `line`, counting lines up from the bottom of the frame.
+    """
+    bottom_pad = 5 * self.font_scale
+    line_height = 25 * self.font_scale
+    return int(frame_height - bottom_pad - (bottom_pad + line_height) * line)
+
+  def draw(self, frame: av.VideoFrame, lines: Sequence[tuple[str, Color]]) -> av.VideoFrame:
+    """
+    Draw `lines` from the bottom of `frame` up, in place. Frames not in yuv420p are converted to it first, and the
+    converted frame is returned.
+    """
+    if frame.format.name not in {"yuv420p", "yuvj420p"}:
+      frame = frame.reformat(format="yuv420p")
+    full_range = frame.format.name == "yuvj420p"
+    chroma_height, chroma_width = (frame.height + 1) // 2, (frame.width + 1) // 2
+    y_plane = plane_view(frame.planes[0], frame.height, frame.width)
+    u_plane = plane_view(frame.planes[1], chroma_height, chroma_width)
+    v_plane = plane_view(frame.planes[2], chroma_height, chroma_width)
+    for line, (text, color) in enumerate(lines):
+      color = tuple(int(round(c)) for c in color)
+      key = (text, color, frame.width, frame.height, full_range)
+      patch = self._patches.get(line)
+      if patch is None or patch.key != key:
+        patch = self._patches[line] = self._render(key, line, text, color, frame.width, frame.height, full_range)
+      patch.composite(y_plane, u_plane, v_plane)
+    return frame
+
+  def _render(self, key: tuple, line: int, text: str, color: Color, width: int, height: int, full_range: bool) -> _Patch:
+    (text_width, text_height), descent = cv2.getTextSize(text, FONT, self.font_scale, OUTLINE_THICKNESS)
+    y = self.baseline(line, height)
+    margin = OUTLINE_THICKNESS + 1
+    top = max(0, y - text_height - margin) & ~1
+    bottom = max(top, min(height, y + descent + margin))
+    right = min(width, text_width + margin)
+    rows = bottom - top + (bottom - top) % 2
+    cols = right + right % 2
+
+    # Drawing is clipped to the patch exactly as it would be to the frame, so the pixels come out the same
+    rgb = np.zeros((rows, cols, 3), dtype=np.uint8)
+    mask = np.zeros((rows, cols), dtype=np.uint8)
+    origin = (0, y - top)
+    cv2.putText(rgb, text, origin, FONT, self.font_scale, (0, 0, 0), OUTLINE_THICKNESS)
+    cv2.putText(rgb, text, origin, FONT, self.font_scale, color)
+    cv2.putText(mask, text, origin, FONT, self.font_scale, 255, OUTLINE_THICKNESS)
+    cv2.putText(mask, text, origin, FONT, self.font_scale, 255)
+    # Rows and columns padded for chroma alignment past the frame are not drawn
+    mask[bottom - top:, :] = 0
+    mask[:, right:] = 0
+    y_mask = mask > 0
+    yuv = rgb_to_yuv(rgb, full_range=full_range)
+
+    blocks = y_mask.reshape(rows // 2, 2, cols // 2, 2)
+    covered = blocks.sum(axis=(1, 3))
+    c_mask = covered > 0
+    def block_mean(values: np.ndarray) -> np.ndarray:
+      sums = (values * y_mask).reshape(rows // 2, 2, cols // 2, 2).sum(axis=(1, 3))
+      return (sums[c_mask] / covered[c_mask]).astype(np.float32)
+
+    return _Patch(
+      key = key,
+      top = top,
+      left = 0,
+      y_mask = y_mask[:bottom - top, :right],
+      y_values = np.rint(yuv[..., 0][y_mask]).astype(np.uint8),
+      c_mask = c_mask,
+      c_coverage = (covered[c_mask] / 4).astype(np.float32),
+      u_values = block_mean(yuv[..., 1]),
+      v_values = block_mean(yuv[..., 2]),
+    )
@@ -0,0 +1,154 @@
+from __future__ import annotations
+from typing import *
+
+from .analysis import LoudnessIndex
+from .index import cached_analyze
+from .chunker import Chunker
+from .concat import concat
+from .core import write_cut_chunks
+from .cutter import Cutter, CutChunk
+from .sink import HandleWriter
+from .source import FileReader, Source, SEEK_MARGIN
+from dataclasses import dataclass
+import av
+import concurrent.futures
+import io
+import logging
+import numpy as np
+import os
+import tempfile
+
+__all__ = [
+  "Segment",
+  "plan_segments",
+  "cut_parallel",
+]
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Segment:
+  start: int # index of the segment's first frame in the `LoudnessIndex`, always a keyframe
+  end: int   # exclusive
+
+def plan_segments(index: LoudnessIndex, keep: np.ndarray, num_segments: int) -> list[Segment]:
+  """
+  Split `index` into at most `num_segments` segments of roughly equal length. Segments start at keyframes, preferring
+  keyframes of frames that are cut so that seams fall into silences.
+  """
+  keyframes = np.flatnonzero(index.key)
+  keyframes = keyframes[keyframes > 0]
+  silent_keyframes = keyframes[~keep[keyframes]]
+  search_radius = len(index) / num_segments / 4
+
+  starts = [0]
+  for k in range(1, num_segments):
+    target = len(index) * k / num_segments
+    candidates = silent_keyframes[np.abs(silent_keyframes - target) <= search_radius]
+    if len(candidates) == 0:
+      candidates = keyframes
+    if len(candidates) == 0:
+      break
+    start = int(candidates[np.argmin(np.abs(candidates - target))])
+    if start > starts[-1]:
+      starts.append(start)
+  ends = starts[1:] + [len(index)]
+  return [Segment(start=start, end=end) for start, end in zip(starts, ends)]
+
+@dataclass
+class _SegmentJob:
+  input_path: str
+  output_path: str
+  segment: Segment
+  pts: np.ndarray  # of the segment's frames
+  dbfs: np.ndarray # of the segment's frames
+  keep: np.ndarray # of the segment's frames
+  end_pts: Optional[int] # pts of the first frame after the segment
+  audio_start_pts: int
+
+def _encode_segment(job: _SegmentJob) -> None:
+  reader = FileReader(job.input_path)
+  with io.open(job.output_path, "wb") as handle:
+    _encode_segment_to(job, reader, HandleWriter(handle, format="matroska"))
+
+def _encode_segment_to(job: _SegmentJob, reader: FileReader, writer: HandleWriter) -> None:
+  with reader.open() as source, writer.open_like(source) as sink:
+    start_pts = int(job.pts[0])
+    end_time = None if job.end_pts is None else float(job.end_pts * source.video_stream.time_base)
+    source.seek(start_pts - round(SEEK_MARGIN / source.video_stream.time_base))
+
+    def frames() -> Generator[av.VideoFrame | av.AudioFrame]:
+      for frame in source.decode():
+        if isinstance(frame, av.VideoFrame):
+          if frame.pts < start_pts:
+            continue
+          if job.end_pts is not None and frame.pts >= job.end_pts:
+            continue # only audio is still needed for the last chunks of the segment
+        elif end_time is not None and frame.time >= end_time + SEEK_MARGIN:
+          break
+        yield frame
+
+    chunker = Chunker(source)
+    chunker.start_at(job.segment.start, job.audio_start_pts)
+
+    def cut_chunks() -> Generator[CutChunk]:
+      for i, chunk in enumerate(chunker.to_chunks(frames())):
+        if i >= len(job.pts):
+          break
+        if chunk.video_frame.pts != job.pts[i]:
+          logger.warning(f"segment frame #{job.segment.start + i} has pts {chunk.video_frame.pts}, expected {job.pts[i]}")
+        if job.keep[i]:
+          yield CutChunk(video_frame=chunk.video_frame, sound=chunk.sound, dbfs=float(job.dbfs[i]))
+
+    write_cut_chunks(sink, cut_chunks())
+
+def cut_parallel(
+  reader: FileReader,
+  writer: HandleWriter,
+  tolerance: float,
+  after_loud_save_duration: float,
+  *,
+  jobs: int,
+  before_loud_save_duration: float = 0.0,
+  analysis_rate: Optional[int] = None,
+  ) -> None:
+  """
+  Like `vq.cut`, but decode, cut and encode `jobs` segments of the input in parallel worker processes, then concatenate
+  them without re-encoding.
+
+  The cut decisions are made once over the whole input by an audio-only pass beforehand, so the `Cutter` state carries
+  over segment seams exactly as in a sequential run. `before_loud_save_duration` needs no holding back here.
+  """
+  index = cached_analyze(reader, analysis_rate=analysis_rate)
+  with reader.open() as source:
+    keep = Cutter(
+      source,
+      tolerance = tolerance,
+      after_loud_save_duration = after_loud_save_duration,
+      before_loud_save_duration = before_loud_save_duration,
+      ).keep_mask(index)
+  segments = plan_segments(index, keep, jobs)
+  logger.info(f"cutting {len(segments)} segments with {jobs} jobs")
+
+  with tempfile.TemporaryDirectory(prefix="vq-") as tmpdir:
+    job_list = []
+    for i, segment in enumerate(segments):
+      job_list.append(_SegmentJob(
+        input_path      = reader.path,
+        output_path     = os.path.join(tmpdir, f"segment-{i:04d}.mkv"),
+        segment         = segment,
+        pts             = index.pts[segment.start:segment.end],
+        dbfs            = index.dbfs[segment.start:segment.end],
+        keep            = keep[segment.start:segment.end],
+        end_pts         = int(index.pts[segment.end]) if segment.end < len(index) else None,
+        audio_start_pts = index.audio_start_pts,
+      ))
+    # A segment whose every frame is cut would be an empty file that `concat` cannot open
+    job_list = [job for job in job_list if job.keep.any()]
+    if not job_list:
+      logger.warning("every frame was cut, the output is empty")
+      return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+      for _ in executor.map(_encode_segment, job_list):
+        pass
+    concat([job.output_path for job in job_list], writer)
@@ -0,0 +1,95 @@
+from __future__ import annotations
+from typing import *
+
+import logging
+import queue
+import threading
+
+__all__ = [
+  "ThreadedStage",
+]
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_END = object()
+
+class _Failure:
+  def __init__(self, exception: BaseException) -> None:
+    self.exception = exception
+
+class ThreadedStage(Generic[T]):
+  """
+  Runs `iterable` in a background thread, handing its items over through a queue of at most `maxsize` items.
+
+  Iterating over the stage yields the items of `iterable` in order. An exception raised by `iterable` is re-raised
+  in the iterating thread. Iteration can only happen once. `close` must be called once the stage is not iterated over
+  anymore, before whatever `iterable` reads from is closed.
+  """
+  def __init__(self, iterable: Iterable[T], *, maxsize: int, name: str) -> None:
+    self.name = name
+    self.queue: queue.Queue = queue.Queue(maxsize)
+    self._iterable = iterable
+    self._stop = threading.Event()
+    self._thread = threading.Thread(target=self._run, name=f"vq-{name}", daemon=True)
+    self._thread.start()
+
+  @property
+  def depth(self) -> int:
+    return self.queue.qsize()
+
+  def _put(self, item: Any) -> bool:
+    # Blocks while the queue is full, returns False if the consumer has gone away meanwhile
+    while not self._stop.is_set():
+      try:
+        self.queue.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def _run(self) -> None:
+    try:
+      for item in self._iterable:
+        if not self._put(item):
+          return
+    except BaseException as e:
+      self._put(_Failure(e))
+    else:
+      self._put(_END)
+    finally:
+      # Closed in this thread, so that the generators of `iterable` (and the stages they iterate over) stop here too
+      close = getattr(self._iterable, "close", None)
+      if close is not None:
+        close()
+
+  def close(self) -> None:
+    """
+    Stop the thread and wait for it to end. It stops once `iterable` yields its next item, or right away if it is
+    waiting for room in the queue. The items left in the queue are dropped.
+    """
+    self._stop.set()
+    while self._thread.is_alive():
+      self._drain()
+      self._thread.join(timeout=0.1)
+    self._drain()
+
+  def _drain(self) -> None:
+    try:
+      while True:
+        self.queue.get_nowait()
+    except queue.Empty:
+      pass
+
+  def __iter__(self) -> Generator[T]:
+    try:
+      while True:
+        item = self.queue.get()
+        if item is _END:
+          return
+        if isinstance(item, _Failure):
+          raise item.exception
+        yield item
+    finally:
+      self._stop.set()
@@ -0,0 +1,199 @@
+from __future__ import annotations
+from typing import *
+
+from dataclasses import dataclass
+import collections
+import io
+import os
+import tempfile
+import threading
+import time
+
+__all__ = [
+  "PrefetchStats",
+  "PrefetchReader",
+  "DEFAULT_PREFETCH_SIZE",
+]
+
+# Default of `PrefetchReader.capacity`
+DEFAULT_PREFETCH_SIZE = 32 * 2**20
+
+@dataclass
+class PrefetchStats:
+  bytes_received: int = 0 # read from the pipe
+  bytes_consumed: int = 0 # read by the consumer
+  max_buffered: int = 0
+  stalls: int = 0 # reads that found the buffer empty and had to wait for the pipe
+  stall_seconds: float = 0.0
+  full_waits: int = 0 # times the background thread waited for the consumer because the buffer was full
+
+  @property
+  def buffered(self) -> int:
+    return self.bytes_received - self.bytes_consumed
+
+  def summary(self) -> str:
+    return (
+      f"prefetch received={self.bytes_received / 2**20:.1f}MiB max_buffered={self.max_buffered / 2**20:.1f}MiB"
+      f" stalls={self.stalls} ({self.stall_seconds:.2f}s) full_waits={self.full_waits}"
+    )
+
+class PrefetchReader(io.RawIOBase):
+  """
+  Reads a pipe ahead in a background thread, so that stalls of the process writing to it are absorbed by up to
+  `capacity` bytes of buffered data instead of stalling the consumer. Readable, not seekable, like the pipe itself.
+
+  The buffer is kept in memory, or in an anonymous temporary file in `spill_dir` if given, which allows a capacity
+  larger than memory would.
+  """
+  def __init__(
+    self,
+    pipe: BinaryIO,
+    *,
+    capacity: int = DEFAULT_PREFETCH_SIZE,
+    chunk_size: int = 2**16,
+    spill_dir: Optional[str] = None,
+  ) -> None:
+    """
+    :param capacity: Read at most this many bytes ahead of the consumer
+    :param chunk_size: Read the pipe this many bytes at a time
+    :param spill_dir: If set, buffer in a temporary file in this directory instead of memory
+    """
+    super().__init__()
+    assert capacity >= chunk_size
+    self.pipe = pipe
+    self.capacity = capacity
+    self.chunk_size = chunk_size
+    self.stats = PrefetchStats()
+    self._cond = threading.Condition()
+    self._eof = False
+    self._error: Optional[BaseException] = None
+    self._stopped = False
+    # Whether the spill file is being written or read, which is done without holding `_cond`
+    self._writing = False
+    self._reading = False
+    if spill_dir is None:
+      self._chunks: Deque[memoryview] = collections.deque()
+      self._spill = None
+    else:
+      # Used as a ring of `capacity` bytes, see `_spill_write`, so that it never grows larger than that
+      self._spill = tempfile.TemporaryFile(dir=spill_dir)
+    self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+    self._thread.start()
+
+  def _run(self) -> None:
+    try:
+      while True:
+        with self._cond:
+          while self.stats.buffered + self.chunk_size > self.capacity and not self._stopped:
+            self.stats.full_waits += 1
+            self._cond.wait()
+          if self._stopped:
+            return
+        data = self.pipe.read1(self.chunk_size) if hasattr(self.pipe, "read1") else self.pipe.read(self.chunk_size)
+        with self._cond:
+          if self._stopped:
+            return
+          if not data:
+            self._eof = True
+            self._cond.notify_all()
+            return
+          if self._spill is None:
+            self._chunks.append(memoryview(data))
+            self._received(len(data))
+            continue
+          # Written without holding `_cond`, so that a slow disk does not block the consumer too. The ring has room for
+          # `data` from `bytes_received` on, checked above, and the consumer reads none of it until it is received
+          position = self.stats.bytes_received % self.capacity
+          self._writing = True
+        written = False
+        try:
+          self._spill_write(data, position)
+          written = True
+        finally:
+          with self._cond:
+            self._writing = False
+            if written:
+              self._received(len(data))
+            self._cond.notify_all()
+    except BaseException as e:
+      with self._cond:
+        self._error = e
+        self._cond.notify_all()
+
+  def _received(self, size: int) -> None:
+    self.stats.bytes_received += size
+    self.stats.max_buffered = max(self.stats.max_buffered, self.stats.buffered)
+    self._cond.notify_all()
+
+  def _spill_write(self, data: bytes, position: int) -> None:
+    # Byte n of the pipe goes to position n % `capacity` of the file, where it stays until it is read, as no more than
+    # `capacity` bytes are ever buffered
+    view = memoryview(data)
+    while view:
+      written = os.pwrite(self._spill.fileno(), view[:self.capacity - position], position)
+      view = view[written:]
+      position = (position + written) % self.capacity
+
+  def _spill_read(self, buffer: memoryview, position: int) -> int:
+    # Stops at the end of the ring, the rest is read by the next call
+    return os.preadv(self._spill.fileno(), [buffer[:self.capacity - position]], position)
+
+  def readable(self) -> bool:
+    return True
+
+  def readinto(self, buffer: memoryview) -> int:
+    with self._cond:
+      while self._reading:
+        self._cond.wait() # another thread is reading the spill file
+      if self.stats.buffered == 0 and not self._eof and self._error is None:
+        self.stats.stalls += 1
+        start = time.monotonic()
+        while self.stats.buffered == 0 and not self._eof and self._error is None:
+          self._cond.wait()
+        self.stats.stall_seconds += time.monotonic() - start
+      if self.stats.buffered == 0:
+        if self._error is not None:
+          raise IOError(f"reading the pipe failed: {self._error}") from self._error
+        return 0 # end of file
+
+      size = min(len(buffer), self.stats.buffered)
+      if self._spill is None:
+        offset = 0
+        while offset < size:
+          chunk = self._chunks[0]
+          n = min(len(chunk), size - offset)
+          buffer[offset:offset + n] = chunk[:n]
+          if n == len(chunk):
+            self._chunks.popleft()
+          else:
+            self._chunks[0] = chunk[n:]
+          offset += n
+        self.stats.bytes_consumed += size
+        self._cond.notify_all()
+        return size
+      # Read without holding `_cond`, like `_spill_write`. The pipe thread writes none of these bytes over until they
+      # are consumed
+      position = self.stats.bytes_consumed % self.capacity
+      self._reading = True
+    num_read = 0
+    try:
+      num_read = self._spill_read(memoryview(buffer)[:size], position)
+    finally:
+      with self._cond:
+        self._reading = False
+        self.stats.bytes_consumed += num_read
+        self._cond.notify_all()
+    return num_read
+
+  def close(self) -> None:
+    if not self.closed:
+      with self._cond:
+        self._stopped = True
+        self._cond.notify_all()
+        # The spill file is not closed under a write or read in progress, whose file descriptor could be reused
+        while self._writing or self._reading:
+          self._cond.wait()
+      # The thread may still be blocked reading the pipe, it exits once the pipe is closed or ends
+      if self._spill is not None:
+        self._spill.close()
+    super().close()
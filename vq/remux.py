@@ -0,0 +1,154 @@
+from __future__ import annotations
+from typing import *
+
+from .analysis import LoudnessIndex, analyze
+from .core import cut
+from .cutter import Cutter
+from .sink import HandleWriter
+from .source import Source
+from dataclasses import dataclass
+import av
+import bisect
+import logging
+import numpy as np
+
+__all__ = [
+  "KeptRange",
+  "gop_keep_mask",
+  "kept_ranges",
+  "remux",
+  "DEFAULT_MAX_REMUX_EXTRA",
+]
+
+logger = logging.getLogger(__name__)
+
+# Default of `remux`'s `max_extra`
+DEFAULT_MAX_REMUX_EXTRA = 0.05
+
+@dataclass
+class KeptRange:
+  start: float # in seconds
+  end: float   # in seconds, exclusive
+  offset: float # seconds removed before `start`
+
+def _gops(index: LoudnessIndex, keep: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  # GOP of each frame, first frame of each GOP, and whether each GOP has a kept frame
+  gop = np.maximum(np.cumsum(index.key) - 1, 0)
+  gop_starts = np.flatnonzero(np.r_[True, gop[1:] != gop[:-1]])
+  return gop, gop_starts, np.logical_or.reduceat(keep, gop_starts)
+
+def gop_keep_mask(index: LoudnessIndex, keep: np.ndarray) -> np.ndarray:
+  """
+  The frames of `index` that `remux` copies: `keep` widened to whole GOPs.
+  """
+  if len(index) == 0:
+    return keep
+  gop, _, gop_kept = _gops(index, keep)
+  return gop_kept[gop]
+
+def kept_ranges(index: LoudnessIndex, keep: np.ndarray) -> list[KeptRange]:
+  """
+  Widen the kept frames of `index` to whole GOPs and merge them into time ranges.
+
+  A GOP is kept if any of its frames is kept, so a packet can be copied if and only if its GOP is.
+  """
+  if len(index) == 0:
+    return []
+  time = index.time
+  _, gop_starts, gop_kept = _gops(index, keep)
+
+  ranges: list[KeptRange] = []
+  removed = 0.0
+  last_end = 0.0
+  for i, start_ix in enumerate(gop_starts.tolist()):
+    if not gop_kept[i]:
+      continue
+    start = 0.0 if i == 0 else float(time[start_ix])
+    end = float(time[gop_starts[i + 1]]) if i + 1 < len(gop_starts) else np.inf
+    if ranges and ranges[-1].end == start:
+      ranges[-1].end = end
+    else:
+      removed += start - last_end
+      ranges.append(KeptRange(start=start, end=end, offset=removed))
+    last_end = end
+  return ranges
+
+def remux(
+  source: Source,
+  writer: HandleWriter,
+  tolerance: float,
+  after_loud_save_duration: float,
+  *,
+  before_loud_save_duration: float = 0.0,
+  index: Optional[LoudnessIndex] = None,
+  analysis_rate: Optional[int] = None,
+  max_extra: float = DEFAULT_MAX_REMUX_EXTRA,
+  ) -> None:
+  """
+  Cut `source` in two passes: decode only the audio to decide what to keep, then stream-copy the packets of the kept
+  GOPs into `writer`. Nothing is re-encoded, so cut boundaries are widened to the nearest keyframes.
+
+  The farther apart the keyframes, the more of what was decided to be cut this keeps. If it would keep more than
+  `max_extra` times as many frames again as decided, `source` is cut with `cut` instead, which re-encodes it.
+
+  `source` must be seekable.
+
+  :param index: The `LoudnessIndex` of `source` if it is already known, which skips the first pass
+  :param analysis_rate: See `analyze`, if `index` is not given
+  :param max_extra: Share of the kept frames that widening to GOPs may add
+  """
+  cutter = Cutter(
+    source,
+    tolerance = tolerance,
+    after_loud_save_duration = after_loud_save_duration,
+    before_loud_save_duration = before_loud_save_duration,
+    )
+  if index is None:
+    index = analyze(source, analysis_rate=analysis_rate)
+  keep = cutter.keep_mask(index)
+  num_kept, num_copied = int(keep.sum()), int(gop_keep_mask(index, keep).sum())
+  if num_copied > num_kept * (1 + max_extra):
+    rate = float(index.average_rate)
+    logger.warning(
+      f"keyframes are {index.duration / max(1, int(index.key.sum())):.2f}s apart on average, copying whole GOPs would keep"
+      f" {num_copied / rate:.3f}s instead of {num_kept / rate:.3f}s, re-encoding instead"
+    )
+    source.rewind()
+    with writer.open_like(source) as sink:
+      cut(
+        source, sink, tolerance, after_loud_save_duration,
+        before_loud_save_duration = before_loud_save_duration,
+        analysis_rate = analysis_rate,
+      )
+    return
+  ranges = kept_ranges(index, keep)
+  if not ranges:
+    logger.info("nothing is loud enough to be kept")
+  else:
+    logger.info(f"remuxing {len(ranges)} ranges, removing {ranges[-1].offset:.3f}s")
+
+  source.rewind()
+  starts = [r.start for r in ranges]
+  with writer.open_copy_like(source) as sink:
+    # Index of the range the current video GOP is kept in, or None if it is cut.
+    # Video is copied GOP by GOP in decode order, a GOP is kept if its keyframe is in range.
+    gop_range: Optional[int] = 0 if ranges and ranges[0].start == 0.0 else None
+    for packet in source.demux():
+      if packet.pts is None and packet.dts is None:
+        continue # flushing packet, demuxers may leave the dts of the first video packets unset
+      kind = packet.stream.type
+      pts = packet.pts if packet.pts is not None else packet.dts
+      time = float(pts) * packet.time_base.numerator / packet.time_base.denominator # same arithmetic as `LoudnessIndex.time`
+      i = bisect.bisect_right(starts, time) - 1
+      in_range = i >= 0 and time < ranges[i].end
+
+      if kind == "video":
+        if packet.is_keyframe:
+          gop_range = i if in_range else None
+        if gop_range is None:
+          continue
+        i = gop_range
+      elif not in_range:
+        continue
+
+      sink.write_packet(packet, offset=ranges[i].offset)
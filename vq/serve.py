@@ -0,0 +1,296 @@
+from __future__ import annotations
+from typing import *
+
+from .analysis import LoudnessIndex
+from .chunker import Chunker
+from .core import write_cut_chunks
+from .cutter import Cutter, CutChunk
+from .index import cached_analyze, index_path
+from .sink import HandleWriter
+from .source import FileReader, Source
+from dataclasses import dataclass
+import asyncio
+import concurrent.futures
+import http
+import io
+import logging
+import numpy as np
+import os
+import threading
+import urllib.parse
+
+__all__ = [
+  "AnalysisCache",
+  "CutServer",
+  "DEFAULT_MAX_JOBS",
+]
+
+logger = logging.getLogger(__name__)
+
+# Default of `CutServer.max_jobs`
+DEFAULT_MAX_JOBS = 4
+
+# Writes of the muxer queued for a client before the job waits for the client to catch up
+RESPONSE_QUEUE_SIZE = 64
+
+# Seconds a client has to send its request
+REQUEST_TIMEOUT = 10.0
+
+class HttpError(Exception):
+  def __init__(self, status: http.HTTPStatus, message: str) -> None:
+    super().__init__(message)
+    self.status = status
+
+@dataclass
+class CutRequest:
+  path: str
+  tolerance: float
+  after_loud_save_duration: float
+  before_loud_save_duration: float
+
+class AnalysisCache:
+  """
+  Loudness indices of the sources served, shared by all the requests. The first request for a source analyzes it, or
+  loads the index `cached_analyze` keeps on disk, and the requests for it arriving meanwhile wait for that analysis
+  instead of starting their own. Thread-safe.
+  """
+  def __init__(self, *, analysis_rate: Optional[int] = None) -> None:
+    self.analysis_rate = analysis_rate
+    self._lock = threading.Lock()
+    self._indices: dict[str, concurrent.futures.Future[LoudnessIndex]] = {}
+
+  def get(self, reader: FileReader) -> LoudnessIndex:
+    # Keyed like the disk cache, so that a modified file is analyzed again
+    key = index_path(reader.path, analysis_rate=self.analysis_rate)
+    with self._lock:
+      future = self._indices.get(key)
+      analyzing = future is None
+      if analyzing:
+        future = self._indices[key] = concurrent.futures.Future()
+    if analyzing:
+      try:
+        future.set_result(cached_analyze(reader, analysis_rate=self.analysis_rate))
+      except BaseException as e:
+        with self._lock:
+          del self._indices[key] # the next request tries again
+        future.set_exception(e)
+    return future.result()
+
+class _ResponseStream(io.RawIOBase):
+  """
+  Where a job's muxer writes, from a worker thread: each write is queued for the event loop to send. Writing blocks
+  while `RESPONSE_QUEUE_SIZE` writes are waiting to be sent, and fails with `BrokenPipeError` once the job is cancelled.
+  """
+  def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+    super().__init__()
+    self.loop = loop
+    self.queue: asyncio.Queue[Optional[bytes]] = asyncio.Queue() # None once the job is done
+    self.slots = threading.Semaphore(RESPONSE_QUEUE_SIZE)
+    self.cancelled = threading.Event()
+
+  def writable(self) -> bool:
+    return True
+
+  def write(self, data: bytes) -> int:
+    while not self.slots.acquire(timeout=0.1):
+      if self.cancelled.is_set():
+        break
+    if self.cancelled.is_set():
+      raise BrokenPipeError("client disconnected")
+    self.loop.call_soon_threadsafe(self.queue.put_nowait, bytes(data))
+    return len(data)
+
+  def finish(self) -> None:
+    self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+
+def kept_chunks(source: Source, index: LoudnessIndex, keep: np.ndarray, cancelled: threading.Event) -> Generator[CutChunk]:
+  """
+  Decode `source` into the chunks `keep` tells to keep, with the loudness of `index`.
+  """
+  chunker = Chunker(source)
+  for i, chunk in enumerate(chunker.to_chunks(source.decode())):
+    if cancelled.is_set():
+      raise BrokenPipeError("client disconnected")
+    if i >= len(keep):
+      break
+    if keep[i]:
+      yield CutChunk(video_frame=chunk.video_frame, sound=chunk.sound, dbfs=float(index.dbfs[i]))
+
+class CutServer:
+  """
+  Serves `GET /cut?src=<path>&t=<tolerance>&m=<after_loud_save_duration>&b=<before_loud_save_duration>` as cut
+  matroska streamed with chunked transfer encoding, `src` being a file under `root`, and `t`, `m` and `b` defaulting
+  like the command line's options.
+
+  Each request is cut by a job in a pool of `max_jobs` threads, from the loudness index of its source shared through
+  an `AnalysisCache`. Requests arriving while `max_jobs` jobs are running are turned down with 503, and a job is
+  cancelled when its client disconnects.
+  """
+  def __init__(
+    self,
+    root: str,
+    *,
+    max_jobs: int = DEFAULT_MAX_JOBS,
+    threads: int = 0,
+    latency_profile: str = "live",
+    analysis_rate: Optional[int] = None,
+  ) -> None:
+    """
+    :param threads: Number of threads used by each decoder and encoder, 0 lets the codecs decide
+    :param latency_profile: Name of the `LatencyProfile` of the outputs
+    :param analysis_rate: See `vq.cut`
+    """
+    self.root = os.path.realpath(root)
+    self.max_jobs = max_jobs
+    self.threads = threads
+    self.latency_profile = latency_profile
+    self.cache = AnalysisCache(analysis_rate=analysis_rate)
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="vq-job")
+    self.num_jobs = 0 # only touched from the event loop
+
+  async def serve(self, host: str, port: int) -> None:
+    server = await asyncio.start_server(self.handle, host, port)
+    async with server:
+      logger.info(f"serving {self.root} on http://{host}:{port}/cut")
+      try:
+        await server.serve_forever()
+      finally:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+  async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+      try:
+        request = self.parse_request(*await self._read_request(reader))
+        if self.num_jobs >= self.max_jobs:
+          raise HttpError(http.HTTPStatus.SERVICE_UNAVAILABLE, f"already running {self.max_jobs} jobs")
+      except HttpError as e:
+        await self._send_error(writer, e)
+        return
+      self.num_jobs += 1
+      try:
+        await self._stream(request, reader, writer)
+      finally:
+        self.num_jobs -= 1
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+
+  async def _read_request(self, reader: asyncio.StreamReader) -> tuple[str, str]:
+    try:
+      head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), REQUEST_TIMEOUT)
+    except asyncio.LimitOverrunError:
+      raise HttpError(http.HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "request too large")
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+      raise ConnectionResetError("no request")
+    request_line = head.split(b"\r\n", 1)[0].decode("latin-1")
+    parts = request_line.split(" ")
+    if len(parts) != 3:
+      raise HttpError(http.HTTPStatus.BAD_REQUEST, f"malformed request line {request_line!r}")
+    return parts[0], parts[1]
+
+  def parse_request(self, method: str, target: str) -> CutRequest:
+    url = urllib.parse.urlsplit(target)
+    if url.path != "/cut":
+      raise HttpError(http.HTTPStatus.NOT_FOUND, f"no such resource {url.path}")
+    if method != "GET":
+      raise HttpError(http.HTTPStatus.METHOD_NOT_ALLOWED, f"{method} is not allowed")
+    query = urllib.parse.parse_qs(url.query)
+    if "src" not in query:
+      raise HttpError(http.HTTPStatus.BAD_REQUEST, "missing src")
+    path = os.path.realpath(os.path.join(self.root, query["src"][0]))
+    if os.path.commonpath([self.root, path]) != self.root:
+      raise HttpError(http.HTTPStatus.FORBIDDEN, f"{query['src'][0]} is outside of the served directory")
+    if not os.path.isfile(path):
+      raise HttpError(http.HTTPStatus.NOT_FOUND, f"no such file {query['src'][0]}")
+    def number(name: str, default: float) -> float:
+      try:
+        return float(query[name][0]) if name in query else default
+      except ValueError:
+        raise HttpError(http.HTTPStatus.BAD_REQUEST, f"{name} must be a number")
+    request = CutRequest(
+      path = path,
+      tolerance = number("t", -20.0),
+      after_loud_save_duration = number("m", 0.3),
+      before_loud_save_duration = number("b", 0.0),
+    )
+    if request.before_loud_save_duration < 0:
+      raise HttpError(http.HTTPStatus.BAD_REQUEST, "b cannot be negative")
+    return request
+
+  async def _send_error(self, writer: asyncio.StreamWriter, error: HttpError) -> None:
+    body = f"{error}\n".encode()
+    writer.write(
+      f"HTTP/1.1 {error.status.value} {error.status.phrase}\r\n"
+      f"Content-Type: text/plain; charset=utf-8\r\n"
+      f"Content-Length: {len(body)}\r\n"
+      f"Connection: close\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+
+  async def _stream(self, request: CutRequest, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    loop = asyncio.get_running_loop()
+    stream = _ResponseStream(loop)
+    job = loop.run_in_executor(self.executor, self._run_job, request, stream)
+    # The client sends nothing after its request, so the end of its stream means that it is gone
+    disconnected = asyncio.ensure_future(reader.read())
+    headers_sent = False
+    try:
+      while True:
+        receive = asyncio.ensure_future(stream.queue.get())
+        await asyncio.wait({receive, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+        if not receive.done():
+          receive.cancel()
+          raise ConnectionResetError("client disconnected")
+        data = receive.result()
+        if data is None:
+          break
+        if not headers_sent:
+          # Held back until the first output, so that a source that cannot be opened is still reported as an error
+          writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            b"Content-Type: video/x-matroska\r\n"
+            b"Transfer-Encoding: chunked\r\n"
+            b"Connection: close\r\n\r\n"
+          )
+          headers_sent = True
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+        await writer.drain()
+        stream.slots.release()
+      try:
+        await job
+      except Exception as e:
+        logger.error(f"cutting {request.path} failed: {type(e).__name__}: {e}")
+        if not headers_sent:
+          await self._send_error(writer, HttpError(http.HTTPStatus.INTERNAL_SERVER_ERROR, f"{type(e).__name__}: {e}"))
+        return # a response cut short is left without its last chunk, so that the client sees it is incomplete
+      writer.write(b"0\r\n\r\n")
+      await writer.drain()
+    finally:
+      disconnected.cancel()
+      if not job.done():
+        stream.cancelled.set()
+        logger.info(f"client disconnected, cancelling the cut of {request.path}")
+        # The job stops at its next chunk or write, wait for it so that it still counts against `max_jobs` until then
+        await asyncio.wait({job})
+        if not job.cancelled():
+          job.exception() # the BrokenPipeError it stopped with, expected
+
+  def _run_job(self, request: CutRequest, stream: _ResponseStream) -> None:
+    try:
+      reader = FileReader(request.path)
+      index = self.cache.get(reader)
+      writer = HandleWriter(stream, format="matroska", latency_profile=self.latency_profile)
+      with reader.open() as source:
+        keep = Cutter(
+          source,
+          tolerance = request.tolerance,
+          after_loud_save_duration = request.after_loud_save_duration,
+          before_loud_save_duration = request.before_loud_save_duration,
+          ).keep_mask(index)
+        with writer.open_like(source) as sink:
+          source.enable_threading(self.threads)
+          sink.enable_threading(self.threads)
+          write_cut_chunks(sink, kept_chunks(source, index, keep, stream.cancelled))
+    finally:
+      stream.finish()
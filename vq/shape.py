@@ -0,0 +1,86 @@
+from __future__ import annotations
+from typing import *
+
+from .chunker import FrameStub
+from .cutter import CutChunk
+import av
+import fractions
+import math
+
+__all__ = [
+  "decimate",
+  "output_rate",
+  "output_size",
+  "scale_cut_chunks",
+  "scale_frames",
+]
+
+def output_size(width: int, height: int, *, scale: Optional[float] = None, max_height: Optional[int] = None) -> tuple[int, int]:
+  """
+  Size of the output video of a `width`x`height` source, scaled down by `scale` and/or to at most `max_height` rows,
+  keeping the aspect ratio. Never larger than the source. Scaled sizes are even, as yuv420p subsamples chroma by 2.
+  """
+  factor = 1.0 if scale is None else scale
+  if max_height is not None and height * factor > max_height:
+    factor = max_height / height
+  if factor >= 1.0:
+    return width, height
+  return max(2, round(width * factor / 2) * 2), max(2, round(height * factor / 2) * 2)
+
+def output_rate(source_rate: fractions.Fraction, fps: Optional[float] = None) -> fractions.Fraction:
+  """
+  Frame rate of the output video of a `source_rate` source, decimated to at most `fps`.
+  """
+  if fps is None or fps >= source_rate:
+    return source_rate
+  return fractions.Fraction(fps).limit_denominator(1001)
+
+def decimate(
+  frames: Iterable[av.VideoFrame | FrameStub | av.AudioFrame],
+  *,
+  rate: fractions.Fraction,
+  source_rate: fractions.Fraction,
+  start_time: float = 0.0,
+  ) -> Generator[av.VideoFrame | FrameStub | av.AudioFrame]:
+  """
+  Drop video frames of `frames` so that `rate` of the `source_rate` per second remain, from their timestamps only, so
+  that dropped frames are never converted nor encoded. A frame is kept when it is the first one in an interval of
+  1/`rate` seconds from `start_time`. Audio frames are all passed through.
+  """
+  # Frames are placed half a source frame late, so that frames right on an interval boundary fall in it despite
+  # rounding errors in their time
+  offset = 0.5 / float(source_rate) - start_time
+  last_slot: Optional[int] = None
+  for frame in frames:
+    if not isinstance(frame, av.AudioFrame):
+      slot = math.floor((frame.time + offset) * float(rate))
+      if last_slot is not None and slot <= last_slot:
+        continue
+      last_slot = slot
+    yield frame
+
+def scale_frame(frame: av.VideoFrame, width: int, height: int) -> av.VideoFrame:
+  # Scaled by libswscale in its own format, so that nothing is converted to RGB or numpy
+  scaled = frame.reformat(width=width, height=height, interpolation="AREA")
+  scaled.pts = frame.pts
+  scaled.time_base = frame.time_base
+  return scaled
+
+def scale_frames(frames: Iterable[av.VideoFrame | FrameStub | av.AudioFrame], width: int, height: int) -> Generator[av.VideoFrame | FrameStub | av.AudioFrame]:
+  """
+  Scale the video frames of `frames` to `width`x`height`. Audio frames and stubs are passed through.
+  """
+  for frame in frames:
+    if isinstance(frame, av.VideoFrame) and (frame.width, frame.height) != (width, height):
+      frame = scale_frame(frame, width, height)
+    yield frame
+
+def scale_cut_chunks(cut_chunks: Iterable[CutChunk], width: int, height: int) -> Generator[CutChunk]:
+  """
+  Like `scale_frames`, for chunks whose frames are only decoded once they are kept.
+  """
+  for cut_chunk in cut_chunks:
+    frame = cut_chunk.video_frame
+    if (frame.width, frame.height) != (width, height):
+      cut_chunk.video_frame = scale_frame(frame, width, height)
+    yield cut_chunk
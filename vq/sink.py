@@ -1,20 +1,40 @@
 from __future__ import annotations
 from typing import *
 from .source import Source
-from vq.sound import Sound
+from vq.sound import Sound, SoundBuffer
+from .utils import audio_format_to_dtype
+from .latency import LATENCY_PROFILES, LatencyMeter
+from .shape import output_rate, output_size
+from .stats import Stats
 from dataclasses import dataclass
 import av
 import sys
 import abc
+import collections
 import contextlib
+import fractions
+import logging
+import numpy as np
+import threading
 
 __all__ = [
   "SinkError",
   "Sink",
+  "CopySink",
   "Writer",
   "HandleWriter",
+  "TeeWriter",
+  "DEFAULT_OUTPUT_BUFFER_SIZE",
 ]
 
+logger = logging.getLogger(__name__)
+
+# Default of `TeeWriter.max_buffered_bytes`
+DEFAULT_OUTPUT_BUFFER_SIZE = 64 * 2**20
+
+# Seconds `OutputMuxer.abort` waits for a mux in progress, which may be stuck writing to a pipe nobody reads
+ABORT_TIMEOUT = 5.0
+
 class SinkError(Exception):
   pass
 
@@ -25,28 +45,208 @@ class Sink:
     container: av.OutputContainer,
     video_stream: av.VideoStream,
     audio_stream: av.AudioStream,
+    flush_handle: Optional[BinaryIO] = None,
+    flush_always: bool = True,
+    latency: Optional[LatencyMeter] = None,
+    stats: Optional[Stats] = None,
+    fanout: Optional[Fanout] = None,
     ):
+    """
+    :param flush_handle: If set, flush this handle after muxing so that packets reach the output immediately
+    :param flush_always: Flush `flush_handle` after every mux, instead of only until the first video packet is written
+    :param latency: If set, mark when the packet of each video frame has been written
+    :param stats: If set, time encoding and muxing and count the written video frames
+    :param fanout: If set, hand the packets to it to be muxed into its outputs instead of muxing them into `container`
+    """
     self.container = container
     self.video_stream = video_stream
     self.audio_stream = audio_stream
+    self.flush_handle = flush_handle
+    self.flush_always = flush_always
+    self._wrote_video = False
+    self.latency = latency
+    self.stats = stats
+    self.fanout = fanout
+    self.num_video_frames = 0
+    self._source_pts: dict[int, int] = {} # source pts of the video frames being encoded, by their output pts
+    # Kept audio waits here until it fills a whole frame of the encoder
+    codec_context = audio_stream.codec_context
+    self._audio_format = codec_context.format
+    self._audio_layout = codec_context.layout.name
+    self._audio_time_base = fractions.Fraction(1, audio_stream.rate)
+    # Packed formats have their channels interleaved in a single row of samples
+    self._audio_row_samples = 1 if self._audio_format.is_planar else codec_context.channels
+    self._audio_frame_size: Optional[int] = None # known once the encoder is open, 0 if it takes frames of any size
+    self._audio_fifo = SoundBuffer(
+      num_channels = codec_context.channels if self._audio_format.is_planar else 1,
+      dtype = audio_format_to_dtype(self._audio_format),
+    )
+    self.num_audio_samples = 0 # per channel, sent to the encoder
+    self._pending: list[av.Packet] = [] # encoded audio packets muxed along with the next video frame
 
-  def enable_threading(self) -> None:
+  @property
+  def video_rate(self) -> fractions.Fraction:
+    """
+    Frame rate the video is encoded at, which may be lower than the source's.
+    """
+    # The time base is only set once the encoder is open, the frame rate as soon as the stream is added
+    return self.video_stream.codec_context.framerate
+
+  @property
+  def video_size(self) -> tuple[int, int]:
+    """
+    Width and height the video is encoded at, which may be smaller than the source's.
+    """
+    return self.video_stream.codec_context.width, self.video_stream.codec_context.height
+
+  def enable_threading(self, thread_count: int = 0) -> None:
+    """
+    :param thread_count: Number of threads per codec, 0 lets the codecs decide
+    """
     self.video_stream.thread_type = "AUTO"
     self.audio_stream.thread_type = "AUTO"
+    self.video_stream.thread_count = thread_count
+    self.audio_stream.thread_count = thread_count
+
+  def timing(self, name: str) -> ContextManager:
+    """
+    Time the block as stage `name` if `stats` is set.
+    """
+    return self.stats.timing(name) if self.stats is not None else contextlib.nullcontext()
 
   def write_sound(self, sound: Sound) -> None:
     assert isinstance(sound, Sound)
-    frame = av.AudioFrame.from_ndarray(
-      sound.samples,
-      format=self.audio_stream.codec_context.format.name,
-      layout=self.audio_stream.codec_context.layout.name
-    )
+    # The encoder's format and layout are its defaults for the codec, which need not be those of the decoded audio
+    if sound.dtype != self._audio_fifo.dtype or sound.num_channels != self._audio_fifo.num_channels:
+      raise SinkError(
+        f"cannot encode {sound.num_channels} rows of {sound.dtype} samples as {self._audio_format.name} {self._audio_layout} "
+        f"({self._audio_fifo.num_channels} rows of {self._audio_fifo.dtype})"
+      )
+    self._audio_fifo.push_sound(sound)
+    if self._audio_frame_size is None:
+      # Opened here rather than on the first `encode` to learn its frame size, after `enable_threading` had its chance
+      self.audio_stream.codec_context.open(strict=False)
+      self._audio_frame_size = self.audio_stream.codec_context.frame_size
+    row_frame_size = self._audio_frame_size * self._audio_row_samples
+    if row_frame_size == 0:
+      self._encode_audio(self._audio_fifo.num_samples)
+    else:
+      while self._audio_fifo.num_samples >= row_frame_size:
+        self._encode_audio(row_frame_size)
+
+  def _encode_audio(self, num_row_samples: int, *, pad_to: int = 0) -> None:
+    """
+    Encode the first `num_row_samples` samples of the FIFO as one frame, padded with silence up to `pad_to` samples.
+    Frames are timestamped by the number of samples sent so far.
+    """
+    if num_row_samples == 0:
+      return
+    samples = self._audio_fifo.peek(num_row_samples).samples
+    if pad_to > num_row_samples:
+      samples = np.pad(samples, ((0, 0), (0, pad_to - num_row_samples)))
+    # `from_ndarray` copies the samples, the encoder may keep a reference to the frame's buffer
+    frame = av.AudioFrame.from_ndarray(samples, format=self._audio_format.name, layout=self._audio_layout)
     frame.rate = self.audio_stream.rate
-    self.container.mux(self.audio_stream.encode(frame))
+    frame.pts = self.num_audio_samples
+    frame.time_base = self._audio_time_base
+    self._audio_fifo.skip(num_row_samples)
+    self.num_audio_samples += frame.samples
+    with self.timing("encode_audio"):
+      self._pending.extend(self.audio_stream.encode(frame))
+
+  def _mux(self, packets: list[av.Packet]) -> None:
+    if self._pending:
+      packets = self._pending + packets
+      self._pending = []
+    # The pts of encoded video packets are the output pts given by `write_video_frame`, until they are muxed
+    written = [packet.pts for packet in packets if packet.stream.type == "video"]
+    # Source pts of the frames of the packets, to mark in `latency` once they are written
+    keys = [self._source_pts.pop(pts) for pts in written if pts in self._source_pts]
+    with self.timing("mux"):
+      if self.fanout is not None:
+        # Muxed in the outputs' threads, which mark the latency themselves
+        self.fanout.send(packets, latency_keys=keys)
+        keys = []
+      else:
+        self.container.mux(packets)
+        if self.flush_handle is not None and packets and (self.flush_always or not self._wrote_video):
+          self.flush_handle.flush()
+    if written:
+      self._wrote_video = True
+    if self.latency is not None:
+      for key in keys:
+        self.latency.mark_written(key)
 
-  def write_video_frame(self, frame: av.VideoFrame) -> None:
+  def write_video_frame(self, frame: av.VideoFrame, *, source_pts: Optional[int] = None) -> None:
+    """
+    :param source_pts: pts of the frame in the source, identifies it for `latency`
+    """
     assert isinstance(frame, av.VideoFrame)
-    self.container.mux(self.video_stream.encode(frame))
+    if self.latency is not None and source_pts is not None:
+      self._source_pts[self.num_video_frames] = source_pts
+    # `frame` may come straight from a decoder, so restamp it as the next frame of the output and drop the decoder's
+    # picture type, which the encoder would otherwise take as a forced frame type
+    frame.pts = self.num_video_frames
+    frame.time_base = self.video_stream.codec_context.time_base
+    frame.pict_type = av.video.frame.PictureType.NONE
+    self.num_video_frames += 1
+    with self.timing("encode_video"):
+      packets = self.video_stream.encode(frame)
+    self._mux(packets)
+    if self.stats is not None:
+      self.stats.count_output()
+
+  def flush(self) -> None:
+    # Encode the audio left in the FIFO, as a last frame padded to the encoder's frame size
+    self._encode_audio(self._audio_fifo.num_samples, pad_to=(self._audio_frame_size or 0) * self._audio_row_samples)
+    # Drain the frames still buffered in the encoders
+    self._mux(self.video_stream.encode(None))
+    self._mux(self.audio_stream.encode(None))
+
+class CopySink:
+  """
+  Muxes already encoded packets into streams copied from a source, without re-encoding.
+  """
+  def __init__(
+    self,
+    *,
+    container: av.OutputContainer,
+    video_stream: av.VideoStream,
+    audio_stream: av.AudioStream,
+    ):
+    self.container = container
+    self.video_stream = video_stream
+    self.audio_stream = audio_stream
+    self._last_dts: dict[str, int] = {}
+
+  def write_packet(self, packet: av.Packet, *, offset: float = 0.0) -> None:
+    """
+    Mux `packet`, moving its timestamps `offset` seconds earlier. `packet` must come from a stream like the ones this
+    sink was opened like.
+    """
+    kind = packet.stream.type
+    shift = round(offset / packet.time_base)
+    if packet.dts is not None:
+      dts = packet.dts - shift
+    elif kind in self._last_dts:
+      dts = self._last_dts[kind] + 1 # demuxers may leave the dts of the first video packets unset
+    else:
+      dts = packet.pts - shift
+    if kind in self._last_dts and dts <= self._last_dts[kind]:
+      dts = self._last_dts[kind] + 1 # keep dts strictly increasing across splices
+    if packet.pts is not None:
+      packet.pts = max(packet.pts - shift, dts)
+    packet.dts = dts
+    self._last_dts[kind] = dts
+
+    packet.stream = self.video_stream if kind == "video" else self.audio_stream
+    self.container.mux(packet)
+
+def is_seekable(handle: BinaryIO) -> bool:
+  try:
+    return handle.seekable()
+  except (AttributeError, ValueError, OSError):
+    return False
 
 class Writer(abc.ABC):
   @abc.abstractmethod
@@ -56,22 +256,78 @@ class Writer(abc.ABC):
 
 class HandleWriter(Writer):
   STDOUT = sys.stdout.buffer
-  def __init__(self, handle: BinaryIO, *, format: Optional[str] = None) -> None:
+  def __init__(
+    self,
+    handle: BinaryIO,
+    *,
+    format: Optional[str] = None,
+    latency_profile: str = "quality",
+    latency: Optional[LatencyMeter] = None,
+    scale: Optional[float] = None,
+    max_height: Optional[int] = None,
+    fps: Optional[float] = None,
+  ) -> None:
+    """
+    :param latency_profile: Name of the `LatencyProfile` configuring the encoder and muxer
+    :param latency: If set, measure the latency of each video frame with it
+    :param scale: If set, scale the video down by this factor, see `output_size`
+    :param max_height: If set, scale the video down to at most this height, see `output_size`
+    :param fps: If set, decimate the video to at most this frame rate, see `output_rate`
+    """
     self.handle = handle
     self.format = format
+    self.profile = LATENCY_PROFILES[latency_profile]
+    self.latency = latency
+    self.scale = scale
+    self.max_height = max_height
+    self.fps = fps
 
   @contextlib.contextmanager
-  def open_like(self, source: Source) -> ContextManager[Sink]:
+  def open_copy_like(self, source: Source) -> ContextManager[CopySink]:
     container: av.OutputContainer = av.open(self.handle, format=self.format, mode="w")
+    yield CopySink(
+      container = container,
+      video_stream = container.add_stream(template=source.video_stream),
+      audio_stream = container.add_stream(template=source.audio_stream),
+    )
+    container.close()
+
+  def open_container(self) -> tuple[av.OutputContainer, bool]:
+    """
+    Open an output container on the handle. Also tell whether the handle is a pipe rather than a seekable file.
+    """
+    container_options = dict(self.profile.container_options)
+    piped = not is_seekable(self.handle)
+    if piped:
+      # Hand the header and every packet to the handle as soon as they are muxed, rather than once FFmpeg's output
+      # buffer is full, so that whatever reads the pipe can start right away
+      container_options.setdefault("flush_packets", "1")
+    container: av.OutputContainer = av.open(
+      self.handle,
+      format = self.format,
+      mode = "w",
+      container_options = container_options,
+    )
+    # The format may have been guessed from the handle's name, so its own options are only known now. They are read
+    # when the header is written, which has not happened yet
+    for key, value in self.profile.format_container_options.get(container.format.name, {}).items():
+      container.container_options.setdefault(key, value)
+    return container, piped
 
+  def add_encoder_streams(self, container: av.OutputContainer, source: Source) -> tuple[av.VideoStream, av.AudioStream]:
+    # `vq.cut` scales and decimates the frames to what the encoder is opened with, see `Sink.video_rate`
+    rate = output_rate(source.video_stream.average_rate, self.fps)
+    width, height = output_size(source.video_stream.width, source.video_stream.height, scale=self.scale, max_height=self.max_height)
+    codec_name = source.video_stream.codec_context.codec.name
+    video_options = self.profile.video_options_for(av.codec.Codec(codec_name, "w").name)
+    if self.profile.gop_seconds is not None:
+      video_options["g"] = str(max(1, round(self.profile.gop_seconds * rate)))
     video_stream = container.add_stream(
-      source.video_stream.codec_context.codec.name,
-      rate   = source.video_stream.average_rate,
-      width  = source.video_stream.width,
-      height = source.video_stream.height,
-      options = {
-        "crf": "18", # Output high quality images
-      }
+      codec_name,
+      rate   = rate,
+      width  = width,
+      height = height,
+      options = video_options,
     )
     audio_stream = container.add_stream(
       source.audio_stream.codec_context.codec.name,
@@ -80,14 +336,286 @@ class HandleWriter(Writer):
         "strict": "-2", # Enable support for experimental codecs like `opus`
       }
     )
+    return video_stream, audio_stream
+
+  @contextlib.contextmanager
+  def open_like(self, source: Source) -> ContextManager[Sink]:
+    container, piped = self.open_container()
+    video_stream, audio_stream = self.add_encoder_streams(container, source)
 
     # FIXME: doing try/finally sometimes makes the program unkillable by Ctrl-C for some reason.
     # try:
-    yield Sink(
+    sink = Sink(
       container = container,
       video_stream = video_stream,
       audio_stream = audio_stream,
+      flush_handle = self.handle if self.profile.flush_handle or piped else None,
+      flush_always = self.profile.flush_handle,
+      latency = self.latency,
     )
+    yield sink
+    sink.flush()
+    container.close()
 
     # finally:
     #   container.close()
+
+def copy_packet(packet: av.Packet, stream: av.stream.Stream) -> av.Packet:
+  """
+  Copy `packet` for muxing into `stream` of another container, as muxing a packet takes its data out of it.
+  """
+  copy = av.Packet(bytes(packet))
+  copy.pts = packet.pts
+  copy.dts = packet.dts
+  copy.duration = packet.duration
+  copy.time_base = packet.time_base
+  copy.is_keyframe = packet.is_keyframe
+  copy.stream = stream
+  return copy
+
+class OutputMuxer:
+  """
+  Muxes packets into one container in a thread of its own, behind a queue of at most `max_buffered_bytes` of packets.
+  When the queue is full, an output that waits holds up whoever sends packets until there is room, as a file should;
+  other outputs drop packets until the next video keyframe that fits, so that a player that paused or fell behind skips
+  ahead instead. An output whose muxing fails is given up on, and drops all packets from then on.
+  """
+  def __init__(
+    self,
+    container: av.OutputContainer,
+    *,
+    name: str,
+    video_stream: av.VideoStream,
+    audio_stream: av.AudioStream,
+    max_buffered_bytes: int,
+    wait: bool,
+    flush_handle: Optional[BinaryIO] = None,
+    flush_always: bool = True,
+    latency: Optional[LatencyMeter] = None,
+  ) -> None:
+    """
+    :param flush_handle: See `Sink`
+    :param flush_always: See `Sink`
+    :param latency: If set, mark the frames given to `send` as written once their packets are muxed
+    """
+    self.container = container
+    self.name = name
+    self.streams = {"video": video_stream, "audio": audio_stream}
+    self.max_buffered_bytes = max_buffered_bytes
+    self.wait = wait
+    self.flush_handle = flush_handle
+    self.flush_always = flush_always
+    self.latency = latency
+    self.buffered_bytes = 0 # of the packets sent and not muxed yet
+    self.num_dropped = 0 # packets
+    self.error: Optional[BaseException] = None
+    self._queue: Deque[tuple[list[av.Packet], int, Sequence[int]]] = collections.deque()
+    self._cond = threading.Condition()
+    self._closing = False
+    self._aborted = False
+    self._skipping = False # dropping packets until the next video keyframe
+    self._wrote_video = False
+    self._thread = threading.Thread(target=self._run, name=f"mux-{name}", daemon=True)
+    self._thread.start()
+
+  def send(self, packets: list[av.Packet], *, latency_keys: Sequence[int] = ()) -> None:
+    """
+    :param latency_keys: Source pts of the video frames of `packets`, see `latency`
+    """
+    with self._cond:
+      if self.error is not None:
+        return
+      if self._skipping:
+        keyframes = [i for i, packet in enumerate(packets) if packet.stream.type == "video" and packet.is_keyframe]
+        self.num_dropped += keyframes[0] if keyframes else len(packets)
+        packets = packets[keyframes[0]:] if keyframes else []
+      size = sum(packet.size for packet in packets)
+      if self._queue and self.buffered_bytes + size > self.max_buffered_bytes:
+        if self.wait:
+          while self._queue and self.buffered_bytes + size > self.max_buffered_bytes and self.error is None:
+            self._cond.wait()
+          if self.error is not None:
+            return
+        else:
+          if not self._skipping:
+            logger.warning(f"output {self.name} is {self.buffered_bytes / 2**20:.1f}MiB behind, skipping it to the next keyframe")
+          self._skipping = True
+          self.num_dropped += len(packets)
+          return
+      if packets:
+        self._skipping = False
+        self._queue.append((packets, size, latency_keys))
+        self.buffered_bytes += size
+        self._cond.notify_all()
+
+  def _run(self) -> None:
+    while True:
+      with self._cond:
+        while not self._queue and not self._closing:
+          self._cond.wait()
+        if not self._queue:
+          return
+        packets, size, latency_keys = self._queue[0]
+      try:
+        self.container.mux(packets)
+        if self.flush_handle is not None and (self.flush_always or not self._wrote_video):
+          self.flush_handle.flush()
+        self._wrote_video = self._wrote_video or any(packet.stream.type == "video" for packet in packets)
+        if self.latency is not None:
+          for key in latency_keys:
+            self.latency.mark_written(key)
+      except BaseException as e:
+        logger.error(f"giving up on output {self.name}: {type(e).__name__}: {e}")
+        with self._cond:
+          self.error = e
+          self._queue.clear()
+          self.buffered_bytes = 0
+          self._cond.notify_all()
+        return
+      with self._cond:
+        if self._aborted:
+          return # the queue was cleared while muxing
+        self._queue.popleft()
+        self.buffered_bytes -= size
+        self._cond.notify_all()
+
+  def close(self) -> None:
+    """
+    Mux what is left in the queue and close the container.
+    """
+    with self._cond:
+      self._closing = True
+      self._cond.notify_all()
+    self._thread.join()
+    if self.num_dropped > 0:
+      logger.warning(f"output {self.name} skipped {self.num_dropped} packets while behind")
+    if self.error is None:
+      try:
+        self.container.close()
+      except BaseException as e:
+        logger.error(f"closing output {self.name} failed: {type(e).__name__}: {e}")
+        self.error = e
+
+  def abort(self) -> None:
+    """
+    Stop muxing, dropping what is left in the queue, and wait for the thread to finish. The container is left as is.
+    """
+    with self._cond:
+      self._closing = True
+      self._aborted = True
+      self._queue.clear()
+      self.buffered_bytes = 0
+      self._cond.notify_all()
+    self._thread.join(ABORT_TIMEOUT)
+    if self._thread.is_alive():
+      logger.warning(f"output {self.name} is still muxing, leaving it behind")
+
+class Fanout:
+  """
+  Hands the packets of a single encoding to several `OutputMuxer`s. The container of the first one holds the
+  encoders' streams and muxes the packets themselves, the others mux copies into streams made like the source's, which
+  take the encoders' parameters once they are open.
+  """
+  def __init__(self, outputs: list[OutputMuxer]) -> None:
+    self.outputs = outputs
+    self._prepared = False
+
+  def send(self, packets: list[av.Packet], *, latency_keys: Sequence[int] = ()) -> None:
+    """
+    :param latency_keys: See `OutputMuxer.send`, only the first output marks them
+    """
+    if not packets:
+      return
+    owner, *others = self.outputs
+    if not self._prepared:
+      # The encoders are open once there are packets, and the other containers only start with their first packet
+      for output in others:
+        for kind, stream in output.streams.items():
+          copy_codec_parameters(owner.streams[kind].codec_context, stream.codec_context)
+      self._prepared = True
+    # The copies are made first, as muxing the packets takes their data
+    for output in others:
+      if output.error is None:
+        output.send([copy_packet(packet, output.streams[packet.stream.type]) for packet in packets])
+    owner.send(packets, latency_keys=latency_keys)
+    if all(output.error is not None for output in self.outputs):
+      raise SinkError("all outputs failed") from owner.error
+
+  def close(self) -> None:
+    for output in self.outputs:
+      output.close()
+    if all(output.error is not None for output in self.outputs):
+      raise SinkError("all outputs failed") from self.outputs[0].error
+
+def copy_codec_parameters(encoder: av.codec.context.CodecContext, context: av.codec.context.CodecContext) -> None:
+  context.extradata = encoder.extradata
+  if encoder.type == "video":
+    context.width = encoder.width
+    context.height = encoder.height
+    context.pix_fmt = encoder.pix_fmt
+  else:
+    context.rate = encoder.rate
+
+class TeeWriter(Writer):
+  """
+  Writes a single encoding to the handles of several `HandleWriter`s, e.g. to a player on stdout and to a file. The
+  first writer's latency profile configures the encoders, each writer's own its container.
+
+  Each output is muxed in a thread of its own, at most `max_buffered_bytes` of packets behind the encoders, see
+  `OutputMuxer`: outputs to files hold up encoding when they are that far behind, outputs to pipes skip ahead to the
+  next keyframe. Outputs that fail are given up on while the others go on. The first writer's latency meter measures up
+  to when packets are written to its output.
+  """
+  def __init__(self, writers: Sequence[HandleWriter], *, max_buffered_bytes: int = DEFAULT_OUTPUT_BUFFER_SIZE) -> None:
+    assert len(writers) > 0
+    self.writers = writers
+    self.max_buffered_bytes = max_buffered_bytes
+
+  @contextlib.contextmanager
+  def open_like(self, source: Source) -> ContextManager[Sink]:
+    first = self.writers[0]
+    outputs: list[OutputMuxer] = []
+    closed = False
+    try:
+      for i, writer in enumerate(self.writers):
+        container, piped = writer.open_container()
+        if i == 0:
+          video_stream, audio_stream = writer.add_encoder_streams(container, source)
+        else:
+          # Made like the source's streams, as streams made like the encoders' would open encoders of their own
+          video_stream = container.add_stream(template=source.video_stream)
+          audio_stream = container.add_stream(template=source.audio_stream)
+        outputs.append(OutputMuxer(
+          container,
+          name = getattr(writer.handle, "name", str(i)),
+          video_stream = video_stream,
+          audio_stream = audio_stream,
+          max_buffered_bytes = self.max_buffered_bytes,
+          wait = not piped,
+          flush_handle = writer.handle if writer.profile.flush_handle or piped else None,
+          flush_always = writer.profile.flush_handle,
+          latency = first.latency if i == 0 else None,
+        ))
+      # Only the first container sets whether the encoders put their headers in the extradata rather than in the
+      # stream, from its own format. The others get the extradata, so it must be there if any of their formats needs it
+      # (e.g. an mp4 file alongside mpegts on stdout). Formats that do not read it (mpegts) insert it in front of keyframes
+      if any(output.container.format.global_header for output in outputs):
+        for stream in outputs[0].streams.values():
+          stream.codec_context.global_header = True
+      fanout = Fanout(outputs)
+      sink = Sink(
+        container = outputs[0].container,
+        video_stream = outputs[0].streams["video"],
+        audio_stream = outputs[0].streams["audio"],
+        latency = first.latency,
+        fanout = fanout,
+      )
+      yield sink
+      sink.flush()
+      closed = True
+      fanout.close()
+    finally:
+      if not closed:
+        # Failed or interrupted, the muxer threads are stopped rather than left waiting for packets
+        for output in outputs:
+          output.abort()
@@ -1,6 +1,6 @@
 from __future__ import annotations
 from typing import *
-from .utils import calculate_dbfs
+from .utils import calculate_dbfs, calculate_dbfs_batch
 import numpy as np
 import logging
 
@@ -8,6 +8,7 @@ logger = logging.getLogger(__name__)
 
 __all__ = [
   "Sound",
+  "SoundBuffer",
 ]
 
 def cross_func(xs: np.ndarray) -> np.ndarray:
@@ -49,6 +50,16 @@ class Sound:
   def dbfs(self) -> float:
     return calculate_dbfs(self.samples)
 
+  @staticmethod
+  def batch_dbfs(sounds: list[Sound]) -> np.ndarray:
+    """
+    dBFS of each of `sounds`, computed in one vectorized pass. Equal to `[sound.dbfs() for sound in sounds]`.
+    """
+    if len(sounds) == 1:
+      return np.array([sounds[0].dbfs()])
+    offsets = np.cumsum([0] + [sound.num_samples for sound in sounds[:-1]])
+    return calculate_dbfs_batch(Sound.concatenate(sounds).samples, offsets)
+
   @staticmethod
   def concatenate(sounds: list[Sound]) -> Sound:
     concatenated_samples = np.concatenate([sound.samples for sound in sounds], axis=-1)
@@ -62,4 +73,102 @@ class Sound:
     dtype: np.dtype,
   ) -> Sound:
     samples = np.empty((num_channels, num_samples), dtype=dtype)
-    return Sound(samples)
\ No newline at end of file
+    return Sound(samples)
+
+class SoundBuffer:
+  """
+  A growable multi-channel ring buffer of samples.
+
+  Pushing and reading samples is amortized O(num_samples): the backing array is only reallocated when it
+  runs out of capacity (doubling each time), never on every push.
+  """
+  def __init__(
+    self,
+    *,
+    num_channels: int,
+    dtype: np.dtype,
+    capacity: int = 4096,
+  ) -> None:
+    self._data = np.empty((num_channels, max(1, capacity)), dtype=dtype)
+    self._start = 0
+    self._size = 0
+
+  @property
+  def num_channels(self) -> int:
+    return self._data.shape[0]
+
+  @property
+  def num_samples(self) -> int:
+    return self._size
+
+  @property
+  def capacity(self) -> int:
+    return self._data.shape[1]
+
+  @property
+  def dtype(self) -> np.dtype:
+    return self._data.dtype
+
+  def push(self, samples: np.ndarray) -> None:
+    # Assigning into the buffer would silently cast other dtypes and broadcast a single channel to all of them
+    if samples.dtype != self.dtype:
+      raise ValueError(f"cannot push {samples.dtype} samples into a {self.dtype} buffer")
+    if samples.ndim != 2 or samples.shape[0] != self.num_channels:
+      raise ValueError(f"cannot push samples of shape {samples.shape} into a buffer of {self.num_channels} channels")
+    num_samples = samples.shape[1]
+    if self._size + num_samples > self.capacity:
+      self._grow(self._size + num_samples)
+    end = (self._start + self._size) % self.capacity
+    first = min(num_samples, self.capacity - end)
+    self._data[:, end:end + first] = samples[:, :first]
+    self._data[:, :num_samples - first] = samples[:, first:]
+    self._size += num_samples
+
+  def push_sound(self, sound: Sound) -> None:
+    self.push(sound.samples)
+
+  def peek(self, num_samples: int) -> Sound:
+    """
+    Return the first `num_samples` samples without consuming them.
+
+    The result is a zero-copy view into the buffer whenever the samples do not wrap around the end of the
+    ring, so it is only valid until the next `push`.
+    """
+    assert num_samples <= self._size
+    end = self._start + num_samples
+    if end <= self.capacity:
+      return Sound(self._data[:, self._start:end])
+    out = np.empty((self.num_channels, num_samples), dtype=self.dtype)
+    self._copy_into(out)
+    return Sound(out)
+
+  def read(self, num_samples: int) -> Sound:
+    """
+    Consume the first `num_samples` samples and return them as a newly allocated `Sound`.
+    """
+    assert num_samples <= self._size
+    out = np.empty((self.num_channels, num_samples), dtype=self.dtype)
+    self._copy_into(out)
+    self.skip(num_samples)
+    return Sound(out)
+
+  def skip(self, num_samples: int) -> None:
+    assert num_samples <= self._size
+    self._size -= num_samples
+    self._start = 0 if self._size == 0 else (self._start + num_samples) % self.capacity
+
+  def clear(self) -> None:
+    self._start = 0
+    self._size = 0
+
+  def _copy_into(self, out: np.ndarray) -> None:
+    num_samples = out.shape[1]
+    first = min(num_samples, self.capacity - self._start)
+    out[:, :first] = self._data[:, self._start:self._start + first]
+    out[:, first:] = self._data[:, :num_samples - first]
+
+  def _grow(self, min_capacity: int) -> None:
+    data = np.empty((self.num_channels, max(2 * self.capacity, min_capacity)), dtype=self.dtype)
+    self._copy_into(data[:, :self._size])
+    self._data = data
+    self._start = 0
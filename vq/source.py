@@ -1,5 +1,6 @@
 from __future__ import annotations
 from typing import *
+from .prefetch import PrefetchReader, PrefetchStats
 from dataclasses import dataclass
 import abc
 import subprocess
@@ -7,6 +8,7 @@ import contextlib
 import av
 import io
 import datetime
+import logging
 
 __all__ = [
   "SourceError",
@@ -18,6 +20,12 @@ __all__ = [
   "YtdlProcessError",
 ]
 
+logger = logging.getLogger(__name__)
+
+# Seek this many seconds before a keyframe that decoding must start from, so that the audio of the first frames after it
+# is demuxed too
+SEEK_MARGIN = 1.0
+
 class SourceError(Exception):
   pass
 
@@ -33,17 +41,128 @@ class Source:
     self.video_stream = video_stream
     self.audio_stream = audio_stream
     self._decoded: bool = False
+    # Range of the input to process, in seconds of the streams' timestamps like `frame.time`, see `set_range`
+    self.start: Optional[float] = None
+    self.end: Optional[float] = None
 
-  def enable_threading(self) -> None:
+  def enable_threading(self, thread_count: int = 0) -> None:
+    """
+    :param thread_count: Number of threads per codec, 0 lets the codecs decide
+    """
     self.video_stream.thread_type = "AUTO"
     self.audio_stream.thread_type = "AUTO"
+    self.video_stream.thread_count = thread_count
+    self.audio_stream.thread_count = thread_count
 
   def decode(self) -> Generator[av.VideoFrame | av.AudioFrame]:
     # This function can only be called once
     #   self._decoded is used for keep track of that
     assert not self._decoded
     self._decoded = True
-    return self.container.decode(self.audio_stream, self.video_stream)
+    frames = self.container.decode(self.audio_stream, self.video_stream)
+    if self.start is None and self.end is None:
+      return frames
+    return self.trim(frames)
+
+  def demux(self) -> Generator[av.Packet]:
+    # Like `decode`, this function can only be called once
+    assert not self._decoded
+    self._decoded = True
+    return self.container.demux(self.audio_stream, self.video_stream)
+
+  def seek(self, pts: int) -> None:
+    """
+    Seek to the last video keyframe at or before `pts` (in the video stream's time base). Only works on seekable inputs.
+    """
+    self.container.seek(pts, stream=self.video_stream, backward=True)
+    self._decoded = False
+
+  def set_range(self, start: Optional[float] = None, end: Optional[float] = None) -> None:
+    """
+    Only process the part of the input from `start` to `end` seconds after the start of its video (`start_time`), as
+    `YtdlReader` does. Seeks to the last keyframe before `start`, after which `decode` (and `trim`) discards the frames
+    before `start` and stops after `end`. Audio before `start` is kept for `Chunker.start_at_first_video_frame` to align
+    with the video.
+    """
+    self.start = None if start is None else self.start_time + start
+    self.end = None if end is None else self.start_time + end
+    if self.start is not None:
+      self.seek(int(self.start / self.video_stream.time_base))
+
+  def trim(self, frames: Iterable[av.VideoFrame | FrameStub | av.AudioFrame]) -> Generator[av.VideoFrame | FrameStub | av.AudioFrame]:
+    """
+    Restrict `frames` to the range given to `set_range`. Stops pulling `frames` once past `end`.
+    """
+    video_done = False
+    for frame in frames:
+      if isinstance(frame, av.AudioFrame):
+        if self.end is not None and frame.time >= self.end:
+          if video_done:
+            break
+          continue
+      else:
+        if self.start is not None and frame.time < self.start:
+          continue
+        if self.end is not None and frame.time >= self.end:
+          # The audio of the last video frames may still be to come
+          video_done = True
+          continue
+      yield frame
+
+  def rewind(self) -> None:
+    """
+    Seek back to the start of the container so that it can be decoded/demuxed again. Only works on seekable inputs.
+    """
+    # Seeking to 0 skips whatever starts before it, like the priming frame of AAC audio at a negative pts, so this seeks
+    # on the stream that starts first to its start instead
+    streams = [stream for stream in self.container.streams if stream.start_time is not None]
+    if streams:
+      first = min(streams, key=lambda stream: stream.start_time * stream.time_base)
+      self.container.seek(first.start_time, stream=first)
+    else:
+      self.container.seek(0)
+    self._decoded = False
+
+  @property
+  def num_vframes(self) -> Optional[int]:
+    """
+    The (LIKELY) number of video frames, or None if unknown (e.g. for live streams). Containers like Matroska do not
+    store it, in which case it is estimated from the duration.
+    """
+    if self.start is not None or self.end is not None:
+      duration = self.duration
+      if duration is None and self.end is None:
+        return None
+      start = self.start if self.start is not None else self.start_time
+      stream_end = None if duration is None else self.start_time + duration
+      end = self.end if stream_end is None else min(self.end or stream_end, stream_end)
+      return max(0, round((end - start) * self.video_stream.average_rate))
+    if self.video_stream.frames:
+      return self.video_stream.frames
+    duration = self.duration
+    if duration is None:
+      return None
+    return round(duration * self.video_stream.average_rate)
+
+  @property
+  def start_time(self) -> float:
+    """
+    Time of the first video frame in seconds, which is not 0 in some containers (e.g. MPEG-TS).
+    """
+    if self.video_stream.start_time is None:
+      return 0.0
+    return float(self.video_stream.start_time * self.video_stream.time_base)
+
+  @property
+  def duration(self) -> Optional[float]:
+    """
+    Duration of the video in seconds, or None if unknown.
+    """
+    if self.video_stream.duration is not None:
+      return float(self.video_stream.duration * self.video_stream.time_base)
+    if self.container.duration is not None:
+      return self.container.duration / av.time_base
+    return None
 
   @staticmethod
   def from_container(container: av.InputContainer) -> Source:
@@ -68,14 +187,23 @@ class Reader(abc.ABC):
     pass
 
 class FileReader(Reader):
-  def __init__(self, path: str) -> None:
+  def __init__(self, path: str, *, start: Optional[float] = None, end: Optional[float] = None) -> None:
+    """
+    :param start: If set, seek to this many seconds into the file, see `Source.set_range`
+    :param end: If set, stop at this many seconds into the file
+    """
     self.path = path
+    self.start = start
+    self.end = end
 
   @contextlib.contextmanager
   def open(self) -> ContextManager[Source]:
     container = av.open(self.path)
     try:
-      yield Source.from_container(container)
+      source = Source.from_container(container)
+      if self.start is not None or self.end is not None:
+        source.set_range(self.start, self.end)
+      yield source
     finally:
       container.close()
 
@@ -91,9 +219,30 @@ class YtdlReader(Reader):
     url: str,
     *,
     command = "yt-dlp",
+    prefetch_size: int = 0,
+    prefetch_dir: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    probe_size: Optional[int] = None,
+    analyze_duration: Optional[float] = None,
   ) -> None:
+    """
+    :param start: If set, only download from this many seconds into the video (with yt-dlp's --download-sections)
+    :param end: If set, only download up to this many seconds into the video
+    :param prefetch_size: If positive, read up to this many bytes ahead of the decoder in a background thread, which absorbs network stalls of the download
+    :param prefetch_dir: If set, keep the prefetched bytes in a temporary file in this directory instead of memory
+    :param probe_size: If set, read at most this many bytes of the download to detect its streams, instead of FFmpeg's default of 5MB
+    :param analyze_duration: If set, read at most this many seconds of the download to detect its streams, instead of FFmpeg's default of 5s
+    """
     self.url = url
     self.command = command
+    self.prefetch_size = prefetch_size
+    self.prefetch_dir = prefetch_dir
+    self.start = start
+    self.end = end
+    self.probe_size = probe_size
+    self.analyze_duration = analyze_duration
+    self.prefetch_stats: Optional[PrefetchStats] = None # of the latest `open`
 
   @contextlib.contextmanager
   def open(self) -> ContextManager[Source]:
@@ -102,8 +251,11 @@ class YtdlReader(Reader):
       "--quiet",
       "--output", "-", # output to stdout for subprocess.PIPE
       "--no-playlist", # avoid downloading the entire playlist if the video link includes the playlist id
-      self.url,
     ]
+    if self.start is not None or self.end is not None:
+      # yt-dlp cuts the download itself, so the source then starts at the range's start
+      args += ["--download-sections", f"*{self.start or 0}-{'inf' if self.end is None else self.end}"]
+    args.append(self.url)
 
     try:
       # Open process and capture stdout to read downloaded video data
@@ -111,13 +263,26 @@ class YtdlReader(Reader):
     except FileNotFoundError:
       raise YtdlProcessError(f"'{self.command}' command does not exist. Please install youtube-dl or verify that your PATH configuration is correct.")
 
+    handle = process.stdout
+    if self.prefetch_size > 0:
+      handle = PrefetchReader(process.stdout, capacity=self.prefetch_size, spill_dir=self.prefetch_dir)
+      self.prefetch_stats = handle.stats
     try:
       try:
-        container = av.open(process.stdout)
+        # Decoding only starts once the streams are detected, which takes up to the probing limits of the download
+        container_options = {}
+        if self.probe_size is not None:
+          container_options["probesize"] = str(self.probe_size)
+        if self.analyze_duration is not None:
+          container_options["analyzeduration"] = str(round(self.analyze_duration * 1e6)) # in microseconds
+        container = av.open(handle, container_options=container_options)
         yield Source.from_container(container)
       except av.error.InvalidDataError:
         # it is possible that yt-dlp ends undesirably and prints out random information.
         outs, errs = process.communicate()
         raise YtdlProcessError(f"'{self.command}' command has exited unwantedly.") from None
     finally:
-      process.terminate()
\ No newline at end of file
+      process.terminate()
+      if handle is not process.stdout:
+        handle.close()
+        logger.debug(handle.stats.summary())
\ No newline at end of file
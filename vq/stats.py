@@ -0,0 +1,196 @@
+from __future__ import annotations
+from typing import *
+
+from dataclasses import dataclass
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+__all__ = [
+  "StageStats",
+  "Stats",
+]
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class StageStats:
+  count: int = 0 # number of items produced or calls made
+  seconds: float = 0.0 # cumulative time spent in the stage itself, excluding the stages nested in it
+
+class Stats:
+  """
+  Instrumentation of the stages of `vq.cut`: cumulative time and counts per stage, queue depths, realtime factor and
+  percent cut. Periodically exported to a JSON lines or Prometheus textfile, and optionally shown as a progress bar.
+
+  When timing nested stages in the same thread (e.g. decoding inside chunking), each stage is only accounted the time
+  spent in itself.
+  """
+  def __init__(
+    self,
+    *,
+    path: Optional[str] = None,
+    format: str = "jsonl",
+    interval: float = 5.0,
+    progress: bool = False,
+  ) -> None:
+    """
+    :param path: File to export to, or None to not export
+    :param format: 'jsonl' to append a JSON object per export, 'prometheus' to rewrite a Prometheus textfile
+    :param interval: Seconds between exports
+    :param progress: Show a progress bar of input frames on stderr once `start` is called
+    """
+    assert format in {"jsonl", "prometheus"}
+    self.path = path
+    self.format = format
+    self.interval = interval
+    self.stages: dict[str, StageStats] = {}
+    self.gauges: dict[str, Callable[[], float]] = {}
+    self.frames_in = 0
+    self.frames_out = 0
+    self.media_time = 0.0 # of the latest input frame, in seconds
+    self.start_time = time.monotonic()
+    self._last_export = self.start_time
+    self._export_lock = threading.Lock()
+    self._local = threading.local()
+    self.progress = progress
+    self._progress = None
+    self._progress_n = 0
+
+  def start(self, total_frames: Optional[int] = None) -> None:
+    """
+    Start measuring, expecting `total_frames` input frames if known.
+    """
+    self.start_time = time.monotonic()
+    self._last_export = self.start_time
+    if self.progress:
+      import tqdm
+      self._progress = tqdm.tqdm(total=total_frames, unit="frame", file=sys.stderr, dynamic_ncols=True)
+
+  def stage(self, name: str) -> StageStats:
+    if name not in self.stages:
+      self.stages[name] = StageStats()
+    return self.stages[name]
+
+  @contextlib.contextmanager
+  def timing(self, name: str, *, count: bool = True) -> Iterator[None]:
+    """
+    Time the block as stage `name`, counting it as one call if `count`.
+    """
+    stage = self.stage(name)
+    stack = self._local.__dict__.setdefault("stack", [])
+    entry = [time.perf_counter(), 0.0] # start, time spent in nested stages
+    stack.append(entry)
+    try:
+      yield
+    finally:
+      stack.pop()
+      elapsed = time.perf_counter() - entry[0]
+      stage.seconds += elapsed - entry[1]
+      if count:
+        stage.count += 1
+      if stack:
+        stack[-1][1] += elapsed
+
+  def timed(self, name: str, iterable: Iterable, on_item: Optional[Callable[[Any], None]] = None) -> Generator:
+    """
+    Time the production of every item of `iterable` as stage `name`.
+    """
+    stage = self.stage(name)
+    iterator = iter(iterable)
+    while True:
+      with self.timing(name, count=False):
+        try:
+          item = next(iterator)
+        except StopIteration:
+          return
+      stage.count += 1
+      if on_item is not None:
+        on_item(item)
+      yield item
+
+  def count_input(self, chunk: Any) -> None:
+    self.frames_in += 1
+    self.media_time = chunk.time
+    self.tick()
+
+  def count_output(self) -> None:
+    self.frames_out += 1
+    self.tick()
+
+  def tick(self) -> None:
+    now = time.monotonic()
+    if now - self._last_export < self.interval and self._progress is None:
+      return
+    if not self._export_lock.acquire(blocking=False):
+      return
+    try:
+      if self._progress is not None and self.frames_in != self._progress_n:
+        self._progress.update(self.frames_in - self._progress_n)
+        self._progress_n = self.frames_in
+      if now - self._last_export >= self.interval:
+        self._last_export = now
+        self.export()
+    finally:
+      self._export_lock.release()
+
+  def snapshot(self) -> dict:
+    elapsed = time.monotonic() - self.start_time
+    return {
+      "time": time.time(),
+      "elapsed": elapsed,
+      "frames_in": self.frames_in,
+      "frames_out": self.frames_out,
+      "media_time": self.media_time,
+      "realtime_factor": self.media_time / elapsed if elapsed > 0 else 0.0,
+      "percent_cut": 100 * (1 - self.frames_out / self.frames_in) if self.frames_in > 0 else 0.0,
+      "stages": {name: {"count": stage.count, "seconds": stage.seconds} for name, stage in list(self.stages.items())},
+      "gauges": {name: gauge() for name, gauge in list(self.gauges.items())},
+    }
+
+  def export(self) -> None:
+    if self.path is None:
+      return
+    snapshot = self.snapshot()
+    try:
+      if self.format == "jsonl":
+        with open(self.path, "a") as f:
+          f.write(json.dumps(snapshot) + "\n")
+      else:
+        # Prometheus' textfile collector may read the file at any time, so replace it atomically
+        with open(self.path + ".tmp", "w") as f:
+          f.write(to_prometheus(snapshot))
+        os.replace(self.path + ".tmp", self.path)
+    except OSError as e:
+      logger.warning(f"could not write stats to {self.path}: {e}")
+
+  def close(self) -> None:
+    with self._export_lock:
+      self.export()
+      if self._progress is not None:
+        self._progress.update(self.frames_in - self._progress_n)
+        self._progress.close()
+        self._progress = None
+
+def to_prometheus(snapshot: dict) -> str:
+  lines = []
+  def metric(name: str, kind: str, help: str, samples: list[tuple[str, float]]) -> None:
+    lines.append(f"# HELP vq_{name} {help}")
+    lines.append(f"# TYPE vq_{name} {kind}")
+    for labels, value in samples:
+      lines.append(f"vq_{name}{labels} {value}")
+
+  metric("frames_in_total", "counter", "Input frames processed", [("", snapshot["frames_in"])])
+  metric("frames_out_total", "counter", "Frames written to the output", [("", snapshot["frames_out"])])
+  metric("media_seconds", "gauge", "Time of the latest input frame", [("", snapshot["media_time"])])
+  metric("realtime_factor", "gauge", "Media seconds processed per wall clock second", [("", snapshot["realtime_factor"])])
+  metric("percent_cut", "gauge", "Percentage of the input frames cut", [("", snapshot["percent_cut"])])
+  stages = snapshot["stages"].items()
+  metric("stage_seconds_total", "counter", "Time spent in each stage", [(f'{{stage="{name}"}}', stage["seconds"]) for name, stage in stages])
+  metric("stage_count_total", "counter", "Items produced or calls made by each stage", [(f'{{stage="{name}"}}', stage["count"]) for name, stage in stages])
+  metric("gauge", "gauge", "Instantaneous values such as queue depths", [(f'{{name="{name}"}}', value) for name, value in snapshot["gauges"].items()])
+  return "\n".join(lines) + "\n"
@@ -1,5 +1,6 @@
 from __future__ import annotations
 from typing import *
+import collections
 import datetime
 import itertools
 import av
@@ -9,21 +10,62 @@ import re
 def audio_format_to_dtype(format: av.AudioFormat) -> np.dtype:
   return av.audio.frame.format_dtypes[format.name]
 
+def plane_view(plane: av.video.plane.VideoPlane, height: int, row_bytes: int) -> np.ndarray:
+  """
+  A zero-copy (height, row_bytes) uint8 view of `plane`, without the padding at the end of each line.
+  """
+  return np.frombuffer(plane, dtype=np.uint8).reshape(-1, plane.line_size)[:height, :row_bytes]
+
+def rgb_view(frame: av.VideoFrame) -> np.ndarray:
+  """
+  A zero-copy (height, width, 3) view of an rgb24 `frame`.
+  """
+  assert frame.format.name == "rgb24"
+  return plane_view(frame.planes[0], frame.height, frame.width * 3).reshape(frame.height, frame.width, 3)
+
 def center_viewed(iterable, radius: int):
-  window = []
+  # The yielded window is only valid until the next item is requested
   view_size = radius * 2 + 1
+  window = collections.deque(maxlen=view_size)
   for item in itertools.chain([None] * radius, iterable, [None] * radius):
     window.append(item)
     if len(window) == view_size:
       yield window
-      window.pop(0)
+
+def batched(iterable: Iterable, n: int) -> Iterator[list]:
+  iterator = iter(iterable)
+  while batch := list(itertools.islice(iterator, n)):
+    yield batch
 
 def calculate_dbfs(samples: np.ndarray) -> float:
   with np.errstate(divide='ignore'):
-    power = np.max(np.square(samples))
+    # The peak amplitude is squared instead of taking the peak of the squared samples, which avoids a temporary array
+    # and gives the same power: rounding the squares keeps them in the order of the amplitudes
+    high, low = np.max(samples), np.min(samples)
+    if np.issubdtype(samples.dtype, np.integer):
+      # In floating point, as negating the most negative integer wraps around and squaring the peak overflows
+      high, low = float(high), float(low)
+    peak = max(high, -low)
+    power = peak * peak
     return -np.inf if power == 0 else 10 * np.log10(power)
     # return 10 * np.log10(np.max(samples ** 2))
 
+def calculate_dbfs_batch(samples: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+  """
+  Vectorized `calculate_dbfs` of the (non-empty) slices `samples[:, offsets[i]:offsets[i + 1]]`, where the last slice
+  extends to the end of `samples`.
+  """
+  high = np.maximum.reduceat(samples, offsets, axis=1).max(axis=0)
+  low = np.minimum.reduceat(samples, offsets, axis=1).min(axis=0)
+  if np.issubdtype(samples.dtype, np.integer):
+    # In floating point, as in `calculate_dbfs`
+    high, low = high.astype(np.float64), low.astype(np.float64)
+  peak = np.maximum(high, -low)
+  power = peak * peak
+  with np.errstate(divide='ignore'):
+    # One slice at a time, as numpy's vectorized log10 of float32 may round differently from the scalar one
+    return np.array([10 * np.log10(slice_power) for slice_power in power])
+
 def format_time(total_seconds: float) -> str:
   h = int(total_seconds // 3600)
   m = int(total_seconds // 60) % 60